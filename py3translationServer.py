@@ -21,7 +21,7 @@ py3translationServer.py:
 - Supports large batch requests.
 - Supports both single process and multiprocess modes.
     - In single process mode, the model is preloaded for low latency inferencing.
-    - In multiprocess mode, the model has significantly longer initial startup time (5 seconds+) but returns all memory allocated once the transaction completes. This is ideal for batch translations and long term operation.
+    - In multiprocess mode, the model is loaded in worker processes that stay warm between requests and are recycled periodically to return their memory to the OS. This is ideal for batch translations and long term operation.
 
 Copyright: github/gdiaz384
 License: AGPLv3, https://www.gnu.org/licenses/agpl-3.0.html
@@ -69,10 +69,16 @@ defaultCTranslate2ModelName='model.bin'
 defaultAddress='localhost'  # localhost has an alias of 127.0.0.1
 defaultPort=14366
 
-# The amount of time, in seconds, that must pass before the next request will trigger writing the cache to disk. Set to low value, like 1 to nearly always write out file.
-#  In some situations, writing the file may take several seconds. A safe minimum amount should be ~10 assuming a healthy disk and low to moderate active I/O.
+# The amount of time, in seconds, between writing new cache entries to disk. This happens in a background thread, so it does not block the server.
+# Only the entries added since the last write are written, so low values, like 1, are fine.
 defaultSaveCacheInterval=60
 
+# cache.csv is compacted, rewritten from scratch, at most this often in seconds. Between compactions, new entries are only appended. 0 means only compact after the cache is cleared.
+defaultCacheCompactionInterval=3600
+
+# The largest file, in MB, that can be uploaded to /api/v1/importCache. Uploads are written to a temporary file as they arrive, not kept in memory.
+defaultImportCacheMaxSize=4096
+
 # The minumum time to wait in between allowing cache to be cleared meaning that cache cannot be cleared within this window of writing it out.
 # Not implemented yet.
 defaultMinimumClearCacheInterval=60
@@ -80,6 +86,29 @@ defaultMinimumClearCacheInterval=60
 # Valid values are True or False. Default=True. Set to False to overwrite cache.csv in-place without creating a copy. Not implemented yet.
 defaultCreateBackupOfCacheFile=True
 
+# Limit the size of the cache kept in memory. 0 means no limit. cacheMaxMemory is in MB and is an estimate.
+# Once over the limit, entries are evicted from memory. With sqlite, evicted entries are still on disk and are read back when requested. With csv, they are kept in cache.csv but are not used again until the next restart.
+defaultCacheMaxEntries=0
+defaultCacheMaxMemory=0
+# Valid values are lru and lfu. lru evicts the least recently used entries. lfu evicts the least frequently used ones among the least recently used entries.
+defaultCacheEvictionPolicy='lru'
+
+# Valid values are csv, sqlite and binary.
+# csv keeps the entire cache in memory and rewrites cache.hash.csv every time it is saved.
+# sqlite stores the cache for all models in a single cache.sqlite3 database, only reads entries into memory when they are needed, and only writes new entries when saving. Any existing cache.hash.csv is imported the first time sqlite is used for a model.
+# binary memory maps a cache.hash.bin snapshot, so startup takes the same time regardless of the size of the cache and entries are only read when they are needed. New entries are appended to a journal until the next compaction. Any existing cache.hash.csv is imported the first time binary is used for a model.
+defaultCacheFormat='csv'
+defaultSqliteCacheFileName='cache.sqlite3'
+
+# Valid values are none and gzip. gzip stores cache.hash.csv as cache.hash.csv.gz and compresses it while it is being written. Translation caches are very repetitive and usually compress 5-10x.
+# This also applies to the cache.csv used to import, export and download the cache with --cacheFormat sqlite or binary. The sqlite database and binary snapshot are never compressed since they are read in place.
+defaultCacheCompression='none'
+# 1 is the fastest and 9 compresses the most. 6 is the usual compromise.
+defaultCacheCompressionLevel=6
+
+# The SHA1 hash of each model file is saved here, in the cache folder, together with the file's size, modification time and inode, so that it is only calculated again when the model changes.
+defaultModelHashFileName='modelHashes.json'
+
 # This is relative to path of main script or the local environment. TODO: The path handling logic should be updated to not break if an absolute path is entered here.
 defaultCacheLocation='resources/cache'
 
@@ -95,6 +124,61 @@ defaultProcessesSpawnTechnique='spawn'
 # fairseq does not play well with multithreading or multiprocessing, so create a toggle to help troubleshooting.
 defaultfairseqMultithreadingEnabled=True
 
+# In multiprocess mode, the model is kept loaded in a pool of worker processes instead of being loaded again for every request.
+# workerPoolSize is the number of worker processes. Each one holds its own copy of the model.
+defaultWorkerPoolSize=1
+# Recycle a worker process after it has handled this many requests, or once it uses more than this many MB of memory, to return its memory to the OS. 0 means no limit. workerMaxMemory requires psutil.
+defaultWorkerMaxRequests=100
+defaultWorkerMaxMemory=0
+# Stop a worker process once it has been idle for this many seconds, so that the model only uses memory, and VRAM, while there are requests to translate. The next request loads the model again. 0 means never.
+defaultWorkerIdleTimeout=300
+# fairseq + CPU sometimes hangs instead of returning. If a worker process has not returned a batch after this many seconds, it is terminated and the request fails. The next request starts a new worker. This includes the time to load the model. 0 means wait forever.
+defaultWorkerRequestTimeout=600
+# With --replicas -1, the number of replicas is the number of usable physical cores divided by this, so each replica gets about this many cores.
+defaultReplicaCores=4
+
+# Concurrent translation requests are merged into a single batch before being sent to fairseq/CTranslate2.
+# batchWindow is the maximum amount of time, in seconds, to wait for more requests after the first one arrives. Set to 0 to only merge requests that are already waiting.
+defaultBatchWindow=0.01
+# Submit the batch early once it contains this many sentences or sentencepiece tokens. 0 means no limit. For fairseq, the token count is approximated by the character count.
+defaultBatchMaxSentences=512
+defaultBatchMaxTokens=0
+
+# Requests with "stream": true or 'Accept: application/x-ndjson' get one JSON object per line as soon as each entry is ready instead of a single list at the end.
+# Cache misses are translated and sent streamChunkSize entries at a time.
+defaultStreamChunkSize=64
+
+# When the model is preloaded, inferenceSlots is the number of batches that can be translated by the model at the same time. CTranslate2 and fairseq already use every core for a single batch, so 1 is usually fastest.
+# Up to inferenceMaxQueue more batches can wait for a free slot. Past that, requests are rejected with HTTP 503 until the backlog clears. 0 means no limit.
+defaultInferenceSlots=1
+defaultInferenceMaxQueue=64
+
+# When the model is preloaded with CTranslate2, the whole batch is tokenized in sub-batches of up to defaultPipelineChunkSize entries in a pool of defaultTokenizerThreads threads, sorted by length and split into tokenBudget buckets. The buckets are then processed as a pipeline: the previous bucket is detokenized while the current one is being translated.
+# With --tokenBudget 0, each bucket is defaultPipelineChunkSize entries of similar length instead.
+defaultPipelineChunkSize=128
+defaultTokenizerThreads=2
+
+# --benchmark replays a corpus file against the model with every combination of the settings below and writes a table of the results instead of starting the server.
+# Each setting can be overridden with --benchmarkSweep. intra_threads defaults to 0 and the number of physical cores. compute_type=default uses whatever the model was converted with.
+defaultBenchmarkSweep='inter_threads=1,16;beam_size=5;batch_size=0;compute_type=default'
+# The corpus is replayed this many times for each combination after one untimed warm up batch.
+defaultBenchmarkRepeats=3
+
+# --autotune measures a few intra_threads/inter_threads combinations with the loaded model at startup and uses the fastest one instead of guessing from the number of physical cores.
+# The result is saved to defaultAutotuneFileName in the cache folder, keyed by model hash, CPU model, number of usable CPUs and device, and reused on later starts. Delete that file, or the entry in it, to measure again.
+defaultAutotuneFileName='autotune.json'
+# The number of entries to translate for each combination. Entries from the cache are used if there are enough of them.
+defaultAutotuneSampleSize=32
+
+# Jobs submitted to /api/v1/jobs are translated one at a time in the background, defaultJobChunkSize entries at a time.
+# Finished, failed and cancelled jobs are forgotten defaultJobRetentionTime seconds after they finish.
+defaultJobChunkSize=256
+defaultJobRetentionTime=86400
+
+# --models is a json file that lists more CTranslate2 models to host in the same server. Requests choose one with "source_lang" and "target_lang". Each model is loaded the first time it is used.
+# Once the models from --models use more than modelMemoryBudget MB, estimated from the size of their files, the least recently used ones are unloaded. 0 means no limit. The model from the command prompt is never unloaded.
+defaultModelMemoryBudget=0
+
 
 # These are internal variable names for fairseq and CTranslate2, so they use a slightly different variable naming scheme.
 # Fairseq documentation and source code:
@@ -133,6 +217,9 @@ default_num_hypotheses=1
 default_no_repeat_ngram_size=3
 # Setting this to True corrupts the output, so leave as False until correct vmap can be built. Update: Added this to CLI instead.
 #default_use_vmap=False
+# The maximum number of sentencepiece tokens to send to translate_batch() at once. Cache misses are sorted by length and split into buckets of about this many tokens, so one very long line does not pad every other line and large requests do not use unpredictable amounts of memory.
+# Passed to CTranslate2 as max_batch_size with batch_type='tokens'. 0 means send everything at once like before.
+default_tokenBudget=4096
 
 
 #Might be an interesting read: https://docs.python.org/3/library/configparser.html
@@ -148,7 +235,20 @@ import time                      # Optional library. Used to calculate performan
 #import date or datetime   # Humm. Could be used to append the current date to the cache backup file as cache.hash.csv.backup.Today.csv
 import signal                   #Sometimes required library. This is needed to send signal.SIGTERM to terminate processes when fairseq + CPU hangs. import conditionally as needed. Also used for UI.
 #import inspect               #Used to print out the name of the current function during execution which is useful when debugging. Import conditionally later.
+import threading              # Used to guard the sqlite cache connection which is shared between the I/O loop and other threads.
+import collections            # OrderedDict keeps translationCacheDictionary in least recently used order.
+import shutil                     # Used to copy cache.csv to cache.csv.backup.
+import uuid                      # Used to create job IDs for /api/v1/jobs.
 import hashlib                 # Used to identify correct cache.csv on disk and also as a psudo-rng function for temporary writes.
+import mmap                     # Used to map cache.hash.bin into memory for --cacheFormat binary.
+import struct                     # Used to read and write the records and index of cache.hash.bin.
+import array                      # Compact lists of integers used while building the index of cache.hash.bin.
+import gzip                        # Used to read and write compressed cache.hash.csv.gz files for --cacheCompression gzip.
+import zlib                         # Used to compress /api/v1/getCache downloads on the fly.
+import heapq                      # Used to pick the next page of cache entries for /api/v1/getCache without sorting all of them.
+import itertools                   # islice() takes cache entries a batch at a time while streaming /api/v1/getCache.
+import io                            # TextIOWrapper decodes files uploaded to /api/v1/importCache while they are parsed.
+import tempfile                  # Files uploaded to /api/v1/importCache are spooled to a temporary file while they are received.
 
 #import fairseq                 # Core engine. Must be installed with 'pip install fairseq' or built from source. Import conditionally later.
 #import ctranslate2           # Core engine. Must be installed with 'pip install ctranslate2'. Import conditionally later.
@@ -159,6 +259,7 @@ import multiprocessing     # Part of standard library. Used for Process, Queue o
 import concurrent.futures # Used to create a process that can work with asynconous I/O. Basically asyncio + multiprocessing.
 import tornado                 # Web server. tornado.escape.json_decode creates Python dictionary from input json. Must be installed with 'pip install tornado'.
 import tornado.web          # This duplicate explicit import improves compatibility with Python versions < 3.8 and pyinstaller.
+import tornado.iostream     # StreamClosedError is raised when a client disconnects during a streamed response.
 try:
     import psutil                 # This library is required for fairseq + CPU + multiprocessing, but technically optional otherwise. This library is also used to optimize CTranslate2 to use the number of physical cores if running on CPU. #Update: It should be possible to remove this requirement by altering the way the new process returns its data to always return the process ID. However, the signal library would still be required and sending signal.SIGTERM to the process might be more complicated, os specific, or unsafe. Update: This is also used to identify and child processes when launching the UI in order to close them during shutdown, so back in required territory.
     psutilAvailable=True
@@ -210,17 +311,48 @@ commandLineParser.add_argument('-tl', '--targetLanguage', help='Two letter targe
 commandLineParser.add_argument('-sspm', '--sourceSentencePieceModel', help='The source sentencepiece model name and path. Default is based on source language.', default=None, type=str)
 commandLineParser.add_argument('-tspm', '--targetSentencePieceModel', help='The target sentencepiece model and path. Default is based on target language.', default=None, type=str)
 
+commandLineParser.add_argument('-m', '--models', help='A json file that lists more CTranslate2 models to host for other language pairs. Requests choose a model with source_lang and target_lang. See the README for the format.', default=None, type=str)
+commandLineParser.add_argument('-mmb', '--modelMemoryBudget', help='The approximate amount of memory, in MB, that models from --models can use before the least recently used ones are unloaded. 0 means no limit. Default=' + str(defaultModelMemoryBudget), default=defaultModelMemoryBudget, type=int)
+
 commandLineParser.add_argument('-pm', '--preloadModel', help='Make the system run out of memory. Default=Disabled.', action='store_true')
-commandLineParser.add_argument('-t', '--cpuThreads', help='Specify the number of CPU threads. Only affects CTranslate2. If the psutil library is available, the default is the number of physical cores. Otherwise without psutil, CTranslate2 will use its internal values. Using psutil requires installing it via: pip install psutil', default=None, type=int)
+commandLineParser.add_argument('-t', '--cpuThreads', help='Specify the number of CPU threads. Only affects CTranslate2. The default is the number of physical cores this process is allowed to use, taking CPU affinity and container CPU limits into account. On Windows, this requires psutil: pip install psutil', default=None, type=int)
+commandLineParser.add_argument('-r', '--replicas', help='For CTranslate2 on CPU without --preloadModel, start this many worker processes, each with the model loaded and pinned to its own group of physical cores. Overrides --workers. -1 means one replica per --replicaCores physical cores. 0 means disabled. Default=0', default=0, type=int)
+commandLineParser.add_argument('-rc', '--replicaCores', help='With --replicas -1, the number of physical cores for each replica. Default=' + str(defaultReplicaCores), default=defaultReplicaCores, type=int)
+commandLineParser.add_argument('-pt', '--pinThreads', help='Restrict the server to one logical CPU per physical core so that threads do not share a core with an SMT sibling. Requires Linux, or psutil on Windows. Default=Disabled.', action='store_true')
+commandLineParser.add_argument('-at', '--autotune', help='For CTranslate2 on CPU, measure a few thread settings at startup and use the fastest one. The result is saved and reused for the same model and CPU. Ignored if --cpuThreads is specified. Default=Disabled.', action='store_true')
 commandLineParser.add_argument('-vm', '--useVMap', help='For CTranslate2, enabe the use of a vocabulary map. Must be named vmap.txt. Default=False.', action='store_true')
+commandLineParser.add_argument('-is', '--inferenceSlots', help='With --preloadModel, the number of batches that can be translated at the same time. Default='+str(defaultInferenceSlots), default=defaultInferenceSlots, type=int)
+commandLineParser.add_argument('-imq', '--inferenceMaxQueue', help='With --preloadModel, the number of batches that can wait for an inference slot before new requests are rejected with HTTP 503. 0 means no limit. Default='+str(defaultInferenceMaxQueue), default=defaultInferenceMaxQueue, type=int)
+commandLineParser.add_argument('-w', '--workers', help='The number of worker processes that keep the model loaded in multiprocess mode. Each worker holds its own copy of the model. Default='+str(defaultWorkerPoolSize), default=defaultWorkerPoolSize, type=int)
+commandLineParser.add_argument('-wmr', '--workerMaxRequests', help='In multiprocess mode, restart a worker process after it has handled this many requests to return its memory to the OS. 0 means never. Default='+str(defaultWorkerMaxRequests), default=defaultWorkerMaxRequests, type=int)
+commandLineParser.add_argument('-wmm', '--workerMaxMemory', help='In multiprocess mode, restart a worker process once it uses more than this many MB of memory. 0 means no limit. Requires psutil. Default='+str(defaultWorkerMaxMemory), default=defaultWorkerMaxMemory, type=int)
+commandLineParser.add_argument('-wrt', '--workerRequestTimeout', help='In multiprocess mode, terminate a worker process that has not returned a batch after this many seconds. 0 means wait forever. Default='+str(defaultWorkerRequestTimeout), default=defaultWorkerRequestTimeout, type=int)
+commandLineParser.add_argument('-wit', '--workerIdleTimeout', help='In multiprocess mode, stop a worker process after this many seconds without requests to return its memory to the OS. The next request loads the model again. 0 means never. Default='+str(defaultWorkerIdleTimeout), default=defaultWorkerIdleTimeout, type=int)
+commandLineParser.add_argument('-bw', '--batchWindow', help='The maximum time, in seconds, to wait for concurrent requests to be merged into a single batch. 0 means only merge requests that are already waiting. Default='+str(defaultBatchWindow), default=defaultBatchWindow, type=float)
+commandLineParser.add_argument('-bms', '--batchMaxSentences', help='Submit a merged batch early once it contains this many sentences. 0 means no limit. Default='+str(defaultBatchMaxSentences), default=defaultBatchMaxSentences, type=int)
+commandLineParser.add_argument('-bmt', '--batchMaxTokens', help='Submit a merged batch early once it contains this many tokens. 0 means no limit. Default='+str(defaultBatchMaxTokens), default=defaultBatchMaxTokens, type=int)
+commandLineParser.add_argument('-tb', '--tokenBudget', help='For CTranslate2, the maximum number of tokens to translate at once. Entries are sorted by length and split into buckets of this size. 0 means no limit. Default='+str(default_tokenBudget), default=default_tokenBudget, type=int)
 commandLineParser.add_argument('-dpm', '--disablePerfMetrics', help='Disable tracking and reporting of performance metrics. Default=Enabled.', action='store_false')
+commandLineParser.add_argument('-bench', '--benchmark', help='Benchmark the model with a text file, one entry per line, and exit instead of starting the server. Only CTranslate2 is supported. See --benchmarkSweep.', default=None, type=str)
+commandLineParser.add_argument('-bsw', '--benchmarkSweep', help='Settings to try with --benchmark as name=value,value;name=value. Valid names are intra_threads, inter_threads, beam_size, batch_size (entries per request, 0 means the whole corpus) and compute_type. Default='+defaultBenchmarkSweep, default=defaultBenchmarkSweep, type=str)
+commandLineParser.add_argument('-brp', '--benchmarkRepeats', help='The number of times to replay the corpus for each combination of settings with --benchmark. Default='+str(defaultBenchmarkRepeats), default=defaultBenchmarkRepeats, type=int)
+commandLineParser.add_argument('-bout', '--benchmarkOutput', help='Where to write the --benchmark results. Default=resources/ctranslate2.benchmarks.computerName.txt', default=None, type=str)
 
 commandLineParser.add_argument('-c', '--cache', help='Toggle cache setting from default. Enabling cache saves the results of the model for future requests. Default=cache is enabled.', action='store_false')
+commandLineParser.add_argument('-cf', '--cacheFormat', help='Specify how cache is stored on disk. Must be csv, sqlite or binary. sqlite and binary only load entries into memory as needed and only write new entries. binary starts the fastest with very large caches. Default='+defaultCacheFormat, default=defaultCacheFormat, type=str)
+commandLineParser.add_argument('-cc', '--cacheCompression', help='Compress cache.csv on disk. Must be none or gzip. Default='+defaultCacheCompression, default=defaultCacheCompression, type=str)
+commandLineParser.add_argument('-cme', '--cacheMaxEntries', help='The maximum number of cache entries to keep in memory. 0 means no limit. Default='+str(defaultCacheMaxEntries), default=defaultCacheMaxEntries, type=int)
+commandLineParser.add_argument('-cmm', '--cacheMaxMemory', help='The approximate maximum amount of memory, in MB, to use for cache entries. 0 means no limit. Default='+str(defaultCacheMaxMemory), default=defaultCacheMaxMemory, type=int)
+commandLineParser.add_argument('-cep', '--cacheEvictionPolicy', help='Which cache entries to remove from memory once over the limit. Must be lru or lfu. Default='+defaultCacheEvictionPolicy, default=defaultCacheEvictionPolicy, type=str)
 commandLineParser.add_argument('-ui', '--uiPath', help='Specify the path to the streamlit UI. Using streamlit requires installing it via: pip install streamlit', default=None, type=str)
 
+commandLineParser.add_argument('-hp', '--httpProcesses', help='The number of HTTP server processes to run on the same port. Each one has its own copy of the model. The cache is shared through sqlite. 0 means one per CPU. Not available on Windows. Default=1', default=1, type=int)
 commandLineParser.add_argument('-a', '--address', help='Specify the address to listen on. To bind to all addresses, use 0.0.0.0  Default is to bind to: '+ str(defaultAddress), default=defaultAddress, type=str)
 commandLineParser.add_argument('-p', '--port', help='Specify the port the local server will use. Default=' + str(defaultPort), default=defaultPort, type=int)
 
+commandLineParser.add_argument('-ic', '--importCache', help='Import the translations in this csv, json or jsonl file into the cache for the model and then exit without starting the server. Default=None', default=None, type=str)
+commandLineParser.add_argument('-icf', '--importCacheFormat', help='The format of the --importCache file. Must be csv, json or jsonl. Default is based on the file extension.', default=None, type=str)
+commandLineParser.add_argument('-icp', '--importCacheConflictPolicy', help='What to do with entries from --importCache that are already in the cache. keep leaves the existing translation alone. replace overwrites it. Default=keep', default='keep', type=str)
 commandLineParser.add_argument('-cfe', '--cacheFileEncoding', help='Specify the encoding used for cache.csv. Default='+defaultFileEncoding,default=defaultFileEncoding, type=str)
 commandLineParser.add_argument('-ce', '--consoleEncoding', help='Specify the encoding used for certain types of stdout. Default='+defaultConsoleEncoding,default=defaultConsoleEncoding, type=str)
 commandLineParser.add_argument('-ifeh', '--inputFileErrorHandling', help='If the input from files cannot be read perfectly using the specified encoding, what should happen? See: https://docs.python.org/3.8/library/codecs.html#error-handlers Default is to crash the program.', default=defaultInputFileErrorHandling, type=str)
@@ -240,16 +372,46 @@ sourceLanguage=commandLineArguments.sourceLanguage
 targetLanguage=commandLineArguments.targetLanguage
 sourceSentencePieceModel=commandLineArguments.sourceSentencePieceModel
 targetSentencePieceModel=commandLineArguments.targetSentencePieceModel
+modelsFile=commandLineArguments.models
+modelMemoryBudget=commandLineArguments.modelMemoryBudget
 
 preloadModel=commandLineArguments.preloadModel
 intra_threads=commandLineArguments.cpuThreads
 use_vmap=commandLineArguments.useVMap
+autotune=commandLineArguments.autotune
+pinThreads=commandLineArguments.pinThreads
+replicas=commandLineArguments.replicas
+replicaCores=commandLineArguments.replicaCores
+inferenceSlots=commandLineArguments.inferenceSlots
+inferenceMaxQueue=commandLineArguments.inferenceMaxQueue
+workerPoolSize=commandLineArguments.workers
+workerMaxRequests=commandLineArguments.workerMaxRequests
+workerMaxMemory=commandLineArguments.workerMaxMemory
+workerIdleTimeout=commandLineArguments.workerIdleTimeout
+workerRequestTimeout=commandLineArguments.workerRequestTimeout
+batchWindow=commandLineArguments.batchWindow
+batchMaxSentences=commandLineArguments.batchMaxSentences
+batchMaxTokens=commandLineArguments.batchMaxTokens
+tokenBudget=commandLineArguments.tokenBudget
 perfMetrics=commandLineArguments.disablePerfMetrics
+benchmarkCorpus=commandLineArguments.benchmark
+benchmarkSweep=commandLineArguments.benchmarkSweep
+benchmarkRepeats=commandLineArguments.benchmarkRepeats
+benchmarkOutput=commandLineArguments.benchmarkOutput
 
 cacheEnabled=commandLineArguments.cache
+cacheFormat=commandLineArguments.cacheFormat
+cacheCompression=commandLineArguments.cacheCompression
+cacheMaxEntries=commandLineArguments.cacheMaxEntries
+cacheMaxMemory=commandLineArguments.cacheMaxMemory
+cacheEvictionPolicy=commandLineArguments.cacheEvictionPolicy
+importCacheFile=commandLineArguments.importCache
+importCacheFormat=commandLineArguments.importCacheFormat
+importCacheConflictPolicy=commandLineArguments.importCacheConflictPolicy
 uiPath=commandLineArguments.uiPath
 
 address=commandLineArguments.address
+httpProcesses=commandLineArguments.httpProcesses
 port=commandLineArguments.port
 
 cacheFileEncoding=commandLineArguments.cacheFileEncoding
@@ -270,6 +432,71 @@ if version == True:
     sys.exit( (currentScriptNameWithoutPath + ' ' + __version__).encode(consoleEncoding) )
 
 
+if benchmarkCorpus != None:
+    if mode.lower() != 'ctranslate2':
+        sys.exit( ('Error: --benchmark only supports ctranslate2. Mode=' + str(mode)).encode(consoleEncoding) )
+    # The benchmark loads the model in its own processes and never uses the cache.
+    cacheEnabled=False
+    preloadModel=False
+
+
+# Valid import formats, and the file extensions that select them when --importCacheFormat is not specified.
+importCacheFormats={ '.csv': 'csv', '.json': 'json', '.jsonl': 'jsonl', '.ndjson': 'jsonl' }
+if importCacheConflictPolicy.lower() in [ 'keep', 'replace' ]:
+    importCacheConflictPolicy=importCacheConflictPolicy.lower()
+else:
+    sys.exit( ('Error: --importCacheConflictPolicy must be keep or replace. Current value=' + str(importCacheConflictPolicy)).encode(consoleEncoding) )
+if importCacheFile != None:
+    if cacheEnabled != True:
+        sys.exit( 'Error: --importCache requires the cache to be enabled.' )
+    if importCacheFormat == None:
+        # A compressed file uses the extension before .gz.
+        importCacheFileSuffixes=pathlib.Path(importCacheFile).suffixes
+        if (len(importCacheFileSuffixes) > 1) and (importCacheFileSuffixes[-1].lower() == '.gz'):
+            importCacheFileSuffixes.pop()
+        if len(importCacheFileSuffixes) != 0:
+            importCacheFormat=importCacheFormats.get( importCacheFileSuffixes[-1].lower() )
+        if importCacheFormat == None:
+            sys.exit( ('Error: Unable to determine the format of --importCache from its file extension. Please specify --importCacheFormat. File=' + importCacheFile).encode(consoleEncoding) )
+    importCacheFormat=importCacheFormat.lower()
+    if importCacheFormat not in importCacheFormats.values():
+        sys.exit( ('Error: --importCacheFormat must be csv, json or jsonl. Current value=' + str(importCacheFormat)).encode(consoleEncoding) )
+    # Importing only needs the cache, so do not load the model.
+    preloadModel=False
+    autotune=False
+
+
+# With several HTTP processes, the cache has to be in one place they can all see, so use sqlite.
+if httpProcesses != 1:
+    if sys.platform == 'win32':
+        sys.exit( 'Error: --httpProcesses requires fork() which is not available on Windows.' )
+    if httpProcesses < 0:
+        sys.exit( ('Error: --httpProcesses must be 0 or more. Current value=' + str(httpProcesses)).encode(consoleEncoding) )
+    if (cacheEnabled == True) and (cacheFormat.lower() != 'sqlite'):
+        if __name__ == '__main__':
+            print( 'Info: --httpProcesses shares the cache between processes with sqlite, so using --cacheFormat sqlite.' )
+        cacheFormat='sqlite'
+
+
+if cacheFormat.lower() in [ 'csv', 'sqlite', 'binary' ]:
+    cacheFormat=cacheFormat.lower()
+else:
+    sys.exit( ('Error: --cacheFormat must be csv, sqlite or binary. Current value=' + str(cacheFormat)).encode(consoleEncoding) )
+if cacheCompression.lower() in [ 'none', 'gzip' ]:
+    cacheCompression=cacheCompression.lower()
+else:
+    sys.exit( ('Error: --cacheCompression must be none or gzip. Current value=' + str(cacheCompression)).encode(consoleEncoding) )
+# Every cache.csv file name ends with this, so the two settings never read each other's files by mistake.
+if cacheCompression == 'gzip':
+    cacheFileExtension='.csv.gz'
+else:
+    cacheFileExtension='.csv'
+if cacheEvictionPolicy.lower() in [ 'lru', 'lfu' ]:
+    cacheEvictionPolicy=cacheEvictionPolicy.lower()
+else:
+    sys.exit( ('Error: --cacheEvictionPolicy must be lru or lfu. Current value=' + str(cacheEvictionPolicy)).encode(consoleEncoding) )
+
+
 if debug == True:
     verbose = True
     import inspect   #Used to print out the name of the current function during execution which is useful when debugging.
@@ -298,6 +525,18 @@ def checkIfThisFolderExists(myFolder):
         return False
     return True
 
+# Look for spm.language.nopretok.model next to the model, one folder up, and in the usual sentencepiece subfolders of both. Returns None if it is not found.
+def findSentencePieceModel(modelPathOnly, language):
+    tempFileName=defaultSentencePieceModelPrefix+language+defaultSentencePieceModelPostfix
+    for folder in [ modelPathOnly, modelPathOnly + '/..' ]:
+        if checkIfThisFileExists(folder + '/' + tempFileName) == True:
+            return folder + '/' + tempFileName
+    for folder in [ modelPathOnly, modelPathOnly + '/..' ]:
+        for subFolder in [ defaultSentencePieceModelFolder0, defaultSentencePieceModelFolder1, defaultSentencePieceModelFolder2 ]:
+            if checkIfThisFileExists(folder + '/' + subFolder + '/' + tempFileName) == True:
+                return folder + '/' + subFolder + '/' + tempFileName
+    return None
+
 
 #Update path of current script.
 currentScriptPathObject = pathlib.Path( __file__ ).absolute()
@@ -393,83 +632,1231 @@ else:
 
 
 # Update cache path and related settings.
-# lazyHash is for use in a different process so that the main process does not get overfilled with memory that it will never again use when the entire model contents are read into memory.
-# Proper way is probably to create a thread and read the file in chunks, but since the model is expected to be in memory later on anyway, reading it all in at once does not bloat the memory requirements of this program beyond what they already are. However, not reading it in either in another process, or in chunks would bloat the size.
-def lazyHash(fileNameAndPath,myQueue):
-    # SHA1
-    with open(inputModelFileNameAndPath,'rb') as myFile:
-        myFileContents=myFile.read()
-        #modelHash=str(hashlib.sha1(myFileContents).hexdigest())[:10]
-    myQueue.put( str( hashlib.sha1(myFileContents).hexdigest() ) )
-
-    # CRC32
-    # So, this returns a different crc32 than 7-Zip regardless of binascii/zlip or the 'bitwise and' fix.
-    # Apparently, there are different sub standards for CRC32.
-    # https://reveng.sourceforge.io/crc-catalogue/all.htm
-    # Since SHA1 is too long, CRC32 is just borked, and there are no CRC64 libs in the Python standard library, just use a trunkated SHA1 hash as a compromise. Quirky, but whatever.
-    #import zlib
-    #import binascii
-    #with open(inputModelFileNameAndPath,'rb') as myFile:
-    #    myFileContents=myFile.read()
-    #    #modelHash=binascii.crc32(myFileContents)
-    #myQueue.put(str( (zlib.crc32(myFileContents)) & 0xffffffff) )
-
-
-# This turns translationCacheDictionary into a csv file at cacheFilePathAndName.
-# That .csv can grow quite large, so support optional compression perhaps?
-# https://docs.python.org/3/library/zipfile.html
-# This UI is a bit odd. It should accept a dictionary and a fileNameAndPath. This should probably be turned into a Class that wraps a dictionary and handles the I/O.
-def writeOutCache():
-    # Spaghetti.
-    global translationCacheDictionary
-    global modelHashFull
+# The model is read in chunks of chunkSize bytes, so memory use stays flat no matter how large the model is.
+# Why SHA1: CRC32 from binascii/zlib returns a different value than 7-Zip regardless of the 'bitwise and' fix, since there are different sub standards for CRC32, https://reveng.sourceforge.io/crc-catalogue/all.htm
+# SHA1 is too long for a file name and there are no CRC64 libs in the Python standard library, so the cache uses a truncated SHA1 hash as a compromise. Quirky, but whatever.
+def hashFile(fileNameAndPath, chunkSize=4194304):
+    sha1=hashlib.sha1()
+    with open(fileNameAndPath,'rb') as myFile:
+        while True:
+            chunk=myFile.read(chunkSize)
+            if not chunk:
+                break
+            sha1.update(chunk)
+    return str( sha1.hexdigest() )
+
+
+# modelHashLock keeps models from --models that load at the same time from overwriting each other's entries in defaultModelHashFileName.
+modelHashLock=threading.Lock()
+
+# Return the full SHA1 hash of the model file, or of fileNameAndPath for models from --models.
+# The hash is saved in defaultModelHashFileName together with the size, modification time and inode of the file, and is only calculated again once any of those change, so restarting with the same model is almost instant.
+def getModelHash(fileNameAndPath=None):
+    if fileNameAndPath == None:
+        fileNameAndPath=inputModelFileNameAndPath
+    fileNameAndPath=str( pathlib.Path(fileNameAndPath).absolute() )
+    modelHashFilePathAndName=currentScriptPathOnly + '/' + defaultCacheLocation + '/' + defaultModelHashFileName
+
+    with modelHashLock:
+        try:
+            fileStatus=os.stat(fileNameAndPath)
+        except OSError:
+            sys.exit( ('Error: Could not generate hash from model file.' + str(fileNameAndPath)).encode(consoleEncoding) )
+        fileSignature={ 'size': fileStatus.st_size, 'mtime': fileStatus.st_mtime_ns, 'inode': fileStatus.st_ino }
+
+        savedHashes={}
+        if checkIfThisFileExists(modelHashFilePathAndName) == True:
+            try:
+                with open(modelHashFilePathAndName, 'r', encoding='utf-8') as myFileHandle:
+                    savedHashes=json.load(myFileHandle)
+            except (OSError, ValueError):
+                savedHashes=None
+            if not isinstance(savedHashes, dict):
+                print( ('Warning: Could not read ' + modelHashFilePathAndName + '. Hashing the model again.').encode(consoleEncoding) )
+                savedHashes={}
+
+        savedEntry=savedHashes.get(fileNameAndPath)
+        if (isinstance(savedEntry, dict)) and (isinstance(savedEntry.get('sha1'), str)) and ( all( savedEntry.get(key) == value for key, value in fileSignature.items() ) ):
+            if debug == True:
+                print( ('Using saved hash for: ' + fileNameAndPath).encode(consoleEncoding) )
+            return savedEntry['sha1']
+
+        if verbose == True:
+            print( ('Hashing model: ' + fileNameAndPath).encode(consoleEncoding) )
+        try:
+            modelHashFull=hashFile(fileNameAndPath)
+        except OSError:
+            sys.exit( ('Error: Could not generate hash from model file.' + str(fileNameAndPath)).encode(consoleEncoding) )
 
+        fileSignature['sha1']=modelHashFull
+        savedHashes[fileNameAndPath]=fileSignature
+        # Write to a temporary file and then move it into place, so that an interrupted write never leaves a corrupt file behind.
+        try:
+            pathlib.Path(modelHashFilePathAndName).parent.mkdir( parents = True, exist_ok = True )
+            with open(modelHashFilePathAndName + '.temp', 'w', encoding='utf-8') as myFileHandle:
+                json.dump(savedHashes, myFileHandle, indent=4, ensure_ascii=False)
+            pathlib.Path(modelHashFilePathAndName + '.temp').replace(modelHashFilePathAndName)
+        except OSError as exception:
+            print( ('Warning: Could not save model hash to ' + modelHashFilePathAndName + ' ' + str(exception)).encode(consoleEncoding) )
+        return modelHashFull
+
+
+# Open a cache.csv file as text in mode r, w or a. Files that end in .gz are gzip compressed.
+# gzip compresses and decompresses as the file is written and read, so a compressed cache is never inflated to a temporary file first.
+# Appending to a .gz file adds another gzip member to the end of it. Readers treat all of the members as one continuous file.
+def openCsvCacheFile(fileNameAndPath, mode):
+    if fileNameAndPath.endswith('.gz'):
+        return gzip.open(fileNameAndPath, mode + 't', compresslevel=defaultCacheCompressionLevel, newline='', encoding=cacheFileEncoding, errors=inputErrorHandling)
+    return open(fileNameAndPath, mode, newline='', encoding=cacheFileEncoding, errors=inputErrorHandling)
+
+
+# Read cache.csv one row at a time as [rawText, translatedText] pairs. The first row is the header and is skipped.
+# Whitespace around each field is removed and empty translations are returned as None.
+def readCsvCacheFile(fileNameAndPath):
+    with openCsvCacheFile(fileNameAndPath, 'r') as myFileHandle:
+        yield from parseCsvCacheEntries(myFileHandle)
+
+
+# Same as readCsvCacheFile(), but from a file that is already open as text with newline=''.
+# Cache files always start with a header row. Imported files might not, so with headerRequired=False the first row is only skipped if its first field is rawText.
+def parseCsvCacheEntries(myFileHandle, headerRequired=True):
+    csvReader = csv.reader(myFileHandle, strict=True)
+    currentLine=0
+    for line in csvReader:
+        currentLine+=1
+        if currentLine == 1:
+            if headerRequired == True:
+                continue
+            # Files saved by some editors start with a byte order mark.
+            if len(line) != 0:
+                line[0]=line[0].lstrip('\ufeff')
+                if line[0].strip() == 'rawText':
+                    continue
+        #if ignoreWhitespace == True:
+        for i in range(len(line)):
+            line[i]=line[i].strip()
+        if line[1] == '':
+            line[1] = None
+        yield line[0], line[1]
+
+
+# Read one [rawText, translatedText] pair per line from a JSON lines file. Each line is either a ["rawText", "translatedText"] array or a {"rawText": "translatedText"} object. Blank lines are skipped.
+def parseJsonLinesCacheEntries(myFileHandle):
+    for lineNumber, line in enumerate(myFileHandle, 1):
+        if line.strip() == '':
+            continue
+        entry=json.loads(line)
+        if isinstance(entry, dict):
+            entries=entry.items()
+        elif isinstance(entry, list) and (len(entry) == 2):
+            entries=[ entry ]
+        else:
+            raise ValueError('Expected an array of two strings or an object on line ' + str(lineNumber))
+        for rawText, translatedText in entries:
+            yield validateCacheEntry(rawText, translatedText)
+
+
+# Read [rawText, translatedText] pairs from a JSON object without reading all of it into memory.
+# The object can either be {"rawText": "translatedText", ...} or what /api/v1/getCache returns: {"content": {"rawText": "translatedText", ...}, ...}. Anything else next to content is ignored.
+# The file is read chunkSize characters at a time and each key and value is decoded with raw_decode(), so only the current chunk and entry are ever in memory.
+def parseJsonCacheEntries(myFileHandle, chunkSize=1048576):
+    decoder=json.JSONDecoder()
+    buffer=''
+    position=0
+    endOfFile=False
+
+    def readMore():
+        nonlocal buffer, position, endOfFile
+        chunk=myFileHandle.read(chunkSize)
+        if not chunk:
+            endOfFile=True
+        buffer=buffer[position:] + chunk
+        position=0
+
+    # Return the next character that is not whitespace without using it up. '' means the end of the file.
+    def peek():
+        nonlocal position
+        while True:
+            while (position < len(buffer)) and (buffer[position] in ' \t\r\n'):
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if endOfFile == True:
+                return ''
+            readMore()
+
+    def expect(character):
+        nonlocal position
+        if peek() != character:
+            raise ValueError('Expected \'' + character + '\' in JSON but found: ' + repr(buffer[position:position+20]))
+        position += 1
+
+    # A value that ends at the end of the buffer might continue in the next chunk, so read more and decode it again.
+    def decodeValue():
+        nonlocal position
+        peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+                if (end < len(buffer)) or (endOfFile == True):
+                    position=end
+                    return value
+            except json.JSONDecodeError:
+                if endOfFile == True:
+                    raise
+            readMore()
+
+    expect('{')
+    wrapped=False
+    inContent=False
+    while True:
+        character=peek()
+        if character == '':
+            raise ValueError('Unexpected end of JSON.')
+        if character == '}':
+            position += 1
+            if inContent == True:
+                inContent=False
+                continue
+            return
+        if character == ',':
+            position += 1
+            continue
+        key=decodeValue()
+        if not isinstance(key, str):
+            raise ValueError('Expected a string for a key in JSON but found: ' + repr(key))
+        expect(':')
+        if (inContent != True) and (wrapped != True) and (key == 'content') and (peek() == '{'):
+            position += 1
+            inContent=True
+            wrapped=True
+            continue
+        value=decodeValue()
+        if (inContent == True) or (wrapped != True):
+            yield validateCacheEntry(key, value)
+
+
+# Entries from files that were not written by this program could contain anything, so make sure they are text before adding them to the cache.
+def validateCacheEntry(rawText, translatedText):
+    if ( not isinstance(rawText, str) ) or ( (translatedText != None) and ( not isinstance(translatedText, str) ) ):
+        raise ValueError('Cache entries must be strings. Found: ' + repr(rawText)[:100] + ': ' + repr(translatedText)[:100])
+    return rawText, translatedText
+
+
+# Write entries, an iterable of [rawText, translatedText] pairs, to a csv file at fileNameAndPath.
+# The file is written to a temporary file first and then moved into place so that a crash while writing does not corrupt an existing cache.csv.
+# header is the name of the second column. The default is the model name and full hash of the model from the command prompt.
+def writeCsvCacheFile(fileNameAndPath, entries, header=None):
+    if header == None:
+        header=inputModelNameWithoutPath + '.' + modelHashFull
     # Redundant, but it is better to be paranoid.
     pathlib.Path( cacheFilePathOnly ).mkdir( parents = True, exist_ok = True )
 
-    #cacheFilePathOnly
-    #cacheFilePathAndName is the final location
-    #cacheFileNameOnly
-
     #hashlib.sha1(myFileContents).hexdigest()
-    randomNumber=hashlib.sha1(cacheFilePathAndName.encode(consoleEncoding))
+    randomNumber=hashlib.sha1(fileNameAndPath.encode(consoleEncoding))
     randomNumber.update(str(time.perf_counter()).encode(consoleEncoding))
     randomNumber=str(randomNumber.hexdigest())[:8]
     temporaryFileNameAndPath=cacheFilePathOnly + '/' + 'cache.temp.' + randomNumber + '.csv'
+    if fileNameAndPath.endswith('.gz'):
+        temporaryFileNameAndPath=temporaryFileNameAndPath + '.gz'
 
     if debug == True:
         print( 'temporaryFileNameAndPath=' + temporaryFileNameAndPath )
 
     #write to temporary file first.
-    with open(temporaryFileNameAndPath, 'w', newline='', encoding=cacheFileEncoding) as myOutputFileHandle:
+    with openCsvCacheFile(temporaryFileNameAndPath, 'w') as myOutputFileHandle:
         myCsvHandle = csv.writer(myOutputFileHandle)
-        myCsvHandle.writerow(['rawText',inputModelNameWithoutPath + '.' +modelHashFull])
-        for i, k in translationCacheDictionary.items():
+        myCsvHandle.writerow(['rawText',header])
+        for i, k in entries:
             myCsvHandle.writerow( [str(i),str(k)] )
 
     if checkIfThisFileExists(temporaryFileNameAndPath) == True:
         #Replace any existing cache with the temporary one.
-        pathlib.Path(temporaryFileNameAndPath).replace(cacheFilePathAndName)
-        print( ('Wrote cache to disk at: ' + cacheFilePathAndName).encode(consoleEncoding) )
+        pathlib.Path(temporaryFileNameAndPath).replace(fileNameAndPath)
+        print( ('Wrote cache to disk at: ' + fileNameAndPath).encode(consoleEncoding) )
     else:
         print( ('Warning: Error writing temporary cache file at:' + temporaryFileNameAndPath).encode(consoleEncoding) )
 
 
-#This turns translationCacheDictionary into a csv file at cacheFilePathAndName.
+# Return at most limit entries from entries whose rawText sorts after cursor, in order of rawText. 0 means no limit.
+# This is how /api/v1/getCache pages through caches that are not sorted on disk. heapq only keeps limit entries at a time instead of sorting the whole cache.
+def getSortedCachePage(entries, cursor, limit):
+    entries=( entry for entry in entries if entry[0] > cursor )
+    if limit == 0:
+        return sorted(entries)
+    return heapq.nsmallest(limit, entries)
+
+
+# Metrics for /api/v1/metrics, in the Prometheus text format:
+# https://prometheus.io/docs/instrumenting/exposition_formats/
+# These are always collected since they only cost a few additions per batch. perfMetrics only controls what is printed to the console.
+# Histograms are cumulative, like Prometheus expects: bucketCounts[i] counts every observation <= buckets[i].
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets=buckets
+        self.bucketCounts=[0] * len(buckets)
+        self.count=0
+        self.sum=0
+
+    def observe(self, value):
+        for i in range( len(self.buckets) ):
+            if value <= self.buckets[i]:
+                self.bucketCounts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def render(self, name, help):
+        lines=[ '# HELP ' + name + ' ' + help, '# TYPE ' + name + ' histogram' ]
+        for i in range( len(self.buckets) ):
+            lines.append( name + '_bucket{le="' + str(self.buckets[i]) + '"} ' + str(self.bucketCounts[i]) )
+        lines.append( name + '_bucket{le="+Inf"} ' + str(self.count) )
+        lines.append( name + '_sum ' + str( round(self.sum, 6) ) )
+        lines.append( name + '_count ' + str(self.count) )
+        return lines
+
+
+# Counters and histograms updated by the request handlers, translationScheduler and cacheWriter. Gauges are read from those objects when /api/v1/metrics is requested instead.
+# cacheWriter updates these from its own thread, so use lock.
+class ServerMetrics:
+    latencyBuckets=[ 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300 ]
+    batchSizeBuckets=[ 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096 ]
+
+    def __init__(self):
+        self.lock=threading.Lock()
+        self.requestDuration=Histogram(self.latencyBuckets)
+        self.inferenceDuration=Histogram(self.latencyBuckets)
+        self.batchSize=Histogram(self.batchSizeBuckets)
+        self.cacheFlushDuration=Histogram(self.latencyBuckets)
+        self.requestsInFlight=0
+        self.requestsRejected=0
+        self.entriesTranslated=0
+        self.tokensIn=0
+        self.tokensOut=0
+
+    def observe(self, histogram, value):
+        with self.lock:
+            histogram.observe(value)
+
+    def add(self, name, value):
+        with self.lock:
+            setattr( self, name, getattr(self, name) + value )
+
+    def render(self):
+        lines=[]
+        def addMetric(name, type, help, value):
+            lines.extend( [ '# HELP ' + name + ' ' + help, '# TYPE ' + name + ' ' + type, name + ' ' + str(value) ] )
+
+        with self.lock:
+            lines.extend( self.requestDuration.render('py3translationserver_request_duration_seconds', 'Time taken to answer translation requests.') )
+            lines.extend( self.inferenceDuration.render('py3translationserver_inference_duration_seconds', 'Time taken by the translation engine for each batch.') )
+            lines.extend( self.batchSize.render('py3translationserver_batch_size_entries', 'Number of unique entries in each batch sent to the translation engine.') )
+            lines.extend( self.cacheFlushDuration.render('py3translationserver_cache_flush_duration_seconds', 'Time taken to write the cache to disk.') )
+            addMetric('py3translationserver_requests_in_flight', 'gauge', 'Translation requests currently being processed.', self.requestsInFlight)
+            addMetric('py3translationserver_requests_rejected_total', 'counter', 'Translation requests rejected because the inference queue was full.', self.requestsRejected)
+            addMetric('py3translationserver_entries_translated_total', 'counter', 'Entries translated by the translation engine.', self.entriesTranslated)
+            addMetric('py3translationserver_tokens_in_total', 'counter', 'Source tokens sent to the translation engine. Characters for fairseq.', self.tokensIn)
+            addMetric('py3translationserver_tokens_out_total', 'counter', 'Target tokens returned by the translation engine. Characters for fairseq.', self.tokensOut)
+
+        if translationScheduler != None:
+            addMetric('py3translationserver_batch_pending_entries', 'gauge', 'Entries waiting to be merged into the next batch.', translationScheduler.pendingSentenceCount)
+        if inferenceExecutor != None:
+            statistics=inferenceExecutor.statistics()
+            addMetric('py3translationserver_inference_in_flight', 'gauge', 'Batches currently being translated.', statistics['inFlight'])
+            addMetric('py3translationserver_inference_queued', 'gauge', 'Batches waiting for an inference slot.', statistics['queued'])
+            addMetric('py3translationserver_inference_slots', 'gauge', 'Number of inference slots.', statistics['slots'])
+        elif warmWorkerPool != None:
+            addMetric('py3translationserver_inference_in_flight', 'gauge', 'Batches currently being translated.', warmWorkerPool.inFlight)
+            addMetric('py3translationserver_inference_queued', 'gauge', 'Batches waiting for a worker process.', warmWorkerPool.queued)
+            addMetric('py3translationserver_inference_slots', 'gauge', 'Number of worker processes.', warmWorkerPool.poolSize)
+
+        if cacheEnabled == True:
+            with cacheLock:
+                statistics=translationCacheDictionary.statistics()
+                memoryUsed=translationCacheDictionary.memoryUsed
+                pendingWrite=len(cacheEntriesPendingWrite)
+            addMetric('py3translationserver_cache_hits_total', 'counter', 'Entries found in the cache.', statistics['hits'])
+            addMetric('py3translationserver_cache_misses_total', 'counter', 'Entries not found in the cache.', statistics['misses'])
+            addMetric('py3translationserver_cache_evictions_total', 'counter', 'Entries evicted from the cache in memory.', statistics['evictions'])
+            addMetric('py3translationserver_cache_entries', 'gauge', 'Entries in translationCacheDictionary.', statistics['entries'])
+            addMetric('py3translationserver_cache_memory_bytes', 'gauge', 'Estimated memory used by translationCacheDictionary.', memoryUsed)
+            addMetric('py3translationserver_cache_pending_write_entries', 'gauge', 'Entries not written to disk yet.', pendingWrite)
+
+        return '\n'.join(lines) + '\n'
+
+
+# fairseq tokenizes internally, so the tokensIn and tokensOut metrics count characters for it instead. Returns [ tokensIn, tokensOut ]
+def countCharacters(rawTextList, translatedList):
+    return [ sum( len(i) for i in rawTextList ), sum( len(str(i)) for i in translatedList ) ]
+
+
+serverMetrics=ServerMetrics()
+
+
+# TranslationCacheDictionary behaves like a dictionary but can be limited to maxEntries entries or maxMemory bytes. Once over the limit, entries are evicted by evictionPolicy:
+#   lru evicts the least recently used entry.
+#   lfu looks at the evictionSampleSize least recently used entries and evicts the one with the fewest hits. This is an approximation of least frequently used that avoids scanning every entry.
+# It also tracks hits, misses and evictions. maxEntries=0 and maxMemory=0 mean no limit.
+# It is not thread safe on its own. Hold cacheLock when using it.
+class TranslationCacheDictionary:
+    # Rough size of the bookkeeping for each entry: the OrderedDict node, the [translatedText, hitCount, timeLastUsed] list and its contents.
+    entryOverhead=200
+    evictionSampleSize=16
+
+    def __init__(self, maxEntries=0, maxMemory=0, evictionPolicy='lru'):
+        self.maxEntries=maxEntries
+        self.maxMemory=maxMemory
+        self.evictionPolicy=evictionPolicy
+        # The syntax of this is: entries['rawText']=[translatedText, hitCount, timeLastUsed]
+        # Entries are kept in the order they were last used, from least to most recent.
+        self.entries=collections.OrderedDict()
+        self.memoryUsed=0
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+
+    def estimateMemory(self, rawText, translatedText):
+        return sys.getsizeof(rawText) + sys.getsizeof(translatedText) + self.entryOverhead
+
+    def isBounded(self):
+        return (self.maxEntries > 0) or (self.maxMemory > 0)
+
+    def __contains__(self, rawText):
+        return rawText in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Reading an entry counts as using it.
+    def __getitem__(self, rawText):
+        entry=self.entries[rawText]
+        entry[1] += 1
+        entry[2]=time.time()
+        self.entries.move_to_end(rawText)
+        return entry[0]
+
+    def __setitem__(self, rawText, translatedText):
+        if rawText in self.entries:
+            entry=self.entries[rawText]
+            self.memoryUsed -= self.estimateMemory(rawText, entry[0])
+            entry[0]=translatedText
+            entry[2]=time.time()
+            self.entries.move_to_end(rawText)
+        else:
+            self.entries[rawText]=[translatedText, 0, time.time()]
+        self.memoryUsed += self.estimateMemory(rawText, translatedText)
+        self.evictIfNeeded()
+
+    def update(self, otherDictionary):
+        for rawText, translatedText in otherDictionary.items():
+            self[rawText]=translatedText
+
+    # Yields [rawText, translatedText] pairs like dict.items() without counting as using them.
+    def items(self):
+        for rawText, entry in self.entries.items():
+            yield rawText, entry[0]
+
+    # Returns a plain dictionary snapshot.
+    def copy(self):
+        snapshot={}
+        for rawText, entry in self.entries.items():
+            snapshot[rawText]=entry[0]
+        return snapshot
+
+    def clear(self):
+        self.entries=collections.OrderedDict()
+        self.memoryUsed=0
+
+    def recordLookups(self, hits, misses):
+        self.hits += hits
+        self.misses += misses
+
+    def evictIfNeeded(self):
+        while len(self.entries) > 0:
+            if (self.maxEntries > 0) and (len(self.entries) > self.maxEntries):
+                pass
+            elif (self.maxMemory > 0) and (self.memoryUsed > self.maxMemory):
+                pass
+            else:
+                return
+
+            if self.evictionPolicy == 'lfu':
+                victim=None
+                fewestHits=None
+                counter=0
+                for rawText, entry in self.entries.items():
+                    if (fewestHits == None) or (entry[1] < fewestHits):
+                        victim=rawText
+                        fewestHits=entry[1]
+                    counter += 1
+                    if counter >= self.evictionSampleSize:
+                        break
+            else:
+                victim=next( iter(self.entries) )
+
+            entry=self.entries.pop(victim)
+            self.memoryUsed -= self.estimateMemory(victim, entry[0])
+            self.evictions += 1
+
+    def statistics(self):
+        totalLookups=self.hits + self.misses
+        hitRatio=0
+        if totalLookups != 0:
+            hitRatio=round(self.hits / totalLookups, 4)
+        return {
+            'entries': len(self.entries),
+            'memoryUsedMB': round(self.memoryUsed / 1048576, 2),
+            'maxEntries': self.maxEntries,
+            'maxMemoryMB': round(self.maxMemory / 1048576, 2),
+            'evictionPolicy': self.evictionPolicy,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRatio': hitRatio,
+            'evictions': self.evictions,
+            }
+
+
+# The cache has two layers. translationCacheDictionary holds entries in memory. cacheStore is responsible for keeping them on disk.
+# Both stores support the same functions, so the rest of the program does not need to know which one is in use:
+#   load(translationCacheDictionary) fills translationCacheDictionary at startup with any entries that should be kept in memory.
+#   getMany(rawTextList) returns a dictionary of any entries in rawTextList that are on disk.
+#   save(newEntries) durably writes only the entries added since the last save.
+#   compact(allEntries, newEntries) rewrites the on-disk cache from scratch. newEntries are the entries that have not been saved yet. allEntries is a snapshot of translationCacheDictionary that also has every entry in newEntries, since some of them might have been evicted from memory before they were saved. Every entry in newEntries must be on disk afterwards.
+#   clear() removes every entry for the current model from disk.
+#   count() returns the number of entries on disk.
+#   iterateEntries() yields every [rawText, translatedText] pair on disk.
+#   exportCsv(fileNameAndPath) writes every entry to a csv file.
+# entriesAreInMemory is True if every entry is always in translationCacheDictionary, so there is no point in asking the store for them.
+# loading is True while entries are still being read into translationCacheDictionary in the background. The cache is not compacted until that finishes.
+
+# CsvCacheStore is the original format. The entire cache is kept in memory, unless translationCacheDictionary is limited, in which case evicted entries only remain in cache.hash.csv.
+# New entries are appended to the end of cache.hash.csv, so a save only costs as much as the number of new entries. The whole file is only rewritten when compacting.
+# cacheDictionary is the TranslationCacheDictionary that holds the entries in memory and lock is the lock that guards it. They are None for the journal of BinaryCacheStore, which only uses save().
+class CsvCacheStore:
+    entriesAreInMemory=True
+
+    def __init__(self, fileNameAndPath, header=None, cacheDictionary=None, lock=None):
+        self.fileNameAndPath=fileNameAndPath
+        self.header=header
+        self.cacheDictionary=cacheDictionary
+        self.lock=lock
+        # Set by clear(), so that the next compaction does not bring back the entries that were only on disk.
+        self.discardEntriesOnDisk=False
+        self.loading=False
+        # Set whenever no background load is running, so other threads can wait for one to finish.
+        self.loaded=threading.Event()
+        self.loaded.set()
+        # Set by clear() to stop loading entries that were just cleared.
+        self.loadingCancelled=False
+
+    # Read cache.hash.csv into translationCacheDictionary batchSize entries at a time. lock is only held for each batch, so lookups are not blocked for the entire load.
+    # Entries that are already in translationCacheDictionary were translated after the file was written, so they are kept instead of the ones from the file.
+    def load(self, translationCacheDictionary, lock, batchSize=10000):
+        batch=[]
+        for entry in readCsvCacheFile(self.fileNameAndPath):
+            batch.append(entry)
+            if len(batch) >= batchSize:
+                if self.addLoadedEntries(translationCacheDictionary, lock, batch) != True:
+                    return
+                batch=[]
+        self.addLoadedEntries(translationCacheDictionary, lock, batch)
+
+    def addLoadedEntries(self, translationCacheDictionary, lock, batch):
+        with lock:
+            if self.loadingCancelled == True:
+                return False
+            for rawText, translatedText in batch:
+                if rawText not in translationCacheDictionary:
+                    translationCacheDictionary[rawText]=translatedText
+        return True
+
+    # Read cache.csv in a background thread, so the server starts right away no matter how large it is.
+    # Until loading finishes, entries that have not been read yet are cache misses and are translated again.
+    def loadInBackground(self, translationCacheDictionary, lock):
+        self.loading=True
+        self.loaded.clear()
+        threading.Thread( target=self.loadInThread, args=(translationCacheDictionary, lock), name='cacheLoader', daemon=True ).start()
+
+    def loadInThread(self, translationCacheDictionary, lock):
+        global cacheCompactionRequested
+        loadingStartTime=time.perf_counter()
+        try:
+            self.load(translationCacheDictionary, lock)
+            print( ('Loaded ' + str(len(translationCacheDictionary)) + ' entries into cache from: ' + self.fileNameAndPath + ' in ' + str( round(time.perf_counter() - loadingStartTime, 2) ) + ' seconds.').encode(consoleEncoding) )
+        except Exception as exception:
+            # Start over from whatever is in memory, like an unreadable cache.csv has always been handled. The original file is still in cache.csv.backup.
+            print( ('Warning: Reinitalizing cache due to error reading input cache.csv: ' + self.fileNameAndPath + ' ' + str(exception)).encode(consoleEncoding) )
+            with lock:
+                self.discardEntriesOnDisk=True
+                cacheCompactionRequested=True
+        finally:
+            self.loading=False
+            self.loaded.set()
+
+    def getMany(self, rawTextList):
+        return {}
+
+    def save(self, newEntries):
+        if len(newEntries) == 0:
+            return
+        # If there is nothing to append to yet, then write a complete file with a header instead.
+        if checkIfThisFileExists(self.fileNameAndPath) != True:
+            writeCsvCacheFile(self.fileNameAndPath, newEntries.items(), self.header)
+            return
+        with openCsvCacheFile(self.fileNameAndPath, 'a') as myOutputFileHandle:
+            myCsvHandle = csv.writer(myOutputFileHandle)
+            for i, k in newEntries.items():
+                myCsvHandle.writerow( [str(i),str(k)] )
+            # For .gz files, this also flushes the compressor so everything written so far can be read back after a crash.
+            myOutputFileHandle.flush()
+            os.fsync( myOutputFileHandle.fileno() )
+        print( ('Appended ' + str(len(newEntries)) + ' new entries to cache at: ' + self.fileNameAndPath).encode(consoleEncoding) )
+
+    def compact(self, allEntries, newEntries):
+        if (self.discardEntriesOnDisk != True) and (self.cacheDictionary.evictions != 0) and (checkIfThisFileExists(self.fileNameAndPath) == True):
+            # Some entries were evicted from memory, so allEntries is not the whole cache. Keep whatever is only on disk.
+            writeCsvCacheFile(self.fileNameAndPath, self.mergeWithEntriesOnDisk(allEntries), self.header)
+        else:
+            writeCsvCacheFile(self.fileNameAndPath, allEntries.items(), self.header)
+        self.discardEntriesOnDisk=False
+
+    # Stream the entries on disk that are not in allEntries, and then every entry in allEntries.
+    # writeCsvCacheFile() writes to a temporary file first, so reading the current file at the same time is safe.
+    def mergeWithEntriesOnDisk(self, allEntries):
+        for rawText, translatedText in readCsvCacheFile(self.fileNameAndPath):
+            if rawText not in allEntries:
+                yield rawText, translatedText
+        for entry in allEntries.items():
+            yield entry
+
+    # Call this while holding cacheLock so that a background load cannot add anything after translationCacheDictionary was cleared.
+    def clear(self):
+        # The file on disk is replaced on the next save.
+        self.discardEntriesOnDisk=True
+        self.loadingCancelled=True
+
+    def count(self):
+        return len(self.cacheDictionary)
+
+    def iterateEntries(self):
+        if (self.cacheDictionary.evictions == 0) and (self.loading != True):
+            with self.lock:
+                return iter( list( self.cacheDictionary.items() ) )
+        # Some entries are only on disk, or have not been loaded yet. Everything in memory was already written out by cacheWriter, so the file has every entry.
+        entries={}
+        for rawText, translatedText in readCsvCacheFile(self.fileNameAndPath):
+            entries[rawText]=translatedText
+        return iter( entries.items() )
+
+    def getPage(self, cursor, limit):
+        return getSortedCachePage(self.iterateEntries(), cursor, limit)
+
+    def exportCsv(self, fileNameAndPath):
+        writeCsvCacheFile(fileNameAndPath, self.iterateEntries(), self.header)
+
+
+# SqliteCacheStore keeps the cache in cache.sqlite3, shared by all models and keyed by the full model hash and rawText.
+# Entries are only read into memory when they are requested, and saving only upserts the entries added since the last save, so neither startup nor saving depends on the total size of the cache.
+# The connection is shared by the I/O loop and other threads, so every access goes through self.lock.
+class SqliteCacheStore:
+    entriesAreInMemory=False
+    loading=False
+    # Older versions of SQLite limit the number of ? parameters in a single statement to 999.
+    maxParametersPerQuery=900
+
+    def __init__(self, fileNameAndPath, modelHashFull):
+        self.fileNameAndPath=fileNameAndPath
+        self.modelHashFull=modelHashFull
+        self.lock=threading.Lock()
+        self.reopen()
+        with self.lock:
+            self.connection.execute( 'PRAGMA journal_mode=WAL' )
+            self.connection.execute( 'CREATE TABLE IF NOT EXISTS translationCache (modelHash TEXT NOT NULL, rawText TEXT NOT NULL, translatedText TEXT, PRIMARY KEY (modelHash, rawText)) WITHOUT ROWID' )
+            self.connection.commit()
+
+    # sqlite connections must not be carried across fork(), so --httpProcesses closes the connection before forking and every HTTP process calls reopen() to get its own.
+    def reopen(self):
+        self.connection=sqlite3.connect(self.fileNameAndPath, check_same_thread=False)
+
+    def close(self):
+        with self.lock:
+            if self.connection != None:
+                self.connection.close()
+                self.connection=None
+
+    def load(self, translationCacheDictionary):
+        pass
+
+    def getMany(self, rawTextList):
+        entries={}
+        with self.lock:
+            for i in range(0, len(rawTextList), self.maxParametersPerQuery):
+                chunk=rawTextList[ i : i + self.maxParametersPerQuery ]
+                query='SELECT rawText, translatedText FROM translationCache WHERE modelHash=? AND rawText IN (' + ','.join( ['?'] * len(chunk) ) + ')'
+                for rawText, translatedText in self.connection.execute( query, [self.modelHashFull] + chunk ):
+                    entries[rawText]=translatedText
+        return entries
+
+    def save(self, newEntries):
+        if len(newEntries) == 0:
+            return
+        self.upsert( newEntries.items() )
+        print( ('Wrote ' + str(len(newEntries)) + ' new entries to cache at: ' + self.fileNameAndPath).encode(consoleEncoding) )
+
+    # Every saved entry is already in the database, so write newEntries and then just fold the write-ahead log back into the main database file.
+    def compact(self, allEntries, newEntries):
+        self.save(newEntries)
+        with self.lock:
+            self.connection.execute( 'PRAGMA wal_checkpoint(TRUNCATE)' )
+
+    def upsert(self, entries):
+        with self.lock:
+            self.connection.executemany( 'INSERT OR REPLACE INTO translationCache (modelHash, rawText, translatedText) VALUES (?, ?, ?)', ( (self.modelHashFull, rawText, translatedText) for rawText, translatedText in entries ) )
+            self.connection.commit()
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute( 'DELETE FROM translationCache WHERE modelHash=?', (self.modelHashFull,) )
+            self.connection.commit()
+
+    def count(self):
+        with self.lock:
+            return self.connection.execute( 'SELECT COUNT(*) FROM translationCache WHERE modelHash=?', (self.modelHashFull,) ).fetchone()[0]
+
+    # Read the table in pages ordered by rawText so that the lock is never held for long and the I/O loop can keep serving requests in between.
+    def iterateEntries(self, pageSize=10000, cursor=''):
+        lastRawText=cursor
+        while True:
+            with self.lock:
+                page=self.connection.execute( 'SELECT rawText, translatedText FROM translationCache WHERE modelHash=? AND rawText > ? ORDER BY rawText LIMIT ?', (self.modelHashFull, lastRawText, pageSize) ).fetchall()
+            for entry in page:
+                yield entry
+            if len(page) < pageSize:
+                return
+            lastRawText=page[-1][0]
+
+    # rawText is the primary key, so this is read straight from the index. sqlite compares text by UTF-8 bytes, which is the same order as Python.
+    def getPage(self, cursor, limit):
+        if limit == 0:
+            return list( self.iterateEntries(cursor=cursor) )
+        with self.lock:
+            return self.connection.execute( 'SELECT rawText, translatedText FROM translationCache WHERE modelHash=? AND rawText > ? ORDER BY rawText LIMIT ?', (self.modelHashFull, cursor, limit) ).fetchall()
+
+    def exportCsv(self, fileNameAndPath):
+        writeCsvCacheFile(fileNameAndPath, self.iterateEntries())
+
+    # Stream an existing cache.csv into the database in batches without loading all of it into memory.
+    def importCsv(self, fileNameAndPath, batchSize=10000):
+        batch=[]
+        for entry in readCsvCacheFile(fileNameAndPath):
+            batch.append(entry)
+            if len(batch) >= batchSize:
+                self.upsert(batch)
+                batch=[]
+        if len(batch) != 0:
+            self.upsert(batch)
+
+
+# BinaryCacheStore keeps the cache in cache.hash.bin, a snapshot that is memory mapped instead of read, so opening it takes the same time no matter how many entries it has, and entries are only decoded when they are requested.
+# Every process that maps the same snapshot shares one copy of it in the OS page cache.
+# Entries added since the last snapshot are appended to cache.hash.bin.journal.csv and kept in journalEntries. Compacting writes a new snapshot with every entry and empties the journal.
+# The layout of cache.hash.bin is, with every integer in little endian:
+#   header: magic, version, entryCount, bucketCount, indexOffset
+#   records: keyLength, valueLength, then the rawText and translatedText as UTF-8. valueLength is noValue if translatedText is None.
+#   index at indexOffset: bucketCount slots of [ keyHash, recordOffset ] using linear probing. recordOffset 0 means the slot is empty.
+# lock guards the mapping and journalEntries. compactionLock keeps the snapshot from being replaced or deleted while it is being read from start to end.
+class BinaryCacheStore:
+    entriesAreInMemory=False
+    loading=False
+    snapshotHeader=struct.Struct('<8sIQQQ')
+    snapshotMagic=b'P3TSCACH'
+    snapshotVersion=1
+    recordHeader=struct.Struct('<II')
+    indexSlot=struct.Struct('<QQ')
+    noValue=0xFFFFFFFF
+
+    def __init__(self, fileNameAndPath, header=None):
+        self.fileNameAndPath=fileNameAndPath
+        self.journal=CsvCacheStore(fileNameAndPath + '.journal.csv', header)
+        self.lock=threading.Lock()
+        self.compactionLock=threading.Lock()
+        # iterateEntries() reads the snapshot a page at a time without holding a lock in between, so compact() does not replace the snapshot while any readers are using it, and clear() changes generation to tell them to stop.
+        self.readers=0
+        self.generation=0
+        self.fileHandle=None
+        self.map=None
+        self.entryCount=0
+        self.bucketCount=0
+        self.indexOffset=0
+        self.open()
+        self.journalEntries={}
+        if checkIfThisFileExists(self.journal.fileNameAndPath) == True:
+            for rawText, translatedText in readCsvCacheFile(self.journal.fileNameAndPath):
+                self.journalEntries[rawText]=translatedText
+
+    def open(self):
+        if checkIfThisFileExists(self.fileNameAndPath) != True:
+            return
+        self.fileHandle=open(self.fileNameAndPath, 'rb')
+        try:
+            self.map=mmap.mmap(self.fileHandle.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, self.entryCount, self.bucketCount, self.indexOffset = self.snapshotHeader.unpack_from(self.map, 0)
+            if (magic != self.snapshotMagic) or (version != self.snapshotVersion):
+                raise ValueError( 'Not a version ' + str(self.snapshotVersion) + ' cache snapshot: ' + self.fileNameAndPath )
+        except:
+            self.close()
+            raise
+
+    def close(self):
+        if self.map != None:
+            self.map.close()
+        if self.fileHandle != None:
+            self.fileHandle.close()
+        self.fileHandle=None
+        self.map=None
+        self.entryCount=0
+        self.bucketCount=0
+        self.indexOffset=0
+
+    def hashKey(self, keyBytes):
+        return int.from_bytes( hashlib.blake2b(keyBytes, digest_size=8).digest(), 'little' )
+
+    # Return [ True, translatedText ] if rawText is in the snapshot, or [ False, None ] if it is not. Only call this while holding self.lock.
+    def find(self, rawText):
+        if self.map == None:
+            return [ False, None ]
+        keyBytes=rawText.encode('utf-8')
+        keyHash=self.hashKey(keyBytes)
+        mask=self.bucketCount - 1
+        slot=keyHash & mask
+        while True:
+            storedHash, offset = self.indexSlot.unpack_from(self.map, self.indexOffset + slot * self.indexSlot.size)
+            if offset == 0:
+                return [ False, None ]
+            if storedHash == keyHash:
+                keyLength, valueLength = self.recordHeader.unpack_from(self.map, offset)
+                keyStart=offset + self.recordHeader.size
+                if self.map[ keyStart : keyStart + keyLength ] == keyBytes:
+                    if valueLength == self.noValue:
+                        return [ True, None ]
+                    return [ True, self.map[ keyStart + keyLength : keyStart + keyLength + valueLength ].decode('utf-8') ]
+            slot=(slot + 1) & mask
+
+    # Return the record at offset in the snapshot as rawText, translatedText and the offset of the next record.
+    def readRecord(self, offset):
+        keyLength, valueLength = self.recordHeader.unpack_from(self.map, offset)
+        offset += self.recordHeader.size
+        rawText=self.map[ offset : offset + keyLength ].decode('utf-8')
+        offset += keyLength
+        if valueLength == self.noValue:
+            translatedText=None
+        else:
+            translatedText=self.map[ offset : offset + valueLength ].decode('utf-8')
+            offset += valueLength
+        return rawText, translatedText, offset
+
+    # Yield every entry in the snapshot in the order it was written. Only call this while holding self.compactionLock.
+    def iterateSnapshot(self):
+        if self.map == None:
+            return
+        offset=self.snapshotHeader.size
+        for counter in range(self.entryCount):
+            rawText, translatedText, offset = self.readRecord(offset)
+            yield rawText, translatedText
+
+    # Write entries, which must not contain the same rawText twice, as a new snapshot at fileNameAndPath and return the number of entries written.
+    # The index is built after the records since the number of entries is not known ahead of time. The hashes and offsets are kept in arrays so that they only take 16 bytes per entry.
+    def writeSnapshot(self, fileNameAndPath, entries):
+        keyHashes=array.array('Q')
+        recordOffsets=array.array('Q')
+        with open(fileNameAndPath, 'wb') as myOutputFileHandle:
+            myOutputFileHandle.write( bytes(self.snapshotHeader.size) )
+            offset=self.snapshotHeader.size
+            for rawText, translatedText in entries:
+                keyBytes=str(rawText).encode('utf-8')
+                if translatedText == None:
+                    valueBytes=b''
+                    valueLength=self.noValue
+                else:
+                    valueBytes=str(translatedText).encode('utf-8')
+                    valueLength=len(valueBytes)
+                myOutputFileHandle.write( self.recordHeader.pack(len(keyBytes), valueLength) )
+                myOutputFileHandle.write(keyBytes)
+                myOutputFileHandle.write(valueBytes)
+                keyHashes.append( self.hashKey(keyBytes) )
+                recordOffsets.append(offset)
+                offset += self.recordHeader.size + len(keyBytes) + len(valueBytes)
+
+            # Keep the index at most half full so that probing stays short.
+            bucketCount=16
+            while bucketCount < 2 * len(recordOffsets):
+                bucketCount *= 2
+            mask=bucketCount - 1
+            index=bytearray( bucketCount * self.indexSlot.size )
+            for counter in range( len(recordOffsets) ):
+                slot=keyHashes[counter] & mask
+                while self.indexSlot.unpack_from(index, slot * self.indexSlot.size)[1] != 0:
+                    slot=(slot + 1) & mask
+                self.indexSlot.pack_into(index, slot * self.indexSlot.size, keyHashes[counter], recordOffsets[counter])
+            myOutputFileHandle.write(index)
+
+            myOutputFileHandle.seek(0)
+            myOutputFileHandle.write( self.snapshotHeader.pack(self.snapshotMagic, self.snapshotVersion, len(recordOffsets), bucketCount, offset) )
+            myOutputFileHandle.flush()
+            os.fsync( myOutputFileHandle.fileno() )
+        return len(recordOffsets)
+
+    def load(self, translationCacheDictionary):
+        pass
+
+    def getMany(self, rawTextList):
+        entries={}
+        with self.lock:
+            for rawText in rawTextList:
+                if rawText in self.journalEntries:
+                    entries[rawText]=self.journalEntries[rawText]
+                    continue
+                found, translatedText = self.find(rawText)
+                if found == True:
+                    entries[rawText]=translatedText
+        return entries
+
+    def save(self, newEntries):
+        if len(newEntries) == 0:
+            return
+        self.journal.save(newEntries)
+        with self.lock:
+            self.journalEntries.update(newEntries)
+
+    # Merge the snapshot, the journal, allEntries and newEntries into a new snapshot. Newer entries replace older ones with the same rawText.
+    # The new snapshot is written to a temporary file while lookups continue to use the old one. The old mapping has to be closed before it can be replaced on Windows, so lookups only wait for the swap itself.
+    # Returns False, without changing anything, if iterateEntries() is still reading the current snapshot. The caller should try again later.
+    def compact(self, allEntries, newEntries):
+        with self.compactionLock:
+            with self.lock:
+                if self.readers > 0:
+                    return False
+                newerEntries=dict(self.journalEntries)
+            newerEntries.update(allEntries)
+            newerEntries.update(newEntries)
+
+            def mergedEntries():
+                for rawText, translatedText in self.iterateSnapshot():
+                    if rawText not in newerEntries:
+                        yield rawText, translatedText
+                for entry in newerEntries.items():
+                    yield entry
+
+            temporaryFileNameAndPath=self.fileNameAndPath + '.temp'
+            entryCount=self.writeSnapshot(temporaryFileNameAndPath, mergedEntries())
+            with self.lock:
+                if self.readers > 0:
+                    os.remove(temporaryFileNameAndPath)
+                    return False
+                self.close()
+                pathlib.Path(temporaryFileNameAndPath).replace(self.fileNameAndPath)
+                self.open()
+                # Only cacheWriter's thread calls save(), and it is the one running this, so nothing was added to the journal in the meantime.
+                self.journalEntries={}
+                if checkIfThisFileExists(self.journal.fileNameAndPath) == True:
+                    os.remove(self.journal.fileNameAndPath)
+        print( ('Wrote ' + str(entryCount) + ' entries to cache snapshot at: ' + self.fileNameAndPath).encode(consoleEncoding) )
+        return True
+
+    def clear(self):
+        with self.compactionLock:
+            with self.lock:
+                self.generation += 1
+                self.close()
+                self.journalEntries={}
+                for fileNameAndPath in [ self.fileNameAndPath, self.journal.fileNameAndPath ]:
+                    if checkIfThisFileExists(fileNameAndPath) == True:
+                        os.remove(fileNameAndPath)
+
+    def count(self):
+        with self.lock:
+            entryCount=self.entryCount
+            for rawText in self.journalEntries:
+                if self.find(rawText)[0] != True:
+                    entryCount += 1
+        return entryCount
+
+    # The snapshot is read pageSize records at a time, and self.lock is only held while reading each page, so a slow reader never holds up lookups, clear() or the I/O loop.
+    # If the cache is cleared in the meantime, then iteration stops.
+    def iterateEntries(self, pageSize=10000):
+        with self.lock:
+            self.readers += 1
+            generation=self.generation
+            journalEntries=dict(self.journalEntries)
+        try:
+            offset=self.snapshotHeader.size
+            counter=0
+            while True:
+                page=[]
+                with self.lock:
+                    if self.generation != generation:
+                        return
+                    if self.map != None:
+                        while (counter < self.entryCount) and (len(page) < pageSize):
+                            rawText, translatedText, offset = self.readRecord(offset)
+                            page.append( (rawText, translatedText) )
+                            counter += 1
+                if len(page) == 0:
+                    break
+                for rawText, translatedText in page:
+                    if rawText not in journalEntries:
+                        yield rawText, translatedText
+            for entry in journalEntries.items():
+                yield entry
+        finally:
+            with self.lock:
+                self.readers -= 1
+
+    def getPage(self, cursor, limit):
+        return getSortedCachePage(self.iterateEntries(), cursor, limit)
+
+    def exportCsv(self, fileNameAndPath):
+        writeCsvCacheFile(fileNameAndPath, self.iterateEntries(), self.journal.header)
+
+    # The entries in cache.csv have to be deduplicated before they can be written to a snapshot, so this reads all of it into memory once.
+    def importCsv(self, fileNameAndPath):
+        entries={}
+        for rawText, translatedText in readCsvCacheFile(fileNameAndPath):
+            entries[rawText]=translatedText
+        self.compact(entries, {})
+
+
+# Write any entries added since the last save to disk.
+# Normally only cacheEntriesPendingWrite is written. If compact == True, or if compaction was requested by clearCache(), then the on-disk cache is rewritten from a snapshot of translationCacheDictionary instead.
+# This is called from cacheWriter's thread, so it must never be called directly from the I/O loop.
+def writeOutCache(compact=False):
+    # Spaghetti.
+    global cacheEntriesPendingWrite
+    global cacheCompactionRequested
+    with cacheLock:
+        # Compacting rewrites the file from memory, so it has to wait until everything has been loaded. Until then, only append.
+        if (cacheStore.loading == True) and ( (compact == True) or (cacheCompactionRequested == True) ):
+            cacheCompactionRequested=True
+            compact=False
+        if (compact == True) or (cacheCompactionRequested == True):
+            compact=True
+            cacheCompactionRequested=False
+            newEntries=cacheEntriesPendingWrite
+            allEntries=translationCacheDictionary.copy()
+            allEntries.update(newEntries)
+        else:
+            newEntries=cacheEntriesPendingWrite
+        cacheEntriesPendingWrite={}
+
+    try:
+        if compact == True:
+            # BinaryCacheStore postpones compaction while the snapshot is being read by /api/v1/getCache.
+            if cacheStore.compact(allEntries, newEntries) == False:
+                with cacheLock:
+                    newEntries.update(cacheEntriesPendingWrite)
+                    cacheEntriesPendingWrite=newEntries
+                    cacheCompactionRequested=True
+        else:
+            cacheStore.save(newEntries)
+    except:
+        # Put the entries back so that they are not lost and will be retried on the next save.
+        with cacheLock:
+            newEntries.update(cacheEntriesPendingWrite)
+            cacheEntriesPendingWrite=newEntries
+            if compact == True:
+                cacheCompactionRequested=True
+        raise
+
+
+# Writing the cache to disk can take several seconds for large caches, and the server would not answer anything during that time if it happened on the I/O loop.
+# CacheWriter writes the cache in its own thread instead, every saveInterval seconds, and only if there is something new to write. The whole cache is compacted every compactionInterval seconds if anything was written since the last compaction.
+class CacheWriter:
+    def __init__(self, saveInterval, compactionInterval):
+        self.saveInterval=saveInterval
+        self.compactionInterval=compactionInterval
+        self.timeLastCompacted=time.perf_counter()
+        self.writtenSinceCompaction=False
+        # Only one write to disk at a time, whether from the timer or from flush().
+        self.writeLock=threading.Lock()
+        self.wakeUp=threading.Event()
+        self.stopping=False
+        self.thread=threading.Thread( target=self.run, name='cacheWriter', daemon=True )
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while self.stopping != True:
+            self.wakeUp.wait(self.saveInterval)
+            self.wakeUp.clear()
+            if self.stopping == True:
+                break
+            try:
+                self.flush()
+            except Exception as exception:
+                print( ('Warning: An error occured while writing cache to disk: ' + str(exception)).encode(consoleEncoding) )
+
+    def flush(self, compact=False):
+        with self.writeLock:
+            if modelRegistry != None:
+                modelRegistry.writeOutCaches(self.compactionInterval, compact)
+            if (len(cacheEntriesPendingWrite) != 0) or (cacheCompactionRequested == True):
+                self.writtenSinceCompaction=True
+            elif compact != True:
+                return
+
+            if (self.compactionInterval > 0) and (self.writtenSinceCompaction == True) and ( (time.perf_counter() - self.timeLastCompacted) > self.compactionInterval ):
+                compact=True
+            if (compact == True) or (cacheCompactionRequested == True):
+                self.timeLastCompacted=time.perf_counter()
+                self.writtenSinceCompaction=False
+            flushStartTime=time.perf_counter()
+            writeOutCache(compact)
+            serverMetrics.observe( serverMetrics.cacheFlushDuration, time.perf_counter() - flushStartTime )
+
+    # Write out the cache from the default thread pool and wait for it without blocking the I/O loop.
+    async def flushInBackground(self, compact=False):
+        await asyncio.get_running_loop().run_in_executor(None, self.flush, compact)
+
+    # Stop the thread and write out anything still pending. Only call this once the I/O loop has stopped.
+    def stop(self):
+        self.stopping=True
+        self.wakeUp.set()
+        if self.thread.is_alive() == True:
+            self.thread.join()
+        self.flush()
+
+
+# Return a dictionary with the cached translations for any entries in rawTextList.
+# translationCacheDictionary is checked first. Anything not found there is looked up in cacheStore and kept in memory for next time.
+# With --httpProcesses, the other processes add and clear entries in cacheStore, so translationCacheDictionary would go stale. Only the entries from this process that have not been written yet are checked in memory, and everything else comes from cacheStore.
+# Reading from sqlite or binary blocks, so cacheStore is read from the default thread pool instead of on the I/O loop.
+async def lookupCache(rawTextList):
+    cacheHits={}
+    notInMemory=[]
+    with cacheLock:
+        for i in rawTextList:
+            if cacheSharedBetweenProcesses == True:
+                if i in cacheEntriesPendingWrite:
+                    cacheHits[i]=cacheEntriesPendingWrite[i]
+                else:
+                    notInMemory.append(i)
+            elif i in translationCacheDictionary:
+                cacheHits[i]=translationCacheDictionary[i]
+            else:
+                notInMemory.append(i)
+    if (cacheStore.entriesAreInMemory != True) and (len(notInMemory) != 0):
+        storeHits=await asyncio.get_running_loop().run_in_executor(None, cacheStore.getMany, notInMemory)
+        if cacheSharedBetweenProcesses != True:
+            with cacheLock:
+                translationCacheDictionary.update(storeHits)
+        cacheHits.update(storeHits)
+
+    hits=0
+    for i in rawTextList:
+        if i in cacheHits:
+            hits += 1
+    with cacheLock:
+        translationCacheDictionary.recordLookups(hits, len(rawTextList) - hits)
+    return cacheHits
+
+
+# Add newly translated entries to the cache. cacheWriter writes them to disk later.
+# With --httpProcesses, the other processes can only see entries once they are written, so cacheWriter is woken up to write them right away.
+def addToCache(rawTextList, translatedList):
+    with cacheLock:
+        for i in range( len(rawTextList) ):
+            if cacheSharedBetweenProcesses != True:
+                translationCacheDictionary[ rawTextList[i] ] = translatedList[i]
+            cacheEntriesPendingWrite[ rawTextList[i] ] = translatedList[i]
+    if cacheSharedBetweenProcesses == True:
+        cacheWriter.wakeUp.set()
+
+
+# Parse an import file that is already open in binary mode. importFormat must be csv, json or jsonl.
+# csv uses --cacheFileEncoding like cache.csv does. json and jsonl are always utf-8, with or without a byte order mark.
+def parseImportFile(myBinaryFileHandle, importFormat):
+    if importFormat == 'csv':
+        return parseCsvCacheEntries( io.TextIOWrapper(myBinaryFileHandle, encoding=cacheFileEncoding, errors=inputErrorHandling, newline=''), headerRequired=False )
+    myFileHandle=io.TextIOWrapper(myBinaryFileHandle, encoding='utf-8-sig', errors=inputErrorHandling)
+    if importFormat == 'jsonl':
+        return parseJsonLinesCacheEntries(myFileHandle)
+    return parseJsonCacheEntries(myFileHandle)
+
+
+# Merge entries, an iterable of [rawText, translatedText] pairs, into the cache for /api/v1/importCache and --importCache.
+# conflictPolicy is keep, to leave translations that are already in the cache alone, or replace, to overwrite them.
+# Entries are checked and added batchSize at a time, and written to disk once at the end.
+# This blocks until the whole file has been read, so call it from a thread when the I/O loop is running.
+def importCacheEntries(entries, conflictPolicy, batchSize=10000):
+    # With csv, entries that have not been read from cache.csv yet would be overwritten instead of kept.
+    if cacheStore.loading == True:
+        cacheStore.loaded.wait()
+    entries=iter(entries)
+    counts={ 'read': 0, 'added': 0, 'replaced': 0, 'skipped': 0 }
+    while True:
+        batch=list( itertools.islice(entries, batchSize) )
+        if len(batch) == 0:
+            break
+        counts['read'] += len(batch)
+        # If the same rawText is in the file more than once, the last one is used.
+        batch=dict(batch)
+
+        existing=set()
+        with cacheLock:
+            for rawText in batch:
+                if (rawText in cacheEntriesPendingWrite) or ( (cacheSharedBetweenProcesses != True) and (rawText in translationCacheDictionary) ):
+                    existing.add(rawText)
+        if cacheStore.entriesAreInMemory != True:
+            existing.update( cacheStore.getMany( [ rawText for rawText in batch if rawText not in existing ] ) )
+
+        if conflictPolicy == 'keep':
+            for rawText in existing:
+                del batch[rawText]
+            counts['skipped'] += len(existing)
+        else:
+            counts['replaced'] += len(existing)
+        counts['added'] += len(batch) - len(existing.intersection(batch))
+
+        if len(batch) != 0:
+            addToCache( list( batch.keys() ), list( batch.values() ) )
+    if counts['added'] + counts['replaced'] != 0:
+        cacheWriter.flush()
+    return counts
+
+
+# Return every cache entry as [rawText, translatedText] pairs. For sqlite, await cacheWriter.flushInBackground() first so that the database has the pending entries.
+def iterateCacheEntries():
+    return cacheStore.iterateEntries()
+
+
 def clearCache():
-    global translationCacheDictionary
-    translationCacheDictionary={}
+    global cacheEntriesPendingWrite
+    global cacheCompactionRequested
+    with cacheLock:
+        translationCacheDictionary.clear()
+        cacheEntriesPendingWrite={}
+        # For csv, the appended file still has the old entries, so it must be rewritten on the next write.
+        cacheCompactionRequested=True
+        cacheStore.clear()
     print( 'Cleared cache.' )
 
 if ( __name__ == '__main__' ) and ( cacheEnabled == True ):
     # import libraries specific to handling cache.
     import csv    #i/o cache to disk
     #import hashlib  # Used to identify correct cache.csv on disk and also as a psudo-rng function for temporary writes.
+    if cacheFormat == 'sqlite':
+        import sqlite3    # Part of the standard library. Only needed for --cacheFormat sqlite.
 
+    # Entries are only kept in memory by this process if it is the only one.
+    cacheSharedBetweenProcesses=(httpProcesses != 1)
     # Initialize translationCacheDictionary
-    translationCacheDictionary={}
-    # Initalize timeCacheWasLastWritten
-    timeCacheWasLastWritten=time.perf_counter()
+    translationCacheDictionary=TranslationCacheDictionary(cacheMaxEntries, cacheMaxMemory * 1048576, cacheEvictionPolicy)
+    # Entries added since the last time the cache was written to disk. The syntax is the same as translationCacheDictionary.
+    cacheEntriesPendingWrite={}
+    cacheCompactionRequested=False
+    # cacheLock guards translationCacheDictionary and cacheEntriesPendingWrite while cacheWriter takes its snapshot from another thread.
+    cacheLock=threading.Lock()
+    cacheWriter=CacheWriter(defaultSaveCacheInterval, defaultCacheCompactionInterval)
     timeCacheWasLastCleared=time.perf_counter()
 
     verifyThisFileExists(inputModelFileNameAndPath,'modelNameAndPath')
@@ -477,24 +1864,25 @@ if ( __name__ == '__main__' ) and ( cacheEnabled == True ):
         print('cacheEnabled='+str(cacheEnabled))
     print( 'Attempting to read cache for model: ' + str(inputModelFileNameAndPath) )
 
-    # Dump the work of reading the file onto another process so main process does not have to deal with it.
-    # This is low level code according to the concurrent.futures python docs since that documentation refers to itself as a high-level wrapper for multiprocessing.
-    # https://docs.python.org/3/library/concurrent.futures.html
-    # https://docs.python.org/3/library/multiprocessing.html
-    modelHash=None
-    myQueue = multiprocessing.Queue()
-    lazyHashFunction = multiprocessing.Process(target=lazyHash, args=(inputModelFileNameAndPath,myQueue,) )
-    lazyHashFunction.start()
-    modelHashFull = myQueue.get()
-    lazyHashFunction.join()
-    if modelHashFull == None:
-        sys.exit( ('Error: Could not generate hash from model file.' + str(inputModelFileNameAndPath)).encode(consoleEncoding) )
+    modelHashFull=getModelHash()
     modelHash=modelHashFull[:10] # Truncate hash to make the file name more friendly to file system length limitations.
 
     cacheFilePathOnly=currentScriptPathOnly+'/'+defaultCacheLocation
-    cacheFileNameOnly='cache.'+ modelHash + '.csv' #Hardcoded. Maybe add prefix and postfix variables?
+    cacheFileNameOnly='cache.'+ modelHash + cacheFileExtension #Hardcoded. Maybe add prefix and postfix variables?
     cacheFilePathAndName=cacheFilePathOnly + '/' + cacheFileNameOnly
 
+    # If --cacheCompression was changed since the last run, convert the cache.csv from the old setting once. The old file is left alone.
+    if cacheFileExtension == '.csv.gz':
+        otherCacheFilePathAndName=cacheFilePathOnly + '/' + 'cache.' + modelHash + '.csv'
+    else:
+        otherCacheFilePathAndName=cacheFilePathOnly + '/' + 'cache.' + modelHash + '.csv.gz'
+    if (checkIfThisFileExists(cacheFilePathAndName) != True) and (checkIfThisFileExists(otherCacheFilePathAndName) == True):
+        print( ('Converting ' + otherCacheFilePathAndName + ' to ' + cacheFilePathAndName).encode(consoleEncoding) )
+        try:
+            writeCsvCacheFile(cacheFilePathAndName, readCsvCacheFile(otherCacheFilePathAndName))
+        except Exception as exception:
+            print( ('Warning: Could not convert ' + otherCacheFilePathAndName + ' ' + str(exception)).encode(consoleEncoding) )
+
     if debug == True:#Maybe change this to debug for final settings.
         print( 'modelHash=' + str(modelHash) )
         print( 'cacheFilePathOnly=' + cacheFilePathOnly )
@@ -502,45 +1890,51 @@ if ( __name__ == '__main__' ) and ( cacheEnabled == True ):
     if verbose == True:
         print( 'cacheFilePathAndName=' + cacheFilePathAndName )
 
-    if checkIfThisFileExists(cacheFilePathAndName) ==  True:
-        # Then cache exists. Path to it also already exists.
-        # Read entries to translationCacheDictionary.
-        # If valid then read as normal, but if any error occurs, then print out that there was an error when reading the cache file and just use a new one.
+    if cacheFormat == 'sqlite':
+        pathlib.Path( cacheFilePathOnly ).mkdir( parents = True, exist_ok = True )
+        sqliteCacheFilePathAndName=cacheFilePathOnly + '/' + defaultSqliteCacheFileName
+        if verbose == True:
+            print( 'sqliteCacheFilePathAndName=' + sqliteCacheFilePathAndName )
         try:
-            with open(cacheFilePathAndName, newline='', encoding=cacheFileEncoding, errors=inputErrorHandling) as myFileHandle:
-                csvReader = csv.reader(myFileHandle, strict=True)
-                currentLine=0
-                for line in csvReader:
-                    # Skip first line.
-                    if currentLine == 0:
-                        currentLine+=1
-                    elif currentLine != 0:
-                        #if ignoreWhitespace == True:
-                        for i in range(len(line)):
-                            line[i]=line[i].strip()
-                        if line[1] == '':
-                            line[1] = None
-                        translationCacheDictionary[line[0]]=line[1]
-        except:
-            print( ('Warning: Reinitalizing cache due to error reading input cache.csv: ' + cacheFilePathAndName).encode(consoleEncoding) )
-            translationCacheDictionary={}
-
-        if debug == True:
-            print( ('translationCacheDictionary=' + str(translationCacheDictionary)).encode(consoleEncoding) )
-
-        print( 'Number of entries loaded into cache: ' + str(len(translationCacheDictionary)) )
-
-        # Rename cache file to backup file regardless of I/O errors. File has already been verified to exist. Rename to backup.
-        #print('pie')
+            cacheStore=SqliteCacheStore(sqliteCacheFilePathAndName, modelHashFull)
+            # The first time sqlite is used for a model, bring in any existing cache.csv for it. cache.csv itself is left alone.
+            if (cacheStore.count() == 0) and (checkIfThisFileExists(cacheFilePathAndName) == True):
+                print( ('Importing ' + cacheFilePathAndName + ' into ' + sqliteCacheFilePathAndName).encode(consoleEncoding) )
+                cacheStore.importCsv(cacheFilePathAndName)
+        except sqlite3.Error as exception:
+            sys.exit( ('Error: Unable to open sqlite cache at: ' + sqliteCacheFilePathAndName + ' ' + str(exception)).encode(consoleEncoding) )
+        print( 'Number of entries in cache: ' + str(cacheStore.count()) )
+
+    elif cacheFormat == 'binary':
+        pathlib.Path( cacheFilePathOnly ).mkdir( parents = True, exist_ok = True )
+        binaryCacheFilePathAndName=cacheFilePathOnly + '/' + 'cache.' + modelHash + '.bin'
+        if verbose == True:
+            print( 'binaryCacheFilePathAndName=' + binaryCacheFilePathAndName )
+        try:
+            cacheStore=BinaryCacheStore(binaryCacheFilePathAndName)
+            # The first time binary is used for a model, bring in any existing cache.csv for it. cache.csv itself is left alone.
+            if (cacheStore.count() == 0) and (checkIfThisFileExists(cacheFilePathAndName) == True):
+                print( ('Importing ' + cacheFilePathAndName + ' into ' + binaryCacheFilePathAndName).encode(consoleEncoding) )
+                cacheStore.importCsv(cacheFilePathAndName)
+        except (OSError, ValueError, struct.error) as exception:
+            sys.exit( ('Error: Unable to open binary cache at: ' + binaryCacheFilePathAndName + ' ' + str(exception)).encode(consoleEncoding) )
+        print( 'Number of entries in cache: ' + str(cacheStore.count()) )
+
+    elif checkIfThisFileExists(cacheFilePathAndName) ==  True:
+        cacheStore=CsvCacheStore(cacheFilePathAndName, cacheDictionary=translationCacheDictionary, lock=cacheLock)
+        # Then cache exists. Path to it also already exists.
+        # Keep a copy of the old cache.csv. cache.csv itself is only appended to from now on and rewritten when compacting, so there is no need to rewrite it here.
         cacheBackupFileName=cacheFilePathAndName + '.backup'
-        pathlib.Path(cacheFilePathAndName).replace(cacheBackupFileName) #It might make sense to append the date the backup was made, but could also just leave well enough alone.
-        print ( ('Moved old cache.csv to: ' + cacheBackupFileName).encode(consoleEncoding) )
+        shutil.copyfile(cacheFilePathAndName, cacheBackupFileName)
+        print ( ('Copied old cache.csv to: ' + cacheBackupFileName).encode(consoleEncoding) )
 
-        # So, if the 'old' cache is moved and the still-in-memory-cache is never written out, then the cache will be deleted if the user does not translate at least 1 entry to trigger a cache write. To avoid that weird bug, flush cache here. This is a bit wasteful over just binary copying the file or not moving it until needed, but it also tests to make sure I/O actually works during initalization, so leave it.
-        if len(translationCacheDictionary) > 0:
-            writeOutCache()
+        # Read entries to translationCacheDictionary in the background so the server can start right away.
+        # If any error occurs while reading it, then the error is printed and a new cache is started from whatever was translated in the meantime.
+        print( ('Loading cache in the background from: ' + cacheFilePathAndName).encode(consoleEncoding) )
+        cacheStore.loadInBackground(translationCacheDictionary, cacheLock)
 
     else:
+        cacheStore=CsvCacheStore(cacheFilePathAndName, cacheDictionary=translationCacheDictionary, lock=cacheLock)
         # Then cache does not exist. Create path. File will be created later when writing out entries.
         if verbose == True:
             print( (' Cache file not found. Creating a new one at: '+str(cacheFilePathAndName)).encode(consoleEncoding) )
@@ -580,24 +1974,7 @@ if checkIfThisFileExists(sourceSentencePieceModel) == True:
 
 #if checkIfThisFileExists(sourceSentencePieceModel) != True:
 else: 
-    tempFileName=defaultSentencePieceModelPrefix+sourceLanguage+defaultSentencePieceModelPostfix
-    #tempPath=inputModelPathOnly
-    if checkIfThisFileExists(inputModelPathOnly + '/' + tempFileName) == True:
-        sourceSentencePieceModel=inputModelPathOnly + '/' + tempFileName
-    elif checkIfThisFileExists(inputModelPathOnly + '/../' + tempFileName) == True:
-        sourceSentencePieceModel=inputModelPathOnly + '/../' + tempFileName
-    elif checkIfThisFileExists(inputModelPathOnly+ '/' + defaultSentencePieceModelFolder0 + '/' + tempFileName) == True:
-        sourceSentencePieceModel=inputModelPathOnly+ '/' + defaultSentencePieceModelFolder0 + '/' + tempFileName
-    elif checkIfThisFileExists(inputModelPathOnly+ '/' + defaultSentencePieceModelFolder1 + '/' + tempFileName) == True:
-        sourceSentencePieceModel=inputModelPathOnly+ '/' + defaultSentencePieceModelFolder1 + '/' + tempFileName
-    elif checkIfThisFileExists(inputModelPathOnly+ '/' + defaultSentencePieceModelFolder2 + '/' + tempFileName) == True:
-        sourceSentencePieceModel=inputModelPathOnly+ '/' + defaultSentencePieceModelFolder2 + '/' + tempFileName
-    elif checkIfThisFileExists(inputModelPathOnly+ '/../' + defaultSentencePieceModelFolder0 + '/' + tempFileName) == True:
-        sourceSentencePieceModel=inputModelPathOnly+ '/../' + defaultSentencePieceModelFolder0 + '/' + tempFileName
-    elif checkIfThisFileExists(inputModelPathOnly+ '/../' + defaultSentencePieceModelFolder1 + '/' + tempFileName) == True:
-        sourceSentencePieceModel=inputModelPathOnly+ '/../' + defaultSentencePieceModelFolder1 + '/' + tempFileName
-    elif checkIfThisFileExists(inputModelPathOnly+ '/../' + defaultSentencePieceModelFolder2 + '/' + tempFileName) == True:
-        sourceSentencePieceModel=inputModelPathOnly+ '/../' + defaultSentencePieceModelFolder2 + '/' + tempFileName
+    sourceSentencePieceModel=findSentencePieceModel(inputModelPathOnly, sourceLanguage)
     verifyThisFileExists(sourceSentencePieceModel,'sourceSentencePieceModel')
 
     if __name__ == '__main__':
@@ -629,24 +2006,7 @@ if checkIfThisFileExists(targetSentencePieceModel) == True:
 
 #if checkIfThisFileExists(targetSentencePieceModel) != True
 else:
-    tempFileName=defaultSentencePieceModelPrefix+targetLanguage+defaultSentencePieceModelPostfix
-    #tempPath2=inputModelPathOnly + '/' + tempFileName
-    if checkIfThisFileExists(inputModelPathOnly + '/' + tempFileName) == True:
-        targetSentencePieceModel=inputModelPathOnly + '/' + tempFileName
-    elif checkIfThisFileExists(inputModelPathOnly + '/../' + tempFileName) == True:
-        targetSentencePieceModel=inputModelPathOnly + '/../' + tempFileName
-    elif checkIfThisFileExists(inputModelPathOnly + '/' + defaultSentencePieceModelFolder0 + '/' + tempFileName) == True:
-        targetSentencePieceModel=inputModelPathOnly + '/' + defaultSentencePieceModelFolder0 + '/' + tempFileName
-    elif checkIfThisFileExists(inputModelPathOnly + '/' + defaultSentencePieceModelFolder1 + '/' + tempFileName) == True:
-        targetSentencePieceModel=inputModelPathOnly + '/' + defaultSentencePieceModelFolder1 + '/' + tempFileName
-    elif checkIfThisFileExists(inputModelPathOnly + '/' + defaultSentencePieceModelFolder2 + '/' + tempFileName) == True:
-        targetSentencePieceModel=inputModelPathOnly + '/' + defaultSentencePieceModelFolder2 + '/' + tempFileName
-    elif checkIfThisFileExists(inputModelPathOnly + '/../' + defaultSentencePieceModelFolder0 + '/' + tempFileName) == True:
-        targetSentencePieceModel=inputModelPathOnly + '/../' + defaultSentencePieceModelFolder0 + '/' + tempFileName
-    elif checkIfThisFileExists(inputModelPathOnly + '/../' + defaultSentencePieceModelFolder1 + '/' + tempFileName) == True:
-        targetSentencePieceModel=inputModelPathOnly + '/../' + defaultSentencePieceModelFolder1 + '/' + tempFileName
-    elif checkIfThisFileExists(inputModelPathOnly + '/../' + defaultSentencePieceModelFolder2 + '/' + tempFileName) == True:
-        targetSentencePieceModel=inputModelPathOnly + '/../' + defaultSentencePieceModelFolder2 + '/' + tempFileName
+    targetSentencePieceModel=findSentencePieceModel(inputModelPathOnly, targetLanguage)
     #The target is optional for fairseq, but required for ctranslate2.
     if mode == 'ctranslate2':
         verifyThisFileExists(targetSentencePieceModel,'targetSentencePieceModel')
@@ -655,6 +2015,336 @@ else:
         print( ('Set targetSentencePieceModel to \'' + str(targetSentencePieceModel) + '\' from: \'' + targetLanguage + '\'.').encode(consoleEncoding) )
 
 
+# A CTranslate2 model from --models. Its translator and sentencepiece processors are only loaded by ModelRegistry while the model is needed.
+# Each model has its own cache, keyed by the hash of its own model file, in the same format as the main cache. cacheWriter writes it out along with the main cache.
+class RegisteredModel:
+    def __init__(self, modelPath, sourceLanguage, targetLanguage, sourceSentencePieceModel=None, targetSentencePieceModel=None):
+        modelPathObject=pathlib.Path(modelPath).absolute()
+        if checkIfThisFileExists(modelPath) == True:
+            self.modelFileNameAndPath=str(modelPathObject)
+            self.modelPathOnly=str(modelPathObject.parent)
+        else:
+            verifyThisFolderExists(modelPath, modelPath)
+            self.modelPathOnly=str(modelPathObject)
+            self.modelFileNameAndPath=self.modelPathOnly + '/' + defaultCTranslate2ModelName
+        verifyThisFileExists(self.modelFileNameAndPath, self.modelFileNameAndPath)
+        self.modelNameWithoutPath=pathlib.Path(self.modelPathOnly).name
+        self.sourceLanguage=sourceLanguage
+        self.targetLanguage=targetLanguage
+
+        if sourceSentencePieceModel == None:
+            sourceSentencePieceModel=findSentencePieceModel(self.modelPathOnly, sourceLanguage)
+        if targetSentencePieceModel == None:
+            targetSentencePieceModel=findSentencePieceModel(self.modelPathOnly, targetLanguage)
+        verifyThisFileExists(sourceSentencePieceModel, 'sourceSentencePieceModel for ' + modelPath)
+        verifyThisFileExists(targetSentencePieceModel, 'targetSentencePieceModel for ' + modelPath)
+        self.sourceSentencePieceModel=sourceSentencePieceModel
+        self.targetSentencePieceModel=targetSentencePieceModel
+
+        # CTranslate2 memory maps model.bin, so the file sizes are a reasonable estimate of the memory used once it is loaded.
+        self.memoryEstimate=( os.path.getsize(self.modelFileNameAndPath) + os.path.getsize(sourceSentencePieceModel) + os.path.getsize(targetSentencePieceModel) ) / 1048576
+
+        self.translator=None
+        self.sourceLanguageProcessor=None
+        self.targetLanguageProcessor=None
+        # inUse counts the requests using the model right now. Models that are in use are never unloaded.
+        self.inUse=0
+        self.timeLastUsed=0
+        self.timesLoaded=0
+        # Created by ModelRegistry.
+        self.translationScheduler=None
+
+        self.modelHashFull=None
+        self.cacheStore=None
+        self.cacheDictionary=None
+        self.cacheEntriesPendingWrite={}
+        self.cacheLock=threading.Lock()
+        self.timeCacheLastCompacted=time.perf_counter()
+        self.cacheWrittenSinceCompaction=False
+
+    def isLoaded(self):
+        return self.translator != None
+
+    # This runs in a thread since it blocks. Hashing the model reads the entire file, so the cache is only opened the first time.
+    def load(self):
+        print( ('Loading model for ' + self.sourceLanguage + '->' + self.targetLanguage + ': ' + self.modelPathOnly).encode(consoleEncoding) )
+        self.sourceLanguageProcessor = sentencepiece.SentencePieceProcessor(self.sourceSentencePieceModel)
+        self.targetLanguageProcessor = sentencepiece.SentencePieceProcessor(self.targetSentencePieceModel)
+        self.translator=ctranslate2.Translator(self.modelPathOnly, device=device, inter_threads=inter_threads, intra_threads=intra_threads)
+        self.timesLoaded += 1
+
+    # The memory is returned once the last reference to the translator is gone. The cache stays open.
+    def unload(self):
+        print( ('Unloading model for ' + self.sourceLanguage + '->' + self.targetLanguage + ': ' + self.modelPathOnly).encode(consoleEncoding) )
+        self.translator=None
+        self.sourceLanguageProcessor=None
+        self.targetLanguageProcessor=None
+
+    def openCache(self):
+        self.modelHashFull=getModelHash(self.modelFileNameAndPath)
+        self.cacheDictionary=TranslationCacheDictionary(cacheMaxEntries, cacheMaxMemory * 1048576, cacheEvictionPolicy)
+        if cacheFormat == 'sqlite':
+            self.cacheStore=SqliteCacheStore(sqliteCacheFilePathAndName, self.modelHashFull)
+            print( ('Number of entries in cache for ' + self.modelNameWithoutPath + ': ' + str(self.cacheStore.count())).encode(consoleEncoding) )
+            return
+        if cacheFormat == 'binary':
+            self.cacheStore=BinaryCacheStore(cacheFilePathOnly + '/' + 'cache.' + self.modelHashFull[:10] + '.bin', self.modelNameWithoutPath + '.' + self.modelHashFull)
+            # A journal left over from the last run has not been compacted yet.
+            self.cacheWrittenSinceCompaction=( len(self.cacheStore.journalEntries) != 0 )
+            print( ('Number of entries in cache for ' + self.modelNameWithoutPath + ': ' + str(self.cacheStore.count())).encode(consoleEncoding) )
+            return
+
+        cacheFileNameAndPath=cacheFilePathOnly + '/' + 'cache.' + self.modelHashFull[:10] + cacheFileExtension
+        self.cacheStore=CsvCacheStore(cacheFileNameAndPath, self.modelNameWithoutPath + '.' + self.modelHashFull, self.cacheDictionary, self.cacheLock)
+        if checkIfThisFileExists(cacheFileNameAndPath) == True:
+            try:
+                self.cacheStore.load(self.cacheDictionary, self.cacheLock)
+            except:
+                print( ('Warning: Ignoring cache due to error reading: ' + cacheFileNameAndPath).encode(consoleEncoding) )
+                self.cacheDictionary.clear()
+        print( ('Number of entries loaded into cache for ' + self.modelNameWithoutPath + ': ' + str(len(self.cacheDictionary))).encode(consoleEncoding) )
+
+    # Same as lookupCache() and addToCache(), but for this model's cache.
+    async def lookupCache(self, rawTextList):
+        cacheHits={}
+        notInMemory=[]
+        with self.cacheLock:
+            for i in rawTextList:
+                if cacheSharedBetweenProcesses == True:
+                    if i in self.cacheEntriesPendingWrite:
+                        cacheHits[i]=self.cacheEntriesPendingWrite[i]
+                    else:
+                        notInMemory.append(i)
+                elif i in self.cacheDictionary:
+                    cacheHits[i]=self.cacheDictionary[i]
+                else:
+                    notInMemory.append(i)
+        if (self.cacheStore.entriesAreInMemory != True) and (len(notInMemory) != 0):
+            storeHits=await asyncio.get_running_loop().run_in_executor(None, self.cacheStore.getMany, notInMemory)
+            if cacheSharedBetweenProcesses != True:
+                with self.cacheLock:
+                    self.cacheDictionary.update(storeHits)
+            cacheHits.update(storeHits)
+
+        hits=0
+        for i in rawTextList:
+            if i in cacheHits:
+                hits += 1
+        with self.cacheLock:
+            self.cacheDictionary.recordLookups(hits, len(rawTextList) - hits)
+        return cacheHits
+
+    def addToCache(self, rawTextList, translatedList):
+        with self.cacheLock:
+            for i in range( len(rawTextList) ):
+                if cacheSharedBetweenProcesses != True:
+                    self.cacheDictionary[ rawTextList[i] ] = translatedList[i]
+                self.cacheEntriesPendingWrite[ rawTextList[i] ] = translatedList[i]
+        if cacheSharedBetweenProcesses == True:
+            cacheWriter.wakeUp.set()
+
+    # Called from cacheWriter's thread. Like writeOutCache() for the main cache, compact == True rewrites the csv file or binary snapshot from scratch, so appended entries and the binary journal do not grow forever.
+    def writeOutCache(self, compact=False):
+        with self.cacheLock:
+            newEntries=self.cacheEntriesPendingWrite
+            self.cacheEntriesPendingWrite={}
+            if compact == True:
+                allEntries=self.cacheDictionary.copy()
+                allEntries.update(newEntries)
+        try:
+            if compact == True:
+                self.timeCacheLastCompacted=time.perf_counter()
+                if self.cacheStore.compact(allEntries, newEntries) == False:
+                    # Postponed because /api/v1/getCache is reading the snapshot. Try again on the next write.
+                    self.timeCacheLastCompacted=float('-inf')
+                    self.cacheStore.save(newEntries)
+                    self.cacheWrittenSinceCompaction=True
+                else:
+                    self.cacheWrittenSinceCompaction=False
+            else:
+                self.cacheStore.save(newEntries)
+                if len(newEntries) != 0:
+                    self.cacheWrittenSinceCompaction=True
+        except:
+            with self.cacheLock:
+                newEntries.update(self.cacheEntriesPendingWrite)
+                self.cacheEntriesPendingWrite=newEntries
+            raise
+
+    # translateInPipeline() runs this in ModelRegistry's inferenceExecutor, like preloadModelTranslate() for the model from the command prompt.
+    def translateTokenized(self, tokenizedList):
+        return translateTokenizedBatch( self.translator, tokenizedList )
+
+    # Same as countTokens(), for this model's translationScheduler.
+    def countTokens(self, textList):
+        tokenCount=0
+        for i in self.sourceLanguageProcessor.encode(textList):
+            tokenCount += len(i)
+        return tokenCount
+
+    def summary(self):
+        return {
+            'sourceLanguage': self.sourceLanguage,
+            'targetLanguage': self.targetLanguage,
+            'model': 'ctranslate2/' + self.modelNameWithoutPath,
+            'loaded': self.isLoaded(),
+            'memoryEstimateMB': round(self.memoryEstimate, 1),
+            'timesLoaded': self.timesLoaded,
+            }
+
+
+# Routes requests for the language pairs from --models to their RegisteredModel, loads each model the first time it is needed, and unloads the least recently used ones once the loaded models are over memoryBudget MB.
+# The models share their own InferenceExecutor, separate from the one for the model from the command prompt, so a slow model load or a busy language pair does not hold up the main one.
+# This uses asyncio objects, so it is created in main().
+class ModelRegistry:
+    def __init__(self, registeredModels, memoryBudget):
+        self.models={}
+        for model in registeredModels:
+            self.models[ (model.sourceLanguage, model.targetLanguage) ] = model
+        self.memoryBudget=memoryBudget
+        # Only one model is loaded or unloaded at a time.
+        self.loadLock=asyncio.Lock()
+        # Opening a cache hashes the model and, for csv, reads the whole cache, so each model has its own lock for that instead of holding up loadLock.
+        self.cacheLocks={ key: asyncio.Lock() for key in self.models }
+        self.inferenceExecutor=InferenceExecutor(inferenceSlots, inferenceMaxQueue)
+        # Every model merges its own concurrent requests, and runs them through the same tokenizer pipeline as the model from the command prompt.
+        for model in self.models.values():
+            model.translationScheduler=MicroBatchScheduler(batchWindow, batchMaxSentences, batchMaxTokens, lambda translateMe, model=model: self.translateWithModel(model, translateMe), model.countTokens)
+        self.cacheOpener=None
+
+    # Open every cache in the background at startup, so the first request for each pair usually does not have to wait for it.
+    def start(self):
+        if cacheEnabled == True:
+            self.cacheOpener=asyncio.create_task( self.openCaches() )
+
+    async def openCaches(self):
+        for model in self.models.values():
+            try:
+                await self.openCache(model)
+            except Exception as exception:
+                print( ('Warning: Unable to open cache for ' + model.modelPathOnly + ' ' + str(exception)).encode(consoleEncoding) )
+
+    async def openCache(self, model):
+        async with self.cacheLocks[ (model.sourceLanguage, model.targetLanguage) ]:
+            if model.cacheStore == None:
+                await asyncio.get_running_loop().run_in_executor(None, model.openCache)
+
+    def get(self, sourceLanguage, targetLanguage):
+        return self.models.get( (sourceLanguage, targetLanguage) )
+
+    def loadedMemory(self):
+        memoryUsed=0
+        for model in self.models.values():
+            if model.isLoaded() == True:
+                memoryUsed += model.memoryEstimate
+        return memoryUsed
+
+    # Unload idle models, least recently used first, until memoryNeeded more MB fits in memoryBudget. A model that does not fit even after that is still loaded.
+    def makeRoomFor(self, memoryNeeded):
+        idleModels=[ model for model in self.models.values() if (model.isLoaded() == True) and (model.inUse == 0) ]
+        for model in sorted(idleModels, key=lambda model: model.timeLastUsed):
+            if self.loadedMemory() + memoryNeeded <= self.memoryBudget:
+                return
+            model.unload()
+        if self.loadedMemory() + memoryNeeded > self.memoryBudget:
+            print( 'Warning: Loading another model will go over --modelMemoryBudget since the models that are still loaded are in use.' )
+
+    # Only loading and unloading wait for loadLock, so requests for a model that is already loaded are not held up while another pair's model loads.
+    async def acquire(self, model):
+        if cacheEnabled == True:
+            await self.openCache(model)
+        if model.isLoaded() != True:
+            async with self.loadLock:
+                if model.isLoaded() != True:
+                    if self.memoryBudget > 0:
+                        self.makeRoomFor(model.memoryEstimate)
+                    await asyncio.get_running_loop().run_in_executor(None, model.load)
+        # Nothing is awaited between isLoaded() and here, so makeRoomFor() cannot unload the model before it is marked as in use.
+        model.inUse += 1
+        model.timeLastUsed=time.perf_counter()
+
+    def release(self, model):
+        model.inUse -= 1
+
+    # The engine for model.translationScheduler. The model is in use by every request in the batch, so it stays loaded until this returns.
+    async def translateWithModel(self, model, translateMe):
+        print( ('Using ctranslate2 in \'' + device + '\' mode with ' + model.modelNameWithoutPath + ' for ' + str(len(translateMe)) + ' entries.').encode(consoleEncoding) )
+        return await translateInPipeline(translateMe, self.inferenceExecutor, model.translateTokenized, model.sourceLanguageProcessor, model.targetLanguageProcessor)
+
+    # Translate rawInput with model and return one translation per entry. Like MainHandler.post(), cache hits are not translated again, and model.translationScheduler merges concurrent requests and only translates duplicates once.
+    async def translate(self, model, rawInput):
+        await self.acquire(model)
+        try:
+            translatedDictionary={}
+            if cacheEnabled == True:
+                translatedDictionary=await model.lookupCache(rawInput)
+                if verbose == True:
+                    print( 'Number of cache hits=' + str( len(translatedDictionary) ) )
+            translateMe=[ i for i in rawInput if i not in translatedDictionary ]
+            if len(translateMe) != 0:
+                postTranslatedList=await model.translationScheduler.translate(translateMe)
+                if cacheEnabled == True:
+                    model.addToCache(translateMe, postTranslatedList)
+                translatedDictionary.update( zip(translateMe, postTranslatedList) )
+            return [ translatedDictionary[i] for i in rawInput ]
+        finally:
+            self.release(model)
+
+    # Called from cacheWriter's thread.
+    # The caches are compacted on the same schedule as the cache for the model from the command prompt: every compactionInterval seconds if anything was written since the last compaction, or whenever compact == True.
+    def writeOutCaches(self, compactionInterval=0, compact=False):
+        for model in self.models.values():
+            if model.cacheStore == None:
+                continue
+            compactModel=False
+            if (model.cacheWrittenSinceCompaction == True) or (len(model.cacheEntriesPendingWrite) != 0):
+                if (compact == True) or ( (compactionInterval > 0) and (time.perf_counter() - model.timeCacheLastCompacted > compactionInterval) ):
+                    compactModel=True
+            if (compactModel == True) or (len(model.cacheEntriesPendingWrite) != 0):
+                model.writeOutCache(compactModel)
+
+    def summary(self):
+        return [ model.summary() for model in self.models.values() ]
+
+    def shutdown(self):
+        if self.cacheOpener != None:
+            self.cacheOpener.cancel()
+        self.inferenceExecutor.shutdown()
+
+
+# Read --models. The syntax of the file is a list of:
+# { "modelPath": "path/to/ctranslate2/model", "sourceLanguage": "zh", "targetLanguage": "en" }
+# with optional "sourceSentencePieceModel" and "targetSentencePieceModel" entries. Like at the command prompt, the sentencepiece models are found from the languages if they are not specified.
+registeredModels=[]
+if ( __name__ == '__main__' ) and ( modelsFile != None ):
+    verifyThisFileExists(modelsFile, 'models')
+    try:
+        import ctranslate2
+        import sentencepiece
+    except ImportError:
+        sys.exit( 'Error: --models requires ctranslate2 and sentencepiece. Please install them with: pip install ctranslate2 sentencepiece' )
+    try:
+        with open(modelsFile, 'r', encoding=defaultFileEncoding, errors=inputErrorHandling) as myFileHandle:
+            modelsList=json.load(myFileHandle)
+    except ValueError as exception:
+        sys.exit( ('Error: Unable to read --models file: ' + modelsFile + ' ' + str(exception)).encode(consoleEncoding) )
+    if not isinstance(modelsList, list):
+        sys.exit( 'Error: --models must be a json list of models.' )
+    if modelMemoryBudget < 0:
+        sys.exit( ('Error: --modelMemoryBudget must be 0 or more. Current value=' + str(modelMemoryBudget)).encode(consoleEncoding) )
+
+    languagePairs=[ (sourceLanguage, targetLanguage) ]
+    for entry in modelsList:
+        if (not isinstance(entry, dict)) or ('modelPath' not in entry) or ('sourceLanguage' not in entry) or ('targetLanguage' not in entry):
+            sys.exit( ('Error: Every entry in --models needs modelPath, sourceLanguage and targetLanguage. Entry=' + str(entry)).encode(consoleEncoding) )
+        if (entry['sourceLanguage'], entry['targetLanguage']) in languagePairs:
+            sys.exit( ('Error: More than one model was specified for ' + entry['sourceLanguage'] + '->' + entry['targetLanguage'] + '.').encode(consoleEncoding) )
+        languagePairs.append( (entry['sourceLanguage'], entry['targetLanguage']) )
+        registeredModels.append( RegisteredModel( entry['modelPath'], entry['sourceLanguage'], entry['targetLanguage'], entry.get('sourceSentencePieceModel'), entry.get('targetSentencePieceModel') ) )
+        if verbose == True:
+            print( ('Registered ' + entry['sourceLanguage'] + '->' + entry['targetLanguage'] + ': ' + registeredModels[-1].modelPathOnly).encode(consoleEncoding) )
+
+
 if uiPath != None:
     if checkIfThisFileExists(uiPath) == True:
         uiPath=str( pathlib.Path(uiPath).absolute() )
@@ -674,41 +2364,218 @@ no_repeat_ngram_size=default_no_repeat_ngram_size
 inter_threads=default_inter_threads
 
 
+# CPU topology.
+# os.cpu_count() and psutil.cpu_count() report every core on the host, even inside of a container that is only allowed to use a few of them, which makes CTranslate2 start far too many threads.
+# These functions work out which CPUs this process can actually use from:
+#   The affinity mask, from taskset, docker --cpuset-cpus, Kubernetes static CPU manager, etc.
+#   The cgroup v2 cpu.max or cgroup v1 cpu.cfs_quota_us quota, from docker --cpus, Kubernetes CPU limits, etc.
+#   /sys/devices/system/cpu for which logical CPUs are SMT siblings of the same physical core and which NUMA node each is on.
+# Only the affinity mask is available outside of Linux, and only with psutil on Windows.
+
+# Return the sorted list of logical CPUs this process is allowed to run on.
+def getAvailableCpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted( os.sched_getaffinity(0) )
+    if psutilAvailable == True:
+        try:
+            return sorted( psutil.Process(os.getpid()).cpu_affinity() )
+        except (AttributeError, psutil.Error):
+            pass
+    return list( range( os.cpu_count() or 1 ) )
+
+
+# Return the number of CPUs allowed by the cgroup quota as a float, like 4.0 or 2.5, or None if there is no quota.
+def getCgroupCpuLimit():
+    if sys.platform != 'linux':
+        return None
+
+    # cgroup v2. /proc/self/cgroup has a single line: 0::/path/of/this/cgroup
+    # The quota can be set on any parent cgroup, so check each of them and use the lowest one.
+    cgroupPath=None
+    try:
+        with open('/proc/self/cgroup', 'r') as myFileHandle:
+            for line in myFileHandle:
+                if line.startswith('0::'):
+                    cgroupPath=line.strip()[3:]
+    except OSError:
+        pass
+    if cgroupPath != None:
+        cpuLimit=None
+        cgroupPathObject=pathlib.Path('/sys/fs/cgroup' + cgroupPath)
+        for folder in [ cgroupPathObject ] + list(cgroupPathObject.parents):
+            try:
+                # The syntax of cpu.max is: 'quota period' or 'max period'
+                quota, period = ( folder / 'cpu.max' ).read_text().split()
+            except (OSError, ValueError):
+                continue
+            if quota != 'max':
+                limit=int(quota) / int(period)
+                if (cpuLimit == None) or (limit < cpuLimit):
+                    cpuLimit=limit
+            if str(folder) == '/sys/fs/cgroup':
+                break
+        if cpuLimit != None:
+            return cpuLimit
+
+    # cgroup v1. Inside of a container, the container's own cgroup is mounted at the root.
+    for folder in [ '/sys/fs/cgroup/cpu,cpuacct', '/sys/fs/cgroup/cpu' ]:
+        try:
+            quota=int( pathlib.Path(folder + '/cpu.cfs_quota_us').read_text() )
+            period=int( pathlib.Path(folder + '/cpu.cfs_period_us').read_text() )
+        except (OSError, ValueError):
+            continue
+        if (quota > 0) and (period > 0):
+            return quota / period
+    return None
+
+
+# Return a dictionary describing the CPUs this process can use:
+#   availableCpus: every logical CPU in the affinity mask.
+#   physicalCores: a list with one entry per physical core, each a list of the logical CPUs that are SMT siblings on that core.
+#   numaNodes: numaNodes[node]=[ logicalCpu, ... ]
+#   cpuLimit: the cgroup quota in CPUs, or None.
+# Without /sys/devices/system/cpu, every logical CPU is treated as its own physical core unless psutil reports fewer physical cores.
+def getCpuTopology():
+    availableCpus=getAvailableCpus()
+    coreSiblings={}
+    numaNodes={}
+    for cpu in availableCpus:
+        cpuFolder=pathlib.Path('/sys/devices/system/cpu/cpu' + str(cpu))
+        try:
+            coreKey=( ( cpuFolder / 'topology/physical_package_id' ).read_text().strip(), ( cpuFolder / 'topology/core_id' ).read_text().strip() )
+        except OSError:
+            coreKey=None
+        if coreKey == None:
+            coreKey=( 'unknown', str(cpu) )
+        coreSiblings.setdefault( coreKey, [] ).append(cpu)
+
+        node=0
+        try:
+            for entry in cpuFolder.iterdir():
+                if entry.name.startswith('node') and entry.name[4:].isdigit():
+                    node=int( entry.name[4:] )
+        except OSError:
+            pass
+        numaNodes.setdefault( node, [] ).append(cpu)
+
+    physicalCores=sorted( coreSiblings.values() )
+    # No sysfs, like on Windows. Fall back to psutil for the SMT ratio if the whole machine is available.
+    if ( sys.platform != 'linux' ) and ( psutilAvailable == True ) and ( len(availableCpus) == (os.cpu_count() or 0) ):
+        physicalCoreCount=psutil.cpu_count(logical=False)
+        if (physicalCoreCount != None) and (physicalCoreCount > 0) and (physicalCoreCount < len(availableCpus)):
+            siblingsPerCore=len(availableCpus) // physicalCoreCount
+            physicalCores=[ availableCpus[i : i + siblingsPerCore] for i in range(0, len(availableCpus), siblingsPerCore) ]
+
+    return {
+        'availableCpus': availableCpus,
+        'physicalCores': physicalCores,
+        'numaNodes': numaNodes,
+        'cpuLimit': getCgroupCpuLimit(),
+        }
+
+
+# The number of CPU threads that can run at the same time without being throttled: physical cores, or logical CPUs if usePhysicalCores == False, capped by the cgroup quota.
+def getUsableCpuCount(topology, usePhysicalCores=True):
+    if usePhysicalCores == True:
+        count=len( topology['physicalCores'] )
+    else:
+        count=len( topology['availableCpus'] )
+    if topology['cpuLimit'] != None:
+        # A quota of 2.5 CPUs cannot keep 3 threads busy all the time, so round down.
+        count=min( count, max( 1, int(topology['cpuLimit']) ) )
+    return max(1, count)
+
+
+# Restrict this process, and therefore every thread and child process it creates afterwards, to cpuList. Returns True if it worked.
+def pinToCpus(cpuList):
+    try:
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cpuList)
+        elif psutilAvailable == True:
+            psutil.Process(os.getpid()).cpu_affinity(cpuList)
+        else:
+            print( 'Warning: Pinning to CPUs requires psutil on this platform. Install it with: pip install psutil' )
+            return False
+    except (OSError, AttributeError) as exception:
+        print( ('Warning: Could not pin to CPUs ' + str(cpuList) + ': ' + str(exception)).encode(consoleEncoding) )
+        return False
+    return True
+
+
+# --pinThreads
+# Pin to one logical CPU per physical core so OpenMP threads do not share a core with an SMT sibling.
+def pinToPhysicalCores(topology):
+    pinnedCpus=[ siblings[0] for siblings in topology['physicalCores'] ][ : getUsableCpuCount(topology) ]
+    if ( pinToCpus(pinnedCpus) == True ) and ( __name__ == '__main__' ):
+        print( 'Pinned to CPUs: ' + str(pinnedCpus) )
+
+
+# --replicas -1
+# One replica per replicaCores usable physical cores. If there are enough replicas to go around, round down to a multiple of the number of NUMA nodes so splitCoreGroups() does not split a replica across nodes.
+def getDefaultReplicaCount(topology, replicaCores):
+    count=max( 1, getUsableCpuCount(topology) // replicaCores )
+    numaNodeCount=len( topology['numaNodes'] )
+    if (numaNodeCount > 1) and (count >= numaNodeCount):
+        count=count - (count % numaNodeCount)
+    return count
+
+
+# --replicas
+# Split the usable physical cores into count groups of neighboring cores, one logical CPU per core, for each replica to be pinned to.
+# Cores are ordered by NUMA node first, so when count is a multiple of the number of NUMA nodes, no group spans two nodes.
+def splitCoreGroups(topology, count):
+    cpuToNode={}
+    for node, cpus in topology['numaNodes'].items():
+        for cpu in cpus:
+            cpuToNode[cpu]=node
+    cores=sorted( topology['physicalCores'], key=lambda siblings: ( cpuToNode.get(siblings[0], 0), siblings[0] ) )
+    cores=cores[ : getUsableCpuCount(topology) ]
+    if count > len(cores):
+        sys.exit( ('Error: --replicas ' + str(count) + ' is more than the ' + str(len(cores)) + ' physical cores available.').encode(consoleEncoding) )
+
+    coreGroups=[]
+    start=0
+    for i in range(count):
+        # Spread any remainder over the first groups so sizes differ by at most one core.
+        size=len(cores) // count + ( 1 if i < len(cores) % count else 0 )
+        coreGroups.append( [ siblings[0] for siblings in cores[ start : start + size ] ] )
+        start += size
+    return coreGroups
+
+
+cpuTopology=getCpuTopology()
+if ( __name__ == '__main__' ) and ( (verbose == True) or (debug == True) ):
+    print( 'Available CPUs=' + str( len(cpuTopology['availableCpus']) ) + ' Physical cores=' + str( len(cpuTopology['physicalCores']) ) + ' NUMA nodes=' + str( len(cpuTopology['numaNodes']) ) + ' cgroup CPU limit=' + str(cpuTopology['cpuLimit']) )
+if pinThreads == True:
+    pinToPhysicalCores(cpuTopology)
+
+
 # For best processing time with CTranslate2, CPU threads should be the same as the number of physical cores for CPU loads (not logical cores). Unclear what it should be for GPU loads but the same number as with CPU loads is a good default based upon initial testing. Update: CPU theads does not matter much when using GPU. Use default setting.
 #If the user specified a number of intra_threads, as --cpuThreads, then just use that instead.
 if intra_threads != None:
     pass
 elif (mode=='ctranslate2') and (device=='cpu'):
-    if psutilAvailable == True:
-        #Always gives logical cores. Incorrect.
-        #intra_threads=os.cpu_count()
-
-        #Gives physical cores. Correct.
-        intra_threads=psutil.cpu_count(logical=False)
-
-        # Setting intra_threads=psutil.cpu_count(logical=False) always gives the wrong value for Bulldozer family FX series processors (2 Module - 4 thread ; 3 Module - 6 thread; 4 Module - 8 thread). Bulldozer FX series should use logical cores, not module count, because every logical core has some dedicated hardware to process the thread, unlike SMT.
-        # https://en.wikipedia.org/wiki/List_of_AMD_FX_processors
-        # Bandaid for Bulldozer FX systems on Windows.
-        # This will likely hurt performance for users that have non-Bulldozer AMD FX systems. No modern AMD FX processors currently exist, so this is more of a concern for the future.
-        # A proper fix might be to create alwaysUseLogicalCores.csv and look up the full processor name there, but it would be a challenge getting it fully correct due to needing the exact processor name which might require real hardware to test with which is unrealistic.
-        # Alternatively, this could be exposed to the user and they could deal with it at runtime.
-        # Maybe just always override this setting to whatever the user inputs? Update: Implemented this with the --cpuThreads option to allow for manual overrides.
-        # This band-aid fix is currently only available on Windows.
-        if sys.platform == 'win32':
-            try:
-                import win32com.client
-                if ( str(win32com.client.GetObject('winmgmts:root\cimv2').ExecQuery('Select * from Win32_Processor')[0].Name).strip()[:6] == 'AMD FX' ):
-                    intra_threads=os.cpu_count()
-            except:
-                pass
-
-        # Fix for BSD systems. See:
-        # https://psutil.readthedocs.io/en/latest/#psutil.cpu_count
-        if intra_threads == None:
-            intra_threads=default_intra_threads
+    # Use the physical cores this process is actually allowed to use. See getCpuTopology().
+    #Always gives logical cores. Incorrect.
+    #intra_threads=os.cpu_count()
+    #Gives physical cores on the host, even inside of a container. Also incorrect.
+    #intra_threads=psutil.cpu_count(logical=False)
+    intra_threads=getUsableCpuCount(cpuTopology)
+
+    # Setting intra_threads to the number of physical cores always gives the wrong value for Bulldozer family FX series processors (2 Module - 4 thread ; 3 Module - 6 thread; 4 Module - 8 thread). Bulldozer FX series should use logical cores, not module count, because every logical core has some dedicated hardware to process the thread, unlike SMT.
+    # https://en.wikipedia.org/wiki/List_of_AMD_FX_processors
+    # Linux reports each logical core of a module as its own core in /sys/devices/system/cpu, so this is only needed on Windows where the topology comes from psutil.
+    # Alternatively, this could be exposed to the user and they could deal with it at runtime. Update: Implemented this with the --cpuThreads option to allow for manual overrides.
+    if sys.platform == 'win32':
+        try:
+            import win32com.client
+            if ( str(win32com.client.GetObject('winmgmts:root\cimv2').ExecQuery('Select * from Win32_Processor')[0].Name).strip()[:6] == 'AMD FX' ):
+                intra_threads=getUsableCpuCount(cpuTopology, usePhysicalCores=False)
+        except:
+            pass
 
-    elif psutilAvailable == False:
-        intra_threads=default_intra_threads
+    # default_inter_threads translations in parallel, each with intra_threads threads, would oversubscribe the CPU, so only run as many in parallel as there are CPUs for.
+    inter_threads=max( 1, min( default_inter_threads, getUsableCpuCount(cpuTopology, usePhysicalCores=False) // intra_threads ) )
 else:
     intra_threads=default_intra_threads
 
@@ -720,19 +2587,49 @@ except:
     intra_threads=0
 
 if ( __name__ == '__main__' ) and (verbose == True) and (mode == 'ctranslate2'):
-    print ( 'CTranslate2 CPU threads=' + str(intra_threads) )
-
+    print ( 'CTranslate2 CPU threads=' + str(intra_threads) + ' parallel translations=' + str(inter_threads) )
+
+
+if workerPoolSize < 1:
+    sys.exit( ('Error: --workers must be at least 1. Current value=' + str(workerPoolSize)).encode(consoleEncoding) )
+if workerIdleTimeout < 0:
+    sys.exit( ('Error: --workerIdleTimeout must be 0 or more. Current value=' + str(workerIdleTimeout)).encode(consoleEncoding) )
+if workerRequestTimeout < 0:
+    sys.exit( ('Error: --workerRequestTimeout must be 0 or more. Current value=' + str(workerRequestTimeout)).encode(consoleEncoding) )
+if inferenceSlots < 1:
+    sys.exit( ('Error: --inferenceSlots must be at least 1. Current value=' + str(inferenceSlots)).encode(consoleEncoding) )
+
+# Replicas are worker processes that each have their own CPUs, so they need multiprocess mode.
+replicaCoreGroups=None
+if replicas < -1:
+    sys.exit( ('Error: --replicas must be -1, 0, or more. Current value=' + str(replicas)).encode(consoleEncoding) )
+if replicaCores < 1:
+    sys.exit( ('Error: --replicaCores must be at least 1. Current value=' + str(replicaCores)).encode(consoleEncoding) )
+if replicas != 0:
+    if (mode != 'ctranslate2') or (device != 'cpu'):
+        if __name__ == '__main__':
+            print( 'Warning: --replicas only applies to CTranslate2 on CPU. Ignoring.' )
+    elif preloadModel == True:
+        if __name__ == '__main__':
+            print( 'Warning: --replicas requires multiprocess mode, so it cannot be used with --preloadModel. Ignoring.' )
+    else:
+        if replicas == -1:
+            replicas=getDefaultReplicaCount(cpuTopology, replicaCores)
+        replicaCoreGroups=splitCoreGroups(cpuTopology, replicas)
+        workerPoolSize=replicas
+        if ( __name__ == '__main__' ) and ( (verbose == True) or (debug == True) ):
+            print( 'Replica core groups=' + str(replicaCoreGroups) )
 
 # Debug code.
 #psutilAvailable=False
 
 #Workaround to fairseq + CPU bug.
 # Update: fairseq seems to hang on any sort of multiprocessing, multithreading, and even simple async + await calls.
-if (mode == 'fairseq') and (device=='cpu') and (preloadModel==False) and (psutilAvailable != True):
-    # Then change to preloading the model because there is no way to end the child process reliably otherwise. It hangs after it finishes processing long batches.
-    preloadModel = True
+# Update2: The warm worker processes in multiprocess mode are managed with multiprocessing.Process handles, so a hung worker can always be terminated directly without psutil. psutil is still needed for workerMaxMemory.
+if (preloadModel == False) and (workerMaxMemory > 0) and (psutilAvailable != True):
+    workerMaxMemory = 0
     if __name__ == '__main__':
-        print( '\n Warning: fairseq + CPU + multiprocessing requires psutil. Install with: \n\n    pip install psutil \n\n Since psutil is not available, preloadModel=True. \n If this behavior is not desired, install psutil.\n')
+        print( '\n Warning: --workerMaxMemory requires psutil. Install with: \n\n    pip install psutil \n\n Since psutil is not available, workers will only be recycled based upon --workerMaxRequests.\n')
 #if (mode == 'fairseq') and (device=='cpu'):
 #    import signal  #Sometimes required library. This is needed to send signal.SIGTERM to terminate processes when fairseq hangs. import conditionally.
 
@@ -764,10 +2661,30 @@ if __name__ == '__main__':
         # print out rest of variables
         print( ('preloadModel=' + str(preloadModel) ).encode(consoleEncoding) )
         print( ('perfMetrics=' + str(perfMetrics) ).encode(consoleEncoding) )
+        print( ('autotune=' + str(autotune) ).encode(consoleEncoding) )
+        print( ('pinThreads=' + str(pinThreads) ).encode(consoleEncoding) )
+        print( ('replicas=' + str(replicas) ).encode(consoleEncoding) )
+        print( ('replicaCores=' + str(replicaCores) ).encode(consoleEncoding) )
+        print( ('inferenceSlots=' + str(inferenceSlots) ).encode(consoleEncoding) )
+        print( ('inferenceMaxQueue=' + str(inferenceMaxQueue) ).encode(consoleEncoding) )
+        print( ('workerPoolSize=' + str(workerPoolSize) ).encode(consoleEncoding) )
+        print( ('workerMaxRequests=' + str(workerMaxRequests) ).encode(consoleEncoding) )
+        print( ('workerMaxMemory=' + str(workerMaxMemory) ).encode(consoleEncoding) )
+        print( ('workerIdleTimeout=' + str(workerIdleTimeout) ).encode(consoleEncoding) )
+        print( ('workerRequestTimeout=' + str(workerRequestTimeout) ).encode(consoleEncoding) )
+        print( ('batchWindow=' + str(batchWindow) ).encode(consoleEncoding) )
+        print( ('batchMaxSentences=' + str(batchMaxSentences) ).encode(consoleEncoding) )
+        print( ('batchMaxTokens=' + str(batchMaxTokens) ).encode(consoleEncoding) )
+        print( ('tokenBudget=' + str(tokenBudget) ).encode(consoleEncoding) )
         print( ('address=' + str(address) ).encode(consoleEncoding) )
         print( ('port=' + str(port) ).encode(consoleEncoding) )
+        print( ('httpProcesses=' + str(httpProcesses) ).encode(consoleEncoding) )
         print( ('version=' + str(version) ).encode(consoleEncoding) )
         print( ('cacheEnabled=' + str(cacheEnabled) ).encode(consoleEncoding) )
+        print( ('cacheFormat=' + str(cacheFormat) ).encode(consoleEncoding) )
+        print( ('cacheMaxEntries=' + str(cacheMaxEntries) ).encode(consoleEncoding) )
+        print( ('cacheMaxMemory=' + str(cacheMaxMemory) ).encode(consoleEncoding) )
+        print( ('cacheEvictionPolicy=' + str(cacheEvictionPolicy) ).encode(consoleEncoding) )
         print( ('verbose=' + str(verbose) ).encode(consoleEncoding) )
         print( ('debug=' + str(debug) ).encode(consoleEncoding) )
         print( ('tornado version=' + str(tornado.version) ).encode(consoleEncoding) )
@@ -788,8 +2705,8 @@ elif mode == 'ctranslate2':
     targetLanguageProcessor = sentencepiece.SentencePieceProcessor(targetSentencePieceModel)
 
 
-if preloadModel == True:
-    #Then preload model.
+# This loads the model for the current mode and device. It is used both to preload the model and by the warm worker processes in multiprocess mode.
+def loadTranslator():
     if mode == 'fairseq':
         # Should probably have a conditional here that says: if bpe mode == 'sentencepiece' add sentencepiece_model, else if bpe mode == pie then add ...etc    # And build the model differently based upon only the tokenizer/pbe changes since that appears to be the only condition that changes dramatically.
         # For now, add sentencepiece_model unconditionally as needed by bpe=sentencepiece, but this will need to be updated later to support additional model types.
@@ -798,53 +2715,430 @@ if preloadModel == True:
 
         if device == 'cuda':
             translator.cuda()
-        if device == 'directml':
+        elif device == 'directml':
         # https://learn.microsoft.com/en-us/windows/ai/directml/gpu-pytorch-windows
         # dml was defined earlier as: dml = torch_directml.device()
             translator.to(dml)
+        return translator
 
     elif mode == 'ctranslate2':
-        translator = ctranslate2.Translator(inputModelPathOnly, device=device, inter_threads=inter_threads, intra_threads=intra_threads)
+        return ctranslate2.Translator(inputModelPathOnly, device=device, inter_threads=inter_threads, intra_threads=intra_threads)
     else:
         sys.exit( 'Unspecified error.' )
 
 
-# This still blocks because a lot of time is spent here without any pause. Maybe this should go in its own thread?
+# Return a human readable name for the CPU, like 'AMD Ryzen 5 5600X 6-Core Processor', to tell apart computers in defaultAutotuneFileName.
+def getCpuModelName():
+    if sys.platform == 'linux':
+        try:
+            with open('/proc/cpuinfo', 'r', encoding='utf-8', errors='replace') as myFileHandle:
+                for line in myFileHandle:
+                    if line.startswith('model name'):
+                        return line.split(':', 1)[1].strip()
+        except OSError:
+            pass
+    import platform
+    if platform.processor() != '':
+        return platform.processor()
+    return platform.machine()
+
+
+# Return [ intra_threads, inter_threads ] that translated sampleText the fastest on this computer.
+# CTranslate2 only runs several batches in parallel when there are several of them, so the sample is split into inter_threads batches with max_batch_size.
+def measureThreadSettings(sampleText):
+    logicalCores=getUsableCpuCount(cpuTopology, usePhysicalCores=False)
+    physicalCores=getUsableCpuCount(cpuTopology)
+
+    candidates=[]
+    for candidateIntraThreads in sorted( set( [ max(1, physicalCores // 2), physicalCores, logicalCores ] ) ):
+        for candidateInterThreads in [ 1, 2, 4 ]:
+            if candidateIntraThreads * candidateInterThreads <= logicalCores:
+                candidates.append( [ candidateIntraThreads, candidateInterThreads ] )
+
+    tokenizedText=sourceLanguageProcessor.encode(sampleText, out_type=str)
+    fastest=None
+    fastestTime=None
+    for candidateIntraThreads, candidateInterThreads in candidates:
+        candidateTranslator=ctranslate2.Translator(inputModelPathOnly, device=device, inter_threads=candidateInterThreads, intra_threads=candidateIntraThreads)
+        maxBatchSize=-( -len(tokenizedText) // candidateInterThreads )
+        # The first batch is always slower, so do not time it.
+        candidateTranslator.translate_batch( source=tokenizedText[:1], beam_size=beam_size, num_hypotheses=num_hypotheses, no_repeat_ngram_size=no_repeat_ngram_size )
+        startTime=time.perf_counter()
+        candidateTranslator.translate_batch( source=tokenizedText, max_batch_size=maxBatchSize, beam_size=beam_size, num_hypotheses=num_hypotheses, no_repeat_ngram_size=no_repeat_ngram_size )
+        elapsedTime=time.perf_counter() - startTime
+        del candidateTranslator
+        print( 'Autotune: intra_threads=' + str(candidateIntraThreads) + ' inter_threads=' + str(candidateInterThreads) + ' took ' + str( round(elapsedTime, 2) ) + 's' )
+        if (fastestTime == None) or (elapsedTime < fastestTime):
+            fastest=[ candidateIntraThreads, candidateInterThreads ]
+            fastestTime=elapsedTime
+    return fastest
+
+
+# --autotune
+# Reuse the saved thread settings for this model, CPU and device, or measure them and save them if there are none yet.
+def runAutotune():
+    global intra_threads
+    global inter_threads
+
+    autotuneFilePathAndName=currentScriptPathOnly + '/' + defaultCacheLocation + '/' + defaultAutotuneFileName
+    if cacheEnabled == True:
+        autotuneModelHash=modelHashFull
+    else:
+        autotuneModelHash=getModelHash()
+    # The same CPU can be limited to fewer cores by a cgroup quota or CPU affinity, like in a container, so the number of usable CPUs is part of the key too.
+    autotuneKey=autotuneModelHash[:10] + '.' + getCpuModelName() + '.' + str( getUsableCpuCount(cpuTopology, usePhysicalCores=False) ) + 'cpus.' + device
+
+    savedSettings={}
+    if checkIfThisFileExists(autotuneFilePathAndName) == True:
+        try:
+            with open(autotuneFilePathAndName, 'r', encoding='utf-8') as myFileHandle:
+                savedSettings=json.load(myFileHandle)
+        except (OSError, ValueError):
+            print( ('Warning: Could not read ' + autotuneFilePathAndName + '. Measuring again.').encode(consoleEncoding) )
+            savedSettings={}
+
+    if autotuneKey in savedSettings:
+        intra_threads=savedSettings[autotuneKey]['intra_threads']
+        inter_threads=savedSettings[autotuneKey]['inter_threads']
+        print( ('Autotune: Using saved settings intra_threads=' + str(intra_threads) + ' inter_threads=' + str(inter_threads) + ' for ' + autotuneKey).encode(consoleEncoding) )
+        return
+
+    sampleText=[]
+    if cacheEnabled == True:
+        # translationCacheDictionary is empty for sqlite and binary and may still be loading for csv, so read the sample from what is on disk.
+        if cacheFormat in [ 'sqlite', 'binary' ]:
+            cacheEntries=cacheStore.iterateEntries()
+        elif checkIfThisFileExists(cacheStore.fileNameAndPath) == True:
+            cacheEntries=readCsvCacheFile(cacheStore.fileNameAndPath)
+        else:
+            cacheEntries=[]
+        for rawText, translatedText in itertools.islice(cacheEntries, defaultAutotuneSampleSize):
+            sampleText.append(rawText)
+    if len(sampleText) < defaultAutotuneSampleSize:
+        # Not enough entries in the cache, so repeat a short built in sample instead. Japanese since that is what most models used with this are for.
+        sampleText=[ 'は静かに前へと歩み出た。', '【クロエ】', '今日もいい天気ですね。', 'そんなことを言われても困ります。' ] * (defaultAutotuneSampleSize // 4)
+
+    print( 'Autotune: Measuring thread settings with ' + str(len(sampleText)) + ' entries. This only happens once per model and CPU.' )
+    # Like --benchmark, measure in a spawned process, so that the CTranslate2 translators and their threads are never created in this process before --httpProcesses forks it.
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context(defaultProcessesSpawnTechnique)) as executor:
+        intra_threads, inter_threads = executor.submit(measureThreadSettings, sampleText).result()
+    print( ('Autotune: Using intra_threads=' + str(intra_threads) + ' inter_threads=' + str(inter_threads) + ' for ' + autotuneKey).encode(consoleEncoding) )
+
+    savedSettings[autotuneKey]={ 'intra_threads': intra_threads, 'inter_threads': inter_threads, 'timeTuned': time.strftime('%Y-%m-%d %H:%M:%S') }
+    try:
+        pathlib.Path(autotuneFilePathAndName).parent.mkdir( parents = True, exist_ok = True )
+        with open(autotuneFilePathAndName, 'w', encoding='utf-8') as myFileHandle:
+            json.dump(savedSettings, myFileHandle, indent=4, ensure_ascii=False)
+    except OSError as exception:
+        print( ('Warning: Could not save autotune results to ' + autotuneFilePathAndName + ' ' + str(exception)).encode(consoleEncoding) )
+
+
+if ( __name__ == '__main__' ) and ( autotune == True ):
+    if (mode != 'ctranslate2') or (device != 'cpu'):
+        print( 'Warning: --autotune only applies to CTranslate2 on CPU. Ignoring.' )
+    elif commandLineArguments.cpuThreads != None:
+        print( 'Info: --cpuThreads was specified, so --autotune will not be used.' )
+    else:
+        runAutotune()
+
+
+# With --httpProcesses, each process loads its own copy of the model after fork() instead, since CTranslate2 and PyTorch threads do not survive fork().
+# --importCache only needs the cache, so it never loads the model.
+if (preloadModel == True) and (httpProcesses == 1) and (importCacheFile == None):
+    #Then preload model.
+    translator = loadTranslator()
+
+
+# Translate a list of sentencepiece tokenized entries with CTranslate2 and return the results in the same order.
+# The entries are sorted by token count and split into buckets of up to tokenBudget tokens, so similar lengths are translated together and each translate_batch() call has a predictable size.
+# max_batch_size with batch_type='tokens' makes CTranslate2 keep to the same budget inside of each call.
+# beamSize defaults to beam_size. --benchmark passes the beam size being measured instead.
+def translateTokenizedBatch( translator, tokenizedList, beamSize=None ):
+    if beamSize == None:
+        beamSize=beam_size
+    if (tokenBudget <= 0) or (len(tokenizedList) <= 1):
+        return translator.translate_batch( source=tokenizedList , beam_size=beamSize , num_hypotheses=num_hypotheses, no_repeat_ngram_size=no_repeat_ngram_size, use_vmap=use_vmap)
+
+    buckets=bucketTokenizedEntries(tokenizedList)
+
+    if debug == True:
+        print( 'Split ' + str(len(tokenizedList)) + ' entries into ' + str(len(buckets)) + ' buckets of up to ' + str(tokenBudget) + ' tokens.' )
+
+    # Put each result back at the position its entry came from.
+    outputList=[None] * len(tokenizedList)
+    for bucket in buckets:
+        bucketOutput = translator.translate_batch( source=[ tokenizedList[i] for i in bucket ] , max_batch_size=tokenBudget , batch_type='tokens' , beam_size=beamSize , num_hypotheses=num_hypotheses, no_repeat_ngram_size=no_repeat_ngram_size, use_vmap=use_vmap)
+        for counter in range( len(bucket) ):
+            outputList[ bucket[counter] ] = bucketOutput[counter]
+    return outputList
+
+
+# Sort the indexes of tokenizedList by token count and split them into buckets of up to tokenBudget tokens, or of up to defaultPipelineChunkSize entries if tokenBudget is 0.
+# The syntax of the returned list is: [ [ index, index, ... ], [ index, index, ... ], ... ]
+def bucketTokenizedEntries( tokenizedList ):
+    sortedIndexes=sorted( range(len(tokenizedList)), key=lambda i: len(tokenizedList[i]) )
+    if tokenBudget <= 0:
+        return [ sortedIndexes[i : i + defaultPipelineChunkSize] for i in range(0, len(sortedIndexes), defaultPipelineChunkSize) ]
+
+    buckets=[]
+    currentBucket=[]
+    currentBucketTokenCount=0
+    for i in sortedIndexes:
+        # Always take at least one entry, even if that entry alone is over tokenBudget.
+        if (len(currentBucket) != 0) and (currentBucketTokenCount + len(tokenizedList[i]) > tokenBudget):
+            buckets.append(currentBucket)
+            currentBucket=[]
+            currentBucketTokenCount=0
+        currentBucket.append(i)
+        currentBucketTokenCount += len(tokenizedList[i])
+    if len(currentBucket) != 0:
+        buckets.append(currentBucket)
+    return buckets
+
+
+# sentencepiece pipeline stages for CTranslate2. These run in tokenizerExecutor. processor is the sourceLanguageProcessor or targetLanguageProcessor of the model being used.
+def tokenizeEntries( processor, textList ):
+    return processor.encode(textList, out_type=str)
+
+
+def detokenizeEntries( processor, outputText ):
+    return processor.decode( [ i.hypotheses[0] for i in outputText ] )
+
+
+# This still blocks because a lot of time is spent here without any pause. Maybe this should go in its own thread? Update: This is now called from inferenceExecutor.
 def preloadModelTranslate( rawText ):
     if mode == 'fairseq':
         return translator.translate( rawText )
     elif mode == 'ctranslate2':
-        return translator.translate_batch( source=rawText , beam_size=beam_size , num_hypotheses=num_hypotheses, no_repeat_ngram_size = no_repeat_ngram_size, use_vmap=use_vmap)
+        return translateTokenizedBatch( translator, rawText )
 
 
-async def preloadModelTranslateProxy(executor, rawText):
-    return await asyncio.get_running_loop().run_in_executor(executor, preloadModelTranslate, rawText)
+# Raised by InferenceExecutor.run() when maxQueued batches are already waiting for a slot. MainHandler returns HTTP 503 for this.
+class InferenceQueueFullError(Exception):
+    pass
 
 
-#def translateNMT(rawText,myQueue):
-def translateNMT( rawText ):
+# When the model is preloaded, every translation runs on this one long-lived executor instead of creating a new thread pool for every request.
+# slots is the maximum number of batches that run inference against translator at the same time. Up to maxQueued more batches wait for a free slot, and anything past that is rejected with InferenceQueueFullError. maxQueued=0 means no limit.
+# If translator ever gets a native asynchronous interface, like CTranslate2's translate_batch(asynchronous=True), then run() is the place to use it.
+class InferenceExecutor:
+    def __init__(self, slots, maxQueued):
+        self.slots=slots
+        self.maxQueued=maxQueued
+        self.threadPool=concurrent.futures.ThreadPoolExecutor(max_workers=slots, thread_name_prefix='inference')
+        self.semaphore=asyncio.Semaphore(slots)
+        self.queued=0
+        self.inFlight=0
+        self.completed=0
+        self.failed=0
+        self.rejected=0
+        self.totalInferenceTime=0
+        self.totalWaitTime=0
+
+    async def run(self, function, *args):
+        if (self.maxQueued > 0) and (self.queued >= self.maxQueued) and (self.semaphore.locked() == True):
+            self.rejected += 1
+            raise InferenceQueueFullError( 'Inference queue is full. ' + str(self.queued) + ' batches are already waiting.' )
+
+        self.queued += 1
+        waitStartTime=time.perf_counter()
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.queued -= 1
+        self.totalWaitTime += time.perf_counter() - waitStartTime
+
+        self.inFlight += 1
+        inferenceStartTime=time.perf_counter()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.threadPool, function, *args)
+            self.completed += 1
+            return result
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.totalInferenceTime += time.perf_counter() - inferenceStartTime
+            self.inFlight -= 1
+            self.semaphore.release()
+
+    def statistics(self):
+        return {
+            'slots': self.slots,
+            'maxQueued': self.maxQueued,
+            'inFlight': self.inFlight,
+            'queued': self.queued,
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'totalInferenceTime': round(self.totalInferenceTime, 3),
+            'totalWaitTime': round(self.totalWaitTime, 3),
+            }
+
+    def shutdown(self):
+        self.threadPool.shutdown(wait=False)
+
+
+# The highest resident memory of the current process so far in MB, or None if it cannot be determined.
+def getPeakProcessMemory():
+    try:
+        import resource
+        peakMemory=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and KB everywhere else.
+        if sys.platform == 'darwin':
+            return peakMemory / 1048576
+        return peakMemory / 1024
+    except ImportError:
+        # Windows does not have resource, but psutil reports the peak working set.
+        if psutilAvailable == True:
+            memoryInfo=psutil.Process(os.getpid()).memory_info()
+            return getattr(memoryInfo, 'peak_wset', memoryInfo.rss) / 1048576
+    return None
+
+
+# Return the value at fraction, 0.5 for p50, of a list of numbers using the nearest-rank method.
+def percentile(values, fraction):
+    import math
+    sortedValues=sorted(values)
+    index=min( len(sortedValues) - 1, max( 0, math.ceil( fraction * len(sortedValues) ) - 1 ) )
+    return sortedValues[index]
+
+
+# Parse --benchmarkSweep into a dictionary of setting name -> list of values to try.
+def parseBenchmarkSweep(sweep):
+    validSettings=[ 'intra_threads', 'inter_threads', 'beam_size', 'batch_size', 'compute_type' ]
+    # intra_threads=0 lets CTranslate2 decide. The other value is the number of physical cores, or --cpuThreads.
+    settings={ 'intra_threads': sorted( set( [ 0, intra_threads if intra_threads != None else 0 ] ) ) }
+    for entry in sweep.split(';'):
+        if entry.strip() == '':
+            continue
+        if entry.find('=') == -1:
+            sys.exit( ('Error: Invalid --benchmarkSweep entry: ' + entry).encode(consoleEncoding) )
+        name, values = entry.split('=', 1)
+        name=name.strip()
+        if name not in validSettings:
+            sys.exit( ('Error: Unrecognized --benchmarkSweep setting: ' + name + ' Valid settings are: ' + ', '.join(validSettings)).encode(consoleEncoding) )
+        values=[ i.strip() for i in values.split(',') if i.strip() != '' ]
+        if name != 'compute_type':
+            try:
+                values=[ int(i) for i in values ]
+            except ValueError:
+                sys.exit( ('Error: --benchmarkSweep ' + name + ' must be a list of numbers.').encode(consoleEncoding) )
+        settings[name]=values
+    for name in validSettings:
+        if ( name not in settings ) or ( len(settings[name]) == 0 ):
+            sys.exit( ('Error: --benchmarkSweep has no values for: ' + name).encode(consoleEncoding) )
+    return settings
+
+
+# Runs in its own process for every combination of intra_threads, inter_threads and compute_type, so that each one starts from a cold process and peak memory is measured separately.
+# beam_size and batch_size do not require reloading the model, so they are swept inside of this process.
+# Returns a list of dictionaries, one per beam_size and batch_size.
+def runBenchmarkConfiguration(benchmarkIntraThreads, benchmarkInterThreads, computeType, beamSizes, batchSizes, corpus, repeats):
+    benchmarkTranslator=ctranslate2.Translator(inputModelPathOnly, device=device, inter_threads=benchmarkInterThreads, intra_threads=benchmarkIntraThreads, compute_type=computeType)
+    results=[]
+    for benchmarkBeamSize in beamSizes:
+        for batchSize in batchSizes:
+            if (batchSize <= 0) or (batchSize > len(corpus)):
+                batchSize=len(corpus)
+            batches=[ corpus[i : i + batchSize] for i in range(0, len(corpus), batchSize) ]
+
+            # Warm up. The first batch always takes longer.
+            translateTokenizedBatch( benchmarkTranslator, tokenizeEntries(sourceLanguageProcessor, batches[0]), benchmarkBeamSize )
+
+            latencies=[]
+            tokensOut=0
+            startTime=time.perf_counter()
+            for repeat in range(repeats):
+                for batch in batches:
+                    batchStartTime=time.perf_counter()
+                    outputText=translateTokenizedBatch( benchmarkTranslator, tokenizeEntries(sourceLanguageProcessor, batch), benchmarkBeamSize )
+                    detokenizeEntries(targetLanguageProcessor, outputText)
+                    latencies.append( time.perf_counter() - batchStartTime )
+                    for i in outputText:
+                        tokensOut += len(i.hypotheses[0])
+            totalTime=time.perf_counter() - startTime
+
+            results.append( {
+                'intra_threads': benchmarkIntraThreads,
+                'inter_threads': benchmarkInterThreads,
+                'compute_type': computeType,
+                'beam_size': benchmarkBeamSize,
+                'batch_size': batchSize,
+                'p50': percentile(latencies, 0.5),
+                'p95': percentile(latencies, 0.95),
+                'sentencesPerSecond': len(corpus) * repeats / totalTime,
+                'tokensPerSecond': tokensOut / totalTime,
+                'peakMemory': getPeakProcessMemory(),
+                } )
+    return results
+
+
+# --benchmark
+# Replays corpusFileNameAndPath against the model with every combination of settings in --benchmarkSweep and writes a table of the results to --benchmarkOutput.
+# Everything needed to reproduce the results, like the corpus hash and the versions used, is written at the top of the file.
+def runBenchmark(corpusFileNameAndPath):
+    import platform
+    verifyThisFileExists(corpusFileNameAndPath, 'benchmark')
+    with open(corpusFileNameAndPath, 'rb') as myFileHandle:
+        corpusHash=hashlib.sha1( myFileHandle.read() ).hexdigest()
+    with open(corpusFileNameAndPath, 'r', encoding=cacheFileEncoding, errors=inputErrorHandling) as myFileHandle:
+        corpus=[ line.strip() for line in myFileHandle if line.strip() != '' ]
+    if len(corpus) == 0:
+        sys.exit( ('Error: No entries found in benchmark corpus: ' + corpusFileNameAndPath).encode(consoleEncoding) )
+
+    settings=parseBenchmarkSweep(benchmarkSweep)
+    outputFileNameAndPath=benchmarkOutput
+    if outputFileNameAndPath == None:
+        outputFileNameAndPath=currentScriptPathOnly + '/resources/' + mode + '.benchmarks.' + platform.node() + '.txt'
+
+    header=[
+        'CTranslate2 ' + device + ' - ' + str( platform.processor() or platform.machine() ) + ' - ' + str(len(corpus)) + ' lines from ' + pathlib.Path(corpusFileNameAndPath).name,
+        'Generated by: ' + currentScriptNameWithoutPath + ' ' + __version__ + ' --benchmark on ' + time.strftime('%Y-%m-%d %H:%M:%S'),
+        'Computer: ' + platform.node() + ' ; ' + platform.platform() + ' ; Python ' + platform.python_version() + ' ; ctranslate2 ' + ctranslate2.__version__ + ' ; logical CPUs=' + str(os.cpu_count()),
+        'Model: ' + str(inputModelFileNameAndPath),
+        'Corpus: ' + str(corpusFileNameAndPath) + ' ; sha1=' + corpusHash,
+        'Repeats=' + str(benchmarkRepeats) + ' ; tokenBudget=' + str(tokenBudget) + ' ; no_repeat_ngram_size=' + str(no_repeat_ngram_size) + ' ; sweep=' + benchmarkSweep,
+        'Latency is per request of batch_size entries, including tokenization and detokenization. tokens/s counts generated target tokens. Peak RSS is for the whole process, so it includes every earlier row with the same intra/inter/compute_type.',
+        '',
+        '{:>5} {:>5} {:>14} {:>4} {:>6} {:>9} {:>9} {:>11} {:>9} {:>13}'.format('intra', 'inter', 'compute_type', 'beam', 'batch', 'p50(s)', 'p95(s)', 'sentences/s', 'tokens/s', 'peakRSS(MB)'),
+        ]
+    for line in header:
+        print( line.encode(consoleEncoding) )
+
+    rows=[]
+    context=multiprocessing.get_context( defaultProcessesSpawnTechnique )
+    for computeType in settings['compute_type']:
+        for benchmarkIntraThreads in settings['intra_threads']:
+            for benchmarkInterThreads in settings['inter_threads']:
+                # A fresh process for every model load keeps the results independent of each other.
+                with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    results=executor.submit( runBenchmarkConfiguration, benchmarkIntraThreads, benchmarkInterThreads, computeType, settings['beam_size'], settings['batch_size'], corpus, benchmarkRepeats ).result()
+                for result in results:
+                    peakMemory='unknown'
+                    if result['peakMemory'] != None:
+                        peakMemory=str( round(result['peakMemory']) )
+                    row='{:>5} {:>5} {:>14} {:>4} {:>6} {:>9.3f} {:>9.3f} {:>11.2f} {:>9.1f} {:>13}'.format( result['intra_threads'], result['inter_threads'], result['compute_type'], result['beam_size'], result['batch_size'], result['p50'], result['p95'], result['sentencesPerSecond'], result['tokensPerSecond'], peakMemory )
+                    print( row.encode(consoleEncoding) )
+                    rows.append(row)
+
+    pathlib.Path(outputFileNameAndPath).parent.mkdir( parents = True, exist_ok = True )
+    with open(outputFileNameAndPath, 'w', encoding='utf-8') as myOutputFileHandle:
+        myOutputFileHandle.write( '\n'.join(header + rows) + '\n' )
+    print( ('Wrote benchmark results to: ' + outputFileNameAndPath).encode(consoleEncoding) )
+
+
+# This is the body of the multiprocess mode. It runs inside of a warm worker process, so translator was already loaded once by warmWorkerMain() and is reused for every request sent to that worker.
+# Returns [ translatedList, tokensIn, tokensOut ]
+def translateNMT( rawText, translator ):
     if debug == True:
         print( 'Processing item count: ' + str(len(rawText)) )
     if mode == 'fairseq':
-        print( 'Loading fairseq in \'' + device + '\' mode for ' + str(len(rawText)) + ' entries.' )
-
-        translator = fairseq.models.transformer.TransformerModel.from_pretrained(inputModelPathOnly,checkpoint_file=inputModelNameWithoutPath,source_lang=sourceLanguage,target_lang=targetLanguage,bpe=bpe, sentencepiece_model=sourceSentencePieceModel, no_repeat_ngram_size=no_repeat_ngram_size)
-
-        if device == 'cuda':
-            translator.cuda()
-        elif device == 'directml':
-        # https://learn.microsoft.com/en-us/windows/ai/directml/gpu-pytorch-windows
-        # dml was defined earlier as: dml = torch_directml.device()
-            translator.to(dml)
+        print( 'Using fairseq in \'' + device + '\' mode for ' + str(len(rawText)) + ' entries.' )
 
         if (verbose == True) and (perfMetrics==True):
             startProcessingTime=time.perf_counter()
 
-        #if device == 'cpu':
-        # Process each entry individually. Does not fix bug.
-        #    for textEntry in rawText:
-        #        myQueue.put( translator.translate(textEntry) )
-
         #Batch mode. Works well.
         outputText = translator.translate(rawText)
 
@@ -855,56 +3149,643 @@ def translateNMT( rawText ):
         if debug == True:
             print(str(outputText))
 
-        # multiprocessing.Queue logic.
-        #for textEntry in outputText:
-        #    myQueue.put(textEntry)
-
-        # multiprocessing.Pipe logic.
-        #myQueue.send(outputText)
-        #myQueue.close()
-
-        # concurrent.futures.ProcessPoolExecutor logic.
-        # ProcessPoolExecutor is a wrapper for the multiprocessing module.
-        return outputText
+        return [ outputText ] + countCharacters(rawText, outputText)
 
     elif mode == 'ctranslate2':
-        print( 'Loading CTranslate2 in \'' + device + '\' mode for ' + str(len(rawText)) + ' entries.' )
-
-        translator = ctranslate2.Translator(inputModelPathOnly, device=device, inter_threads=inter_threads, intra_threads=intra_threads)
+        print( 'Using CTranslate2 in \'' + device + '\' mode for ' + str(len(rawText)) + ' entries.' )
 
         textAfterPreProcessing = sourceLanguageProcessor.encode(rawText, out_type=str);
 
         if (verbose == True) and (perfMetrics==True):
             startProcessingTime=time.perf_counter()
 
-        outputText = translator.translate_batch( source=textAfterPreProcessing , beam_size=beam_size , num_hypotheses=num_hypotheses, no_repeat_ngram_size=no_repeat_ngram_size, use_vmap=use_vmap)
+        outputText = translateTokenizedBatch( translator, textAfterPreProcessing )
 
         if (verbose == True) and (perfMetrics==True):
             processingTime=round(time.perf_counter() - startProcessingTime, 2)
             print( 'Processing time: ' + str( processingTime ) + ' seconds' )
 
-        # multiprocessing.Queue logic.
-        #for i in range(len(outputText)):
-        #    myQueue.put(targetLanguageProcessor.decode(outputText[i].hypotheses[0]))
-
-        # concurrent.futures.ProcessPoolExecutor logic.
         newList=[]
         for i in range( len(outputText) ):
             newList.append( targetLanguageProcessor.decode( outputText[i].hypotheses[0] ) )
-        return newList
+        tokensIn=sum( len(i) for i in textAfterPreProcessing )
+        tokensOut=sum( len(i.hypotheses[0]) for i in outputText )
+        return [ newList, tokensIn, tokensOut ]
     else:
         sys.exit( 'Unspecified error.' )
 
 
-# This function allows run_in_executor() to be added to a taskList, which is a Python list, and then awaiting the taskList.
-# That will process all of the entries at once with an instance of concurrent.futures.ProcessPoolExecutor .
-# Otherwise, each instance of each task will block the next and also maybe the ioloop depending upon implementation details.
-async def proxyTranslateNMT(executor, translateMe):
-    #print( 'pie' * 200 )
-    return await asyncio.get_running_loop().run_in_executor(executor, translateNMT, translateMe)
+# Return the resident memory of the current process in MB, or None if psutil is not available.
+def getCurrentProcessMemory():
+    if psutilAvailable == True:
+        return psutil.Process(os.getpid()).memory_info().rss / 1048576
+    return None
+
+
+# This is the main loop of a warm worker process. The model is loaded once and then every request that arrives over connection is translated with it until the main process sends None or closes the pipe.
+# Every reply has the syntax: [ succeeded, resultOrErrorMessage, memoryUsedInMB ] where result is what translateNMT() returned.
+# threadSettings is [ intra_threads, inter_threads, cpuList ] from the main process, since --autotune only runs there. With --replicas, cpuList is the group of CPUs this worker is pinned to. Otherwise it is None.
+def warmWorkerMain(connection, threadSettings):
+    global intra_threads
+    global inter_threads
+    intra_threads, inter_threads, cpuList = threadSettings
+    if cpuList != None:
+        pinToCpus(cpuList)
+        print( 'Loading ' + mode + ' in \'' + device + '\' mode in worker process ' + str(os.getpid()) + ' pinned to CPUs ' + str(cpuList) + '.' )
+    else:
+        print( 'Loading ' + mode + ' in \'' + device + '\' mode in worker process ' + str(os.getpid()) + '.' )
+    translator = loadTranslator()
+    while True:
+        try:
+            rawText = connection.recv()
+        except EOFError:
+            break
+        if rawText == None:
+            break
+        try:
+            connection.send( [ True, translateNMT(rawText, translator), getCurrentProcessMemory() ] )
+        except Exception as exception:
+            connection.send( [ False, type(exception).__name__ + ': ' + str(exception), getCurrentProcessMemory() ] )
+    connection.close()
+
+
+# A worker process that keeps the model loaded between requests. The methods here block, so WarmWorkerPool calls them from a thread to keep the I/O loop free.
+# slot is the position of this worker in WarmWorkerPool. A replacement for a recycled worker gets the same slot, and therefore the same CPUs.
+class WarmWorker:
+    def __init__(self, context, slot, threadSettings):
+        self.slot=slot
+        self.connection, remoteConnection = context.Pipe()
+        self.process = context.Process( target=warmWorkerMain, args=(remoteConnection, threadSettings), daemon=True )
+        self.process.start()
+        # The child has its own copy now, so close this one. Otherwise, recv() would never see EOFError if the child dies.
+        remoteConnection.close()
+        self.requestCount=0
+        self.memoryUsed=None
+        self.timeLastUsed=time.perf_counter()
+
+    # timeout is in seconds. 0 means wait forever. poll() also returns right away if the worker process exits, and then recv() raises EOFError.
+    def translate(self, rawText, timeout=0):
+        self.connection.send(rawText)
+        if timeout > 0:
+            if self.connection.poll(timeout) != True:
+                self.process.terminate()
+                raise RuntimeError( 'Worker process ' + str(self.process.pid) + ' did not return a result within ' + str(timeout) + ' seconds and was terminated.' )
+        try:
+            succeeded, result, self.memoryUsed = self.connection.recv()
+        except EOFError:
+            raise RuntimeError( 'Worker process ' + str(self.process.pid) + ' exited unexpectedly.' )
+        self.requestCount += 1
+        self.timeLastUsed=time.perf_counter()
+        if succeeded != True:
+            raise RuntimeError( 'Worker process ' + str(self.process.pid) + ' failed: ' + result )
+        return result
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except (OSError, ValueError):
+            pass
+        self.connection.close()
+        # fairseq + CPU sometimes hangs instead of exiting. Nothing it is still doing is needed anymore, since a worker is only stopped when it is idle or after translate() failed, so just force quit it.
+        self.process.join(timeout=10)
+        if self.process.is_alive() == True:
+            self.process.terminate()
+            self.process.join()
+        if verbose == True:
+            print( 'Stopped worker process ' + str(self.process.pid) + ' after ' + str(self.requestCount) + ' requests.' )
+
+
+# WarmWorkerPool keeps up to poolSize worker processes alive with the model loaded, so only the first request to each worker waits for the model to load. Workers are started on demand and recycled after maxRequests requests or once they use more than maxMemory MB. Recycling a worker returns all of its memory to the OS, so long term memory use stays bounded.
+# If coreGroups is specified, as it is with --replicas, then the worker in slot i is pinned to coreGroups[i] and uses one thread per CPU in it.
+# A worker that does not return a batch within requestTimeout seconds is terminated, and its slot is given to a new worker on the next request.
+# Workers that have not translated anything for idleTimeout seconds are stopped by stopIdleWorkers(), so between bursts of requests the model does not use any memory. Only the first request after a pause waits for the model to load.
+# Batches wait in a single queue, availableWorkers, and each one goes to whichever worker becomes idle first, so a worker with a backlog never gets more work while another one is idle.
+class WarmWorkerPool:
+    def __init__(self, poolSize, maxRequests, maxMemory, coreGroups=None, idleTimeout=0, requestTimeout=0):
+        self.poolSize=poolSize
+        self.maxRequests=maxRequests
+        self.maxMemory=maxMemory
+        self.coreGroups=coreGroups
+        self.idleTimeout=idleTimeout
+        self.requestTimeout=requestTimeout
+        self.idleTimer=None
+        self.context=multiprocessing.get_context( defaultProcessesSpawnTechnique )
+        self.idleWorkers=[]
+        self.freeSlots=list( range(poolSize) )
+        self.availableWorkers=asyncio.Semaphore(poolSize)
+        # Read by serverMetrics.
+        self.queued=0
+        self.inFlight=0
+        # Talking to the workers over the pipes blocks, so do it from threads.
+        self.threadPool=concurrent.futures.ThreadPoolExecutor(max_workers=poolSize)
+
+    def getThreadSettings(self, slot):
+        if self.coreGroups != None:
+            return [ len(self.coreGroups[slot]), 1, self.coreGroups[slot] ]
+        return [ intra_threads, inter_threads, None ]
+
+    def startWorker(self):
+        slot=self.freeSlots.pop(0)
+        try:
+            return WarmWorker( self.context, slot, self.getThreadSettings(slot) )
+        except:
+            self.freeSlots.append(slot)
+            raise
+
+    def stopWorker(self, worker):
+        try:
+            worker.stop()
+        finally:
+            self.freeSlots.append(worker.slot)
+
+    def shouldRecycle(self, worker):
+        if (self.maxRequests > 0) and (worker.requestCount >= self.maxRequests):
+            return True
+        if (self.maxMemory > 0) and (worker.memoryUsed != None) and (worker.memoryUsed > self.maxMemory):
+            return True
+        return False
+
+    async def translate(self, rawText):
+        self.queued += 1
+        try:
+            await self.availableWorkers.acquire()
+        finally:
+            self.queued -= 1
+        self.inFlight += 1
+        try:
+            return await self.translateWithIdleWorker(rawText)
+        finally:
+            self.inFlight -= 1
+            self.availableWorkers.release()
+
+    # Only call this while holding availableWorkers.
+    async def translateWithIdleWorker(self, rawText):
+        loop=asyncio.get_running_loop()
+        worker=None
+        while len(self.idleWorkers) != 0:
+            worker=self.idleWorkers.pop()
+            if worker.process.is_alive() == True:
+                break
+            self.freeSlots.append(worker.slot)
+            worker=None
+        if worker == None:
+            worker = await loop.run_in_executor(self.threadPool, self.startWorker)
+
+        try:
+            result = await loop.run_in_executor(self.threadPool, worker.translate, rawText, self.requestTimeout)
+        except:
+            await loop.run_in_executor(self.threadPool, self.stopWorker, worker)
+            raise
+
+        if self.shouldRecycle(worker) == True:
+            await loop.run_in_executor(self.threadPool, self.stopWorker, worker)
+        else:
+            self.idleWorkers.append(worker)
+        return result
+
+    def start(self):
+        if self.idleTimeout > 0:
+            self.idleTimer=asyncio.create_task( self.stopIdleWorkers() )
+
+    # Holding availableWorkers while stopping a worker means a new request cannot try to start a replacement before the worker's slot is free again.
+    async def stopIdleWorkers(self):
+        loop=asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep( max(1, self.idleTimeout / 4) )
+            for worker in list(self.idleWorkers):
+                if time.perf_counter() - worker.timeLastUsed < self.idleTimeout:
+                    continue
+                async with self.availableWorkers:
+                    # The worker may have been used while waiting for availableWorkers.
+                    if (worker not in self.idleWorkers) or (time.perf_counter() - worker.timeLastUsed < self.idleTimeout):
+                        continue
+                    self.idleWorkers.remove(worker)
+                    print( 'Info: Stopping worker process ' + str(worker.process.pid) + ' after ' + str(self.idleTimeout) + ' seconds without requests.' )
+                    # stopWorker() frees the slot even if stopping fails, so log it and keep checking the other workers instead of ending this task.
+                    try:
+                        await loop.run_in_executor(self.threadPool, self.stopWorker, worker)
+                    except Exception as exception:
+                        print( ('Warning: Unable to stop idle worker process ' + str(worker.process.pid) + ' ' + str(exception)).encode(consoleEncoding) )
+
+    def shutdown(self):
+        if self.idleTimer != None:
+            self.idleTimer.cancel()
+        for worker in self.idleWorkers:
+            worker.stop()
+        self.idleWorkers=[]
+        self.threadPool.shutdown(wait=False)
+
+
+# The CTranslate2 pipeline for the model from the command prompt and for the models from --models. Returns [ postTranslatedList, tokensIn, tokensOut ]
+# translateFunction translates a list of tokenized entries and runs in executor, an InferenceExecutor. sourceProcessor and targetProcessor are the sentencepiece processors of the same model.
+async def translateInPipeline(translateMe, executor, translateFunction, sourceProcessor, targetProcessor):
+    tokensIn=0
+    tokensOut=0
+    # Tokenizing, translating and detokenizing all block, so none of them run on the I/O loop.
+    # The whole batch is sorted by length in characters, which is close enough to the length in tokens, and split into chunks of defaultPipelineChunkSize entries in that order, so every chunk has entries of similar lengths.
+    # Chunk n+1 is tokenized while chunk n is being translated, and each bucket is detokenized while the next one is being translated.
+    loop=asyncio.get_running_loop()
+    sortedIndexes=sorted( range(len(translateMe)), key=lambda i: len(translateMe[i]) )
+    chunks=[ sortedIndexes[i : i + defaultPipelineChunkSize] for i in range(0, len(sortedIndexes), defaultPipelineChunkSize) ]
+    tokenizeFuture=loop.run_in_executor(tokenizerExecutor, tokenizeEntries, sourceProcessor, [ translateMe[i] for i in chunks[0] ])
+    # The syntax of this is: detokenizeStages.append( [ [ index, index, ... ], future ] ) where index is the position in translateMe.
+    detokenizeStages=[]
+    for chunkNumber in range( len(chunks) ):
+        tokenizedChunk=await tokenizeFuture
+        if chunkNumber + 1 < len(chunks):
+            tokenizeFuture=loop.run_in_executor(tokenizerExecutor, tokenizeEntries, sourceProcessor, [ translateMe[i] for i in chunks[chunkNumber + 1] ])
+        tokensIn += sum( len(i) for i in tokenizedChunk )
+
+        buckets=bucketTokenizedEntries(tokenizedChunk)
+        if debug == True:
+            print( 'Split chunk ' + str(chunkNumber) + ' of ' + str(len(tokenizedChunk)) + ' entries into ' + str(len(buckets)) + ' buckets.' )
+        for bucket in buckets:
+            outputText = await executor.run(translateFunction, [ tokenizedChunk[i] for i in bucket ])
+            tokensOut += sum( len(i.hypotheses[0]) for i in outputText )
+            detokenizeStages.append( [ [ chunks[chunkNumber][i] for i in bucket ], loop.run_in_executor(tokenizerExecutor, detokenizeEntries, targetProcessor, outputText) ] )
+
+    # Put each result back at the position its entry came from.
+    postTranslatedList=[None] * len(translateMe)
+    for indexes, bucketOutput in zip( [ stage[0] for stage in detokenizeStages ], await asyncio.gather( *[ stage[1] for stage in detokenizeStages ] ) ):
+        for counter in range( len(indexes) ):
+            postTranslatedList[ indexes[counter] ] = bucketOutput[counter]
+    return [ postTranslatedList, tokensIn, tokensOut ]
+
+
+# This submits translateMe to the translation engine and returns the translated list in the same order.
+# It is called by translationScheduler with the merged contents of every request in a batch instead of by each request individually.
+# Returns [ postTranslatedList, tokensIn, tokensOut ] The token counts come from the tokenized input and hypotheses that were already there, for serverMetrics.
+async def translateWithEngine(translateMe):
+    postTranslatedList=[]
+    tokensIn=0
+    tokensOut=0
+
+    if preloadModel == True:
+        #then the models are already loaded, so just process stuff.
+        print( 'Using ' + mode + ' in \'' + device + '\' mode for ' + str(len(translateMe)) + ' entries.' )
+        if mode == 'fairseq':
+
+            if (verbose == True) and (perfMetrics==True):
+                startProcessingTime=time.perf_counter()
+
+            # Process each item one at a time.
+            #for textEntry in translateMe:
+            #    postTranslatedList.append( translator.translate(textEntry) )
+
+            # Batch processing.
+            #outputText = translator.translate(translateMe)
+            #outputText = await preloadModelTranslate(translateMe) # Still blocks.
+
+            # fairseq does not play well with multithreading or multiprocessing, so keep it disabled pending further troubleshooting.
+            if defaultfairseqMultithreadingEnabled == True:
+                postTranslatedList = await inferenceExecutor.run(preloadModelTranslate, translateMe)
+            elif defaultfairseqMultithreadingEnabled != True:
+                postTranslatedList = preloadModelTranslate(translateMe)
+            tokensIn, tokensOut = countCharacters(translateMe, postTranslatedList)
+
+            #print('postTranslatedList='+str(postTranslatedList))
+
+            if (verbose == True) and (perfMetrics==True):
+                processingTime=round(time.perf_counter() - startProcessingTime, 2)
+                print( 'Processing time: ' + str( processingTime ) + ' seconds' )
+
+        elif mode == 'ctranslate2':
+            if (verbose == True) and (perfMetrics==True):
+                startProcessingTime=time.perf_counter()
+
+            postTranslatedList, tokensIn, tokensOut = await translateInPipeline(translateMe, inferenceExecutor, preloadModelTranslate, sourceLanguageProcessor, targetLanguageProcessor)
+
+            if (verbose == True) and (perfMetrics==True):
+                processingTime=round(time.perf_counter() - startProcessingTime, 2)
+                print( 'Processing time: ' + str( processingTime ) + ' seconds' )
+
+    elif preloadModel != True:
+        # The model stays loaded in one of the processes in warmWorkerPool, so only the first request to each worker pays the model loading time.
+        if (replicaCoreGroups != None) and (len(translateMe) >= 2 * len(replicaCoreGroups)):
+            # Split large batches so that every replica works on part of them at the same time.
+            chunkSize=-( -len(translateMe) // len(replicaCoreGroups) )
+            chunks=[ translateMe[i : i + chunkSize] for i in range(0, len(translateMe), chunkSize) ]
+            for chunkOutput, chunkTokensIn, chunkTokensOut in await asyncio.gather( *[ warmWorkerPool.translate(chunk) for chunk in chunks ] ):
+                postTranslatedList.extend(chunkOutput)
+                tokensIn += chunkTokensIn
+                tokensOut += chunkTokensOut
+        else:
+            postTranslatedList, tokensIn, tokensOut = await warmWorkerPool.translate(translateMe)
+
+    return [ postTranslatedList, tokensIn, tokensOut ]
+
+
+# Count tokens for translationScheduler's batchMaxTokens limit. For CTranslate2 this runs sentencepiece, so call it from a thread.
+# fairseq tokenizes internally, so the character count is used as an approximation there.
+def countTokens(textList):
+    if mode == 'ctranslate2':
+        tokenCount=0
+        for i in sourceLanguageProcessor.encode(textList):
+            tokenCount += len(i)
+        return tokenCount
+    else:
+        tokenCount=0
+        for i in textList:
+            tokenCount += len(i)
+        return tokenCount
+
+
+# When Translator++ has 'Max Parallel job' turned up, or when several Textractor clients are connected, many small requests arrive at nearly the same time.
+# Instead of sending each of them to the engine as its own tiny batch, MicroBatchScheduler collects the cache misses from all in-flight requests for up to batchWindow seconds, or until batchMaxSentences or batchMaxTokens is reached, and submits them as one translate_batch()/translate() call.
+# Each request then gets back only its own slice of the results. A single request is never split across batches.
+# engine and tokenCounter default to translateWithEngine() and countTokens() for the model from the command prompt. ModelRegistry gives every model from --models its own MicroBatchScheduler with that model's engine and tokenCounter.
+class MicroBatchScheduler:
+    def __init__(self, batchWindow, batchMaxSentences, batchMaxTokens, engine=None, tokenCounter=None):
+        self.batchWindow=batchWindow
+        self.batchMaxSentences=batchMaxSentences
+        self.batchMaxTokens=batchMaxTokens
+        self.engine=engine
+        self.tokenCounter=tokenCounter
+        # The syntax of this is: pendingRequests.append( [ translateMe, future ] )
+        self.pendingRequests=[]
+        self.pendingSentenceCount=0
+        self.pendingTokenCount=0
+        self.flushTimer=None
+        # asyncio only keeps weak references to tasks, so keep a strong reference here until each batch finishes.
+        self.runningBatches=set()
+
+    async def translate(self, translateMe):
+        tokenCount=0
+        if self.batchMaxTokens > 0:
+            if self.tokenCounter != None:
+                tokenCount=await asyncio.get_running_loop().run_in_executor(tokenizerExecutor, self.tokenCounter, translateMe)
+            elif mode == 'ctranslate2':
+                # tokenizerExecutor is None without --preloadModel, which means the default thread pool.
+                tokenCount=await asyncio.get_running_loop().run_in_executor(tokenizerExecutor, countTokens, translateMe)
+            else:
+                tokenCount=countTokens(translateMe)
+
+        future=asyncio.get_running_loop().create_future()
+        self.pendingRequests.append( [ translateMe, future ] )
+        self.pendingSentenceCount += len(translateMe)
+        self.pendingTokenCount += tokenCount
+
+        if (self.batchWindow <= 0) or ( (self.batchMaxSentences > 0) and (self.pendingSentenceCount >= self.batchMaxSentences) ) or ( (self.batchMaxTokens > 0) and (self.pendingTokenCount >= self.batchMaxTokens) ):
+            self.flush()
+        elif self.flushTimer == None:
+            self.flushTimer=asyncio.get_running_loop().call_later(self.batchWindow, self.flush)
+
+        return await future
+
+    def flush(self):
+        if self.flushTimer != None:
+            self.flushTimer.cancel()
+            self.flushTimer=None
+        if len(self.pendingRequests) == 0:
+            return
+
+        batch=self.pendingRequests
+        self.pendingRequests=[]
+        self.pendingSentenceCount=0
+        self.pendingTokenCount=0
+
+        task=asyncio.create_task( self.runBatch(batch) )
+        self.runningBatches.add(task)
+        task.add_done_callback(self.runningBatches.discard)
+
+    async def runBatch(self, batch):
+        # Anything that goes wrong, even while merging, must reach every future in batch or those requests would wait forever.
+        try:
+            mergedList=[]
+            for translateMe, future in batch:
+                mergedList.extend(translateMe)
+
+            if (verbose == True) and (len(batch) > 1):
+                print( 'Merged ' + str(len(batch)) + ' requests into one batch of ' + str(len(mergedList)) + ' entries.' )
+
+            # Game scripts often repeat the same line many times, so only send each unique line to the translation engine once.
+            # dict.fromkeys() keeps the order each line first appeared in.
+            uniqueList=list( dict.fromkeys(mergedList) )
+            if (verbose == True) and (len(uniqueList) != len(mergedList)):
+                print( 'Removed ' + str( len(mergedList) - len(uniqueList) ) + ' duplicate entries from batch.' )
+
+            inferenceStartTime=time.perf_counter()
+            if self.engine != None:
+                uniqueTranslatedList, tokensIn, tokensOut = await self.engine(uniqueList)
+            else:
+                uniqueTranslatedList, tokensIn, tokensOut = await translateWithEngine(uniqueList)
+            if len(uniqueTranslatedList) != len(uniqueList):
+                raise Exception( 'Translation engine returned ' + str(len(uniqueTranslatedList)) + ' entries for ' + str(len(uniqueList)) + ' inputs.' )
+            serverMetrics.observe( serverMetrics.inferenceDuration, time.perf_counter() - inferenceStartTime )
+            serverMetrics.observe( serverMetrics.batchSize, len(uniqueList) )
+            serverMetrics.add( 'entriesTranslated', len(uniqueList) )
+            serverMetrics.add('tokensIn', tokensIn)
+            serverMetrics.add('tokensOut', tokensOut)
+        except Exception as exception:
+            for translateMe, future in batch:
+                if not future.done():
+                    future.set_exception(exception)
+            return
+
+        # Fan the translations back out to every position in mergedList, including duplicates.
+        translatedDictionary=dict( zip(uniqueList, uniqueTranslatedList) )
+        postTranslatedList=[]
+        for i in mergedList:
+            postTranslatedList.append( translatedDictionary[i] )
+
+        # Hand each request back its own slice. Lists are ordered, so the slices line up with the order the requests were merged in.
+        counter=0
+        for translateMe, future in batch:
+            if not future.done():
+                future.set_result( postTranslatedList[ counter : counter + len(translateMe) ] )
+            counter += len(translateMe)
+
+
+# model.lookupCache() for a RegisteredModel, or lookupCache() if model is None.
+async def lookupCacheForModel(model, rawTextList):
+    if model != None:
+        return await model.lookupCache(rawTextList)
+    return await lookupCache(rawTextList)
+
+
+# Translate rawInput in chunks of up to chunkSize unique entries and yield each group of results as soon as it is ready, so callers do not have to wait for, or hold on to, the entire result.
+# The syntax of each yielded list is: [ [ index, translatedText ], [ index, translatedText ], ... ] where index is the position in rawInput.
+# By default, the cache is checked a chunk at a time, so a large job does not hold up other requests while it is being looked up. Cache hits for each chunk are yielded before its translations. Duplicates are only translated once, but every index is yielded.
+# If lookUpCacheFirst == True, the whole input is looked up at once and every cache hit is yielded before anything is translated, so hits never wait behind inference. Only the misses are split into chunks.
+# If retryWhenBusy == True, chunks rejected because the inference queue is full are retried after a second instead of raising InferenceQueueFullError.
+# model is a RegisteredModel from --models, which must already be acquired from modelRegistry, or None for the model from the command prompt.
+async def translateInChunks(rawInput, chunkSize, retryWhenBusy=False, model=None, lookUpCacheFirst=False):
+    # The syntax of this is: entryIndexes['rawText']=[ index, index, ... ]
+    entryIndexes={}
+    for index in range( len(rawInput) ):
+        entryIndexes.setdefault( rawInput[index], [] ).append(index)
+
+    uniqueEntries=list( entryIndexes.keys() )
+    if (cacheEnabled == True) and (lookUpCacheFirst == True):
+        cacheHits=await lookupCacheForModel(model, uniqueEntries)
+        if len(cacheHits) != 0:
+            if verbose == True:
+                print( 'Number of cache hits=' + str( len(cacheHits) ) )
+            yield [ [ index, cacheHits[rawText] ] for rawText in cacheHits for index in entryIndexes[rawText] ]
+            uniqueEntries=[ i for i in uniqueEntries if i not in cacheHits ]
+
+    for chunkStart in range(0, len(uniqueEntries), chunkSize):
+        chunk=uniqueEntries[ chunkStart : chunkStart + chunkSize ]
+        if (cacheEnabled == True) and (lookUpCacheFirst != True):
+            cacheHits=await lookupCacheForModel(model, chunk)
+            if len(cacheHits) != 0:
+                if verbose == True:
+                    print( 'Number of cache hits=' + str( len(cacheHits) ) )
+                yield [ [ index, cacheHits[rawText] ] for rawText in cacheHits for index in entryIndexes[rawText] ]
+                chunk=[ i for i in chunk if i not in cacheHits ]
+                if len(chunk) == 0:
+                    continue
+        while True:
+            try:
+                if model != None:
+                    postTranslatedList = await model.translationScheduler.translate(chunk)
+                else:
+                    postTranslatedList = await translationScheduler.translate(chunk)
+                break
+            except InferenceQueueFullError:
+                if retryWhenBusy != True:
+                    raise
+                await asyncio.sleep(1)
+        if cacheEnabled == True:
+            if model != None:
+                model.addToCache(chunk, postTranslatedList)
+            else:
+                addToCache(chunk, postTranslatedList)
+
+        translatedResults=[]
+        for counter in range( len(chunk) ):
+            for index in entryIndexes[ chunk[counter] ]:
+                translatedResults.append( [ index, postTranslatedList[counter] ] )
+        yield translatedResults
+
+
+# A translation job submitted to /api/v1/jobs.
+# status is one of: queued, running, completed, failed, cancelled
+# results has one entry per entry in rawInput and is None until that entry is translated. completionOrder lists the indexes in the order they were completed, so /stream can resume from any position.
+class TranslationJob:
+    def __init__(self, rawInput):
+        self.id=uuid.uuid4().hex
+        self.rawInput=rawInput
+        self.status='queued'
+        self.results=[None] * len(rawInput)
+        self.completionOrder=[]
+        self.error=None
+        self.timeCreated=time.time()
+        self.timeFinished=None
+        # Set and then replaced every time more results are available or the job finishes, to wake up anyone streaming the job.
+        self.updated=asyncio.Event()
+
+    def isFinished(self):
+        return self.status in [ 'completed', 'failed', 'cancelled' ]
+
+    def notify(self):
+        self.updated.set()
+        self.updated=asyncio.Event()
+
+    def finish(self, status, error=None):
+        self.status=status
+        self.error=error
+        self.timeFinished=time.time()
+        # The input is no longer needed once the job is over.
+        self.rawInput=None
+        self.notify()
+
+    def summary(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'total': len(self.results),
+            'completed': len(self.completionOrder),
+            'error': self.error,
+            'timeCreated': self.timeCreated,
+            'timeFinished': self.timeFinished,
+            }
+
+
+# Jobs are processed one at a time in the order they were submitted, so a queue of large overnight jobs does not starve interactive requests.
+# Interactive requests still go through translationScheduler, so they are merged with whatever chunk the current job is translating.
+class TranslationJobQueue:
+    def __init__(self, chunkSize, retentionTime):
+        self.chunkSize=chunkSize
+        self.retentionTime=retentionTime
+        # The syntax of this is: jobs['id']=TranslationJob
+        self.jobs={}
+        self.queue=asyncio.Queue()
+        self.runnerTask=None
+
+    def start(self):
+        self.runnerTask=asyncio.create_task( self.run() )
+
+    def submit(self, rawInput):
+        self.removeExpiredJobs()
+        job=TranslationJob(rawInput)
+        self.jobs[job.id]=job
+        self.queue.put_nowait(job)
+        print( 'Queued job ' + job.id + ' with ' + str(len(rawInput)) + ' entries.' )
+        return job
+
+    def get(self, jobId):
+        return self.jobs.get(jobId)
+
+    def cancel(self, jobId):
+        job=self.jobs.get(jobId)
+        if job == None:
+            return None
+        if not job.isFinished():
+            # A running job stops before its next chunk is submitted.
+            job.finish('cancelled')
+            print( 'Cancelled job ' + job.id )
+        return job
+
+    def removeExpiredJobs(self):
+        currentTime=time.time()
+        for jobId in list( self.jobs.keys() ):
+            job=self.jobs[jobId]
+            if ( job.isFinished() == True ) and ( currentTime - job.timeFinished > self.retentionTime ):
+                del self.jobs[jobId]
+
+    async def run(self):
+        while True:
+            job = await self.queue.get()
+            if job.isFinished():
+                continue
+
+            job.status='running'
+            job.notify()
+            if perfMetrics == True:
+                jobStartTime=time.perf_counter()
+            try:
+                # Jobs are not in a hurry, so wait out a full inference queue instead of failing.
+                async for chunkResults in translateInChunks(job.rawInput, self.chunkSize, retryWhenBusy=True):
+                    for index, translatedText in chunkResults:
+                        job.results[index]=translatedText
+                        job.completionOrder.append(index)
+                    job.notify()
+                    if job.isFinished():
+                        break
+            except Exception as exception:
+                print( ('Error: Job ' + job.id + ' failed: ' + str(exception)).encode(consoleEncoding) )
+                job.finish( 'failed', str(exception) )
+                continue
+
+            if not job.isFinished():
+                job.finish('completed')
+                if perfMetrics == True:
+                    print( 'Job ' + job.id + ' completed in ' + str( round( time.perf_counter() - jobStartTime, 2) ) + 's' )
 
 
 class MainHandler(tornado.web.RequestHandler):
+    # Track in-flight translation requests and how long they take for serverMetrics. prepare() and on_finish() also cover every early return in post().
+    def prepare(self):
+        if self.request.method == 'POST':
+            self.metricsStartTime=time.perf_counter()
+            serverMetrics.add('requestsInFlight', 1)
+
+    def on_finish(self):
+        if self.request.method == 'POST':
+            serverMetrics.add('requestsInFlight', -1)
+            serverMetrics.observe( serverMetrics.requestDuration, time.perf_counter() - self.metricsStartTime )
+
     async def get(self):
         print('self.request=' + str(self.request) )
         if debug == True:
@@ -970,8 +3851,7 @@ class MainHandler(tornado.web.RequestHandler):
 
         if 'message' in self.args:
             if ( str(self.args['message']).lower() == 'close server' ):
-                if (cacheEnabled == True) and (len(translationCacheDictionary) != 0):    
-                    writeOutCache()
+                # Any pending cache entries are written out by cacheWriter.stop() once the I/O loop has stopped.
                 print('Info: Recieved \'close server\' message. Exiting.')
 
                 #asyncio.get_running_loop().stop()
@@ -1021,32 +3901,52 @@ class MainHandler(tornado.web.RequestHandler):
             print( 'Warning: Received empty list.' )
             return
 
+        # Anything other than text would only fail later, in translationScheduler, so reject it here.
+        if not all( isinstance(i, str) for i in rawInput ):
+            print( 'Error: Every entry in \'content\' must be a string. Returning.' )
+            self.set_status(400)
+            self.finish( json.dumps( { 'error': 'Every entry in \'content\' must be a string.' } ) )
+            return
+
+        # Requests for another language pair go to the model from --models for that pair. source_lang and target_lang default to the ones from the command prompt.
+        requestedSourceLanguage=self.args.get('source_lang', sourceLanguage)
+        requestedTargetLanguage=self.args.get('target_lang', targetLanguage)
+        streamRequested=( self.args.get('stream') == True ) or ( 'application/x-ndjson' in self.request.headers.get('Accept', '') )
+        if (requestedSourceLanguage != sourceLanguage) or (requestedTargetLanguage != targetLanguage):
+            await self.translateWithRegisteredModel(rawInput, convertedToList, requestedSourceLanguage, requestedTargetLanguage, streamRequested)
+            if perfMetrics == True:
+                print( 'Request servicing time: ' + str( round( time.perf_counter()  - requestStartTime, 2) )+ 's')
+            return
+
+        if streamRequested == True:
+            await self.streamTranslation(rawInput)
+            if perfMetrics == True:
+                print( 'Request servicing time: ' + str( round( time.perf_counter()  - requestStartTime, 2) )+ 's')
+            return
+
         # Deal with cache.
         translateMe=[]
         # The syntax of this is:  tempRequestDictionary['rawEntry']=[thisValueIsFromCache,translatedData]
         #tempRequestDictionary={}
         tempRequestList=[]
-        global timeCacheWasLastWritten
 
-        if (cacheEnabled == True) and (len(translationCacheDictionary) != 0):
+        if cacheEnabled == True:
             # Dump rawInput into a dictionary that incorporates cache.
             # Bug: Using a dictionary creates a subtle bug where if a particular translation request has multiple duplicate items, those items will be de-duplicated.
             # That is problematic because then the len(input) will no longer match len(output). Therefore, use a python List instead to allow duplicates.
-            # This does mean that duplicates will be submitted to the translation engine, but with cache enabled, this will only happen the first time.
-            #create tempRequestDictionary[ 'rawEntry' ]=[ thisValueIsFromCache, translatedData ]
+            # translationScheduler removes the duplicates before they are submitted to the translation engine and copies the translations back to every position, so the lengths still match.
             #create tempRequestList.append( [ 'rawEntry', thisValueIsFromCache, translatedData ] )
+            # lookupCache() checks translationCacheDictionary and then cacheStore.
+            cacheHits=await lookupCache(rawInput)
             # Take every list entry from rawInput
             for i in rawInput:
-                # if entryInList/translatedData exists as a key in translationCacheDictionary,
-                if i in translationCacheDictionary.keys():
-                    # then add entry/i to tempRequestDictionary with thisValueIsFromCache=True
-                    #tempRequestDictionary[i]=[True,translationCacheDictionary[i]]
-                    tempRequestList.append( [ i, True, translationCacheDictionary[i] ] )
+                # if entryInList/translatedData exists in the cache,
+                if i in cacheHits:
+                    # then add entry/i to tempRequestList with thisValueIsFromCache=True
+                    tempRequestList.append( [ i, True, cacheHits[i] ] )
                 else:
                     # Otherwise, it needs to be processed.
-                    # Create a list of all the values where thisValueIsFromCache == False. Maybe create this during parsing?
-                    # Add it to the dictionary with thisValueIsFromCache=False
-                    #tempRequestDictionary[i]=[False,i]
+                    # Add it to the list with thisValueIsFromCache=False
                     tempRequestList.append( [ i, False, i ] )
                     # Append it to the translateMe list.
                     translateMe.append(i)
@@ -1054,6 +3954,8 @@ class MainHandler(tornado.web.RequestHandler):
                 #Move on to next entry.
             if verbose == True:
                 print( 'Number of cache hits=' + str( len(rawInput) - len(translateMe) ) )
+                with cacheLock:
+                    print( 'Cache statistics=' + str( translationCacheDictionary.statistics() ) )
         else:
             translateMe=rawInput
 
@@ -1061,164 +3963,20 @@ class MainHandler(tornado.web.RequestHandler):
         if debug == True:
             print( ('translateMe=' + str(translateMe)).encode(consoleEncoding) )
 
-        postTranslatedList=[]
-        #postTranslatedList.append( translateNMT( translateMe ) )
-        #postTranslatedList = translateNMT( translateMe )
-
         # Only process if there at least one item was not found in the cache.
+        # translateMe may contain duplicates. translationScheduler only translates each unique entry once, but returns one translation per entry in translateMe.
+        # translationScheduler merges this request with any other requests that arrive within batchWindow and sends them to the translation engine together.
+        postTranslatedList=[]
         if len(translateMe) != 0:
-            if preloadModel == True:
-                #then the models are already loaded, so just process stuff.
-                print( 'Using ' + mode + ' in \'' + device + '\' mode for ' + str(len(translateMe)) + ' entries.' )
-                if mode == 'fairseq':
-
-                    if (verbose == True) and (perfMetrics==True):
-                        startProcessingTime=time.perf_counter()
-
-                    # Process each item one at a time.
-                    #for textEntry in translateMe:
-                    #    postTranslatedList.append( translator.translate(textEntry) )
-
-                    # Batch processing.
-                    #outputText = translator.translate(translateMe)
-                    #outputText = await preloadModelTranslate(translateMe) # Still blocks.
-
-                    # fairseq does not play well with multithreading or multiprocessing, so keep it disabled pending further troubleshooting.
-                    if defaultfairseqMultithreadingEnabled == True:
-                        taskList=[]
-                        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-                            taskList.append( asyncio.create_task( preloadModelTranslateProxy(executor, translateMe) ) )
-                            # Run task directly.
-                            #taskList.append(executor.submit(preloadModelTranslate, rawText)
-
-                            #for f in asyncio.as_completed( taskList ):
-                            #    outputText.append( await f )
-                            outputText = await asyncio.gather( *taskList )
-                            executor.shutdown(wait=False)
-
-                        if (verbose == True) and (perfMetrics==True):
-                            processingTime=round(time.perf_counter() - startProcessingTime, 2)
-                            print( 'Processing time: ' + str( processingTime ) + ' seconds' )
-
-                        #print('outputText='+str(outputText))
-                        #The above returns a list which encapsulates all 1 entries in the taskList. The preloadModelTranslate function itself also returns a list, so there is a [[]] object returned.
-                        #Remove the outer list.
-                        outputText=outputText[0]
-
-                        for textEntry in outputText:
-                            postTranslatedList.append(textEntry)
-
-                    elif defaultfairseqMultithreadingEnabled != True:
-                        postTranslatedList = preloadModelTranslate(translateMe) 
-
-                        #print('postTranslatedList='+str(postTranslatedList))
-
-                        if (verbose == True) and (perfMetrics==True):
-                            processingTime=round(time.perf_counter() - startProcessingTime, 2)
-                            print( 'Processing time: ' + str( processingTime ) + ' seconds' )
-
-                elif mode == 'ctranslate2':
-                    textAfterPreProcessing = sourceLanguageProcessor.encode(translateMe, out_type=str);
-
-                    if (verbose == True) and (perfMetrics==True):
-                        startProcessingTime=time.perf_counter()
-
-                    #outputText = translator.translate_batch( source=textAfterPreProcessing , beam_size=beam_size , num_hypotheses=num_hypotheses, no_repeat_ngram_size = no_repeat_ngram_size, use_vmap=use_vmap)
-                    #outputText = await preloadModelTranslate(textAfterPreProcessing) #Still blocks.
-
-                    taskList=[]
-                    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-                        taskList.append( asyncio.create_task( preloadModelTranslateProxy(executor, textAfterPreProcessing) ) )
-
-                        #for f in asyncio.as_completed( taskList ):
-                        #    outputText.append( await f )
-                        outputText = await asyncio.gather( *taskList )
-                        executor.shutdown(wait=False)
-
-                    if (verbose == True) and (perfMetrics==True):
-                        processingTime=round(time.perf_counter() - startProcessingTime, 2)
-                        print( 'Processing time: ' + str( processingTime ) + ' seconds' )
-
-                    #The above returns a list which encapsulates all 1 entries in the taskList. The preloadModelTranslate function itself also returns a list, so there is a [[]] object returned.
-                    #Remove the outer list.
-                    outputText=outputText[0]
-
-                    for i in range(len(outputText)):
-                        postTranslatedList.append(targetLanguageProcessor.decode(outputText[i].hypotheses[0]))
-
-            elif preloadModel != True:
-                # if multiprocessing is allowed, then move the above core logic into a function and call that function.
-
-                # Move data back from other process by using multiprocessing.Queue().
-                #myQueue = multiprocessing.Queue()
-                #translateFunction = multiprocessing.Process(target=translateNMT, args=(translateMe,myQueue,) )
-                #translateFunction.start()
-                # Trying to get the size of the output queue is error prone, so get the size based upon the input. This blindly assumes everything is fine.
-                #for i in range(len(translateMe)):
-                #    postTranslatedList.append(myQueue.get())
-                #translateFunction.join()
-
-                # multiprocessing.Pipe logic
-                #localConnection, remoteConnection = multiprocessing.Pipe(False)#False means unidirectional pipe See: https://docs.python.org/3.10/library/multiprocessing.html#multiprocessing.Pipe
-                #translateFunction = multiprocessing.Process(target=translateNMT, args=(translateMe,remoteConnection,) )
-                #translateFunction.start()
-                #postTranslatedList = localConnection.recv()
-                #translateFunction.join()
-
-                # New multiprocessing logic that should work with the I/O loop to not block the web server from functioning normally during processing. Unclear if it would be completely async and accept loading the same model a second time in a different process while the first process is still busy. That would not be a good idea. However, that is a user error, so let them deal with it.
-                #https://docs.python.org/3/library/concurrent.futures.html#concurrent.futures.ProcessPoolExecutor
-                taskList = []
-                with concurrent.futures.ProcessPoolExecutor( max_workers=1, mp_context = multiprocessing.get_context( defaultProcessesSpawnTechnique ) ) as executor:
-                    # Add an arbitrary amount of tasks that should be completed in seperate processes to a random list.
-                    # The max_workers parameter in ProcessPoolExecutor controls the number of processes to run at once.
-                    #for i in range(200):
-                    taskList.append( asyncio.create_task( proxyTranslateNMT(executor, translateMe) ) )
-
-                    # Execute those processes while still in the loop so that executor still exists.
-                    #for f in asyncio.as_completed( taskList ):
-                    #    finalResults.append( await f )
-
-                    # Alternative smaller and more confusing code to get finalResults. Removing the asterisk * breaks it.
-                    # https://stackoverflow.com/questions/36901/what-does-double-star-asterisk-and-star-asterisk-do-for-parameters
-                    #finalResults = await asyncio.gather( *taskList )
-                    postTranslatedList = await asyncio.gather( *taskList ) # *postTranslatedList supposedly means 'unpack postTranslatedList' which still does not clarify its usage. Why does the assignment break when removing it? Maybe it is not a return object, but the actual stored create_task functions themselves? But in that case, then should not just feeding the raw taskList also work without unpacking? What does asyncio.gather() expect?
-                    #Hint: https://docs.python.org/3/library/asyncio-subprocess.html#subprocesses
-
-                    maxBatchSizeForFairseqBug=5  # Magic number.
-                    # Sizes of ~25+ on fairseq CPU multiprocess always produce a bug on tested CPU that causes the subprocess to hang and never return once its calculations are complete. Does not occur in the same exact multiprocess code if cuda is enabled, or in --preloadModel mode CPU using same code. Does not occur with ctranslate2. multiprocessing.Queue vs multiprocessing.Pipe logic does not matter. Might be an internal bug in fairseq that is somehow triggered by multiprocessing but only sometimes?
-                    # 20 does not usually produce fairseq cpu multiprocess hang bug, but might depend on CPU or utilization %, flat time, or other unknown factors. Smaller sizes are less likely to produce this intermittent bug. Bug was reproduced at least 1 time at batch size=10. Bug has not been reproduced yet at batch size <= 5.
-                    # New improved workaround for this bug is just to forcequit the process after telling executor to shut down.
-                    if ( mode == 'fairseq' ) and ( device == 'cpu' ) and ( len(translateMe) > maxBatchSizeForFairseqBug ):
-                        executor.shutdown(wait=False,cancel_futures=True) #This actually makes the process return the results reliably, but there is no way to shut down the child process without knowing it's Process ID which ProcessPoolExecutor does not expose aparently? The multiprocessing module does expose this information, so there might be some workaround. https://docs.python.org/3/library/multiprocessing.html#the-process-class
-                        # One alternative could be to change the datastructure so that it always returns back its processID, but that is a lot to change for a workaround for a specific bug in one configuration.
-                        # So instead use psutil to find the PID which, in turn, makes psutil a required dependency for fairseq + CPU + multiprocessing. Band-aid fix is better than no fix.
-                        try:
-                            for process in psutil.Process(os.getpid()).children(recursive=True):
-                                # The UI convinence function might be mixed in here which spawns several processes, so it is important to only close the correct one. Blindly selecting the first or last one does not work because the entries seem to be returned out of spawning order.
-                                # Docs: https://psutil.readthedocs.io/en/latest/#processes
-                                # Syntax: psutil.Process().cmdline()
-                                if debug == True:
-                                    print( 'process.pid()=' + str(process.pid) )
-                                    print( 'process.name()=' + str(process.name()) )
-                                    print( 'process.exe()=' + str(process.exe()) )
-                                    print( 'process.cmdline()=' + str(process.cmdline()) )
-                                # psutil.Process().cmdline() returns a list of strings, so check the list to see if it was spawned using Python's multiprocessing module to identify the correct one.
-                                for i in process.cmdline():
-                                    if i == '--multiprocessing-fork': #This is used for spawn as well.
-                                        #process.send_signal(signal.SIGTERM)
-                                        process.terminate() #Mostly an alias for above code.
-                            if debug == True:
-                                print('Info: Child processes found and sent signal.SIGTERM.')
-                        except psutil.NoSuchProcess:
-                            if debug == True:
-                                print('No such child process.')
-                    else:
-                        executor.shutdown(wait=False)
-
-                #The above returns a list which encapsulates all 1 entries in the taskList. translateNMT itself also returns a list, so there is a [[]] object returned.
-                #Remove the outer list.
-                postTranslatedList=postTranslatedList[0]
-
+            try:
+                postTranslatedList = await translationScheduler.translate(translateMe)
+            except InferenceQueueFullError as exception:
+                print( ('Warning: ' + str(exception) + ' Returning HTTP 503.').encode(consoleEncoding) )
+                serverMetrics.add('requestsRejected', 1)
+                self.set_status(503)
+                self.set_header('Retry-After', '1')
+                self.write( json.dumps( { 'error': str(exception) } ) )
+                return
 
         if debug == True:
             print( ( 'postTranslatedList=' + str(postTranslatedList) ).encode(consoleEncoding) )
@@ -1242,7 +4000,7 @@ class MainHandler(tornado.web.RequestHandler):
                 #for i in tempRequestDictionary.values():
                 for i in tempRequestList:
                     finalOutputList.append(i[2])
-            elif len(translationCacheDictionary) == 0:
+            elif len(translateMe) == len(rawInput):
                 finalOutputList=postTranslatedList
             else:
                 # Need to merge processed items with dictionary for final output.
@@ -1265,15 +4023,9 @@ class MainHandler(tornado.web.RequestHandler):
 
             if len(postTranslatedList) != 0:
                 # Add all newlyTranslated entries found to translationCacheDictionary.
-                counter=0
-                # for entry in postTranslatedList
-                # for every untranslated entry, update the cache with the untranslated entry and the translated line together as a pair.
-                # Wait, is this logic correct? translateMe is the list right before it gets submited for translation. postTranslatedList is the post-translated list.
-                # As long as both lists are exactly the same length and no errors occured, then this will work. Should that be asserted or double checked somehow?
-                # The issue being that it is difficult to understand what to do if they do not match, except to print the mismatch to the screen. Since that is incredibly cryptic to explain, just let the program crash instead.
-                for entry in translateMe:
-                    translationCacheDictionary[translateMe[counter]] = postTranslatedList[counter]
-                    counter += 1
+                # translateMe is the list right before it gets submited for translation. postTranslatedList is the post-translated list.
+                # As long as both lists are exactly the same length and no errors occured, then this will work.
+                addToCache(translateMe, postTranslatedList)
 
         # if cacheEnabled != True:
         else:
@@ -1287,15 +4039,6 @@ class MainHandler(tornado.web.RequestHandler):
         #    print(str(finalOutputList).encode(consoleEncoding))
         print( str(finalOutputList) )
 
-        if cacheEnabled == True:
-            #Check timer for cache last written. If timer > 60s, then write out to file.
-            if int( time.perf_counter()  - timeCacheWasLastWritten) > defaultSaveCacheInterval:
-                timeCacheWasLastWritten=time.perf_counter()
-                try:
-                    writeOutCache()
-                except:
-                    print( 'Warning: An unspecified error occured when writeOutCache.')
-
         if perfMetrics == True:
             #requestServicingTime=round( time.perf_counter()  - requestStartTime, 2)
 
@@ -1311,6 +4054,64 @@ class MainHandler(tornado.web.RequestHandler):
         self.write( json.dumps(finalOutputList) )
 
 
+    # Same as post() and streamTranslation(), but with the model from --models for the requested language pair.
+    async def translateWithRegisteredModel(self, rawInput, convertedToList, requestedSourceLanguage, requestedTargetLanguage, streamRequested):
+        model=None
+        if modelRegistry != None:
+            model=modelRegistry.get(requestedSourceLanguage, requestedTargetLanguage)
+        if model == None:
+            print( ('Error: No model is available for ' + str(requestedSourceLanguage) + '->' + str(requestedTargetLanguage) + '. Returning HTTP 400.').encode(consoleEncoding) )
+            self.set_status(400)
+            self.write( json.dumps( { 'error': 'No model is available for ' + str(requestedSourceLanguage) + '->' + str(requestedTargetLanguage) + '. See /api/v1/models.' } ) )
+            return
+
+        if streamRequested == True:
+            await self.streamTranslation(rawInput, model)
+            return
+
+        try:
+            finalOutputList = await modelRegistry.translate(model, rawInput)
+        except InferenceQueueFullError as exception:
+            print( ('Warning: ' + str(exception) + ' Returning HTTP 503.').encode(consoleEncoding) )
+            serverMetrics.add('requestsRejected', 1)
+            self.set_status(503)
+            self.set_header('Retry-After', '1')
+            self.write( json.dumps( { 'error': str(exception) } ) )
+            return
+
+        if convertedToList == True:
+            finalOutputList=finalOutputList[0]
+        print( str(finalOutputList) )
+        self.write( json.dumps(finalOutputList) )
+
+    # Streaming mode writes one line of JSON per entry, {"index": 0, "content": "translatedText"}, as soon as it is available.
+    # index is the position of the entry in the request. The whole request is looked up in the cache first and every hit is sent before anything is translated, so lines are not in request order.
+    # Cache misses are translated defaultStreamChunkSize unique entries at a time, and each chunk is flushed to the client before the next one is submitted.
+    # If translation fails partway through, a final {"error": "message"} line is sent instead since the status code has already been sent.
+    # model is a RegisteredModel from --models, or None for the model from the command prompt.
+    async def streamTranslation(self, rawInput, model=None):
+        self.set_header('Content-Type', 'application/x-ndjson')
+        try:
+            try:
+                if model != None:
+                    await modelRegistry.acquire(model)
+                try:
+                    async for chunkResults in translateInChunks(rawInput, defaultStreamChunkSize, model=model, lookUpCacheFirst=True):
+                        for index, translatedText in chunkResults:
+                            self.write( json.dumps( { 'index': index, 'content': translatedText } ) + '\n' )
+                        await self.flush()
+                finally:
+                    if model != None:
+                        modelRegistry.release(model)
+            except tornado.iostream.StreamClosedError:
+                raise
+            except Exception as exception:
+                print( ('Error: Streamed translation failed: ' + str(exception)).encode(consoleEncoding) )
+                self.write( json.dumps( { 'error': str(exception) } ) + '\n' )
+        except tornado.iostream.StreamClosedError:
+            print( 'Warning: Client disconnected during streamed response.' )
+
+
 # At some point, this should be hardened.
 # Documentation:
 # https://www.tornadoweb.org/en/stable/web.html
@@ -1381,6 +4182,33 @@ class ReturnModel(tornado.web.RequestHandler):
         self.write( json.dumps( modeAndModelNameDictionary ) )
 
 
+# /api/v1/models lists every language pair this server can translate. The model from the command prompt is first and is always loaded if --preloadModel was used.
+class Models(tornado.web.RequestHandler):
+    async def get(self):
+        print('self.request=' + str(self.request) )
+        self.set_status(200)
+        self.set_header('Content-Type', 'application/json')
+
+        models=[ { 'sourceLanguage': sourceLanguage, 'targetLanguage': targetLanguage, 'model': modeAndModelName, 'loaded': preloadModel } ]
+        if modelRegistry != None:
+            models.extend( modelRegistry.summary() )
+        self.write( json.dumps( { 'content': models } ) )
+
+    async def post(self):
+        await self.get()
+
+
+# Prometheus scrapes this every few seconds, so only print the request when verbose.
+class Metrics(tornado.web.RequestHandler):
+    async def get(self):
+        if verbose == True:
+            print('self.request=' + str(self.request) )
+        self.set_status(200)
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+
+        self.write( serverMetrics.render() )
+
+
 class SaveCache(tornado.web.RequestHandler):
     async def get(self):
         print( 'self.request=' + str(self.request) )
@@ -1393,20 +4221,14 @@ class SaveCache(tornado.web.RequestHandler):
             self.finish( 'Unable to save cache because cache is not enabled.' )
             return
 
-        global timeCacheWasLastWritten
-        #Check timer for cache last written. If timer > 60s, then write out to file.
-        if int( time.perf_counter()  - timeCacheWasLastWritten) > defaultSaveCacheInterval:
-            timeCacheWasLastWritten=time.perf_counter()
-            try:
-                writeOutCache()
-                self.finish('Cache was written to disk.')
-                return
-            except:
-                print( 'Warning: An unspecified error occured during writeOutCache()' ) # Print to console.
-                self.finish( 'Warning: An unspecified error occured during writeOutCache()' ) # Send error message over HTTP.
-                return
-        else:
-            self.finish('Cache was not written to disk. To save cache, please wait up to ' + str(defaultSaveCacheInterval) + ' seconds.')
+        # Only the entries added since the last write are written, so there is no need to rate limit this anymore. The write happens in another thread so the server keeps responding.
+        try:
+            await cacheWriter.flushInBackground()
+            self.finish('Cache was written to disk.')
+            return
+        except:
+            print( 'Warning: An unspecified error occured during writeOutCache()' ) # Print to console.
+            self.finish( 'Warning: An unspecified error occured during writeOutCache()' ) # Send error message over HTTP.
             return
 
     async def post(self):
@@ -1420,20 +4242,13 @@ class SaveCache(tornado.web.RequestHandler):
             self.finish( json.dumps({ 'content': 'Unable to save cache because cache is not enabled.'}) )
             return
 
-        global timeCacheWasLastWritten
-        #Check timer for cache last written. If timer > 60s, then write out to file.
-        if int( time.perf_counter()  - timeCacheWasLastWritten) > defaultSaveCacheInterval:
-            timeCacheWasLastWritten=time.perf_counter()
-            try:
-                writeOutCache()
-                self.finish( json.dumps({'content': 'Cache was written to disk.'}) )
-                return
-            except:
-                print( 'Warning: An unspecified error occured during writeOutCache()' ) # Print to console.
-                self.finish( json.dumps({'content': 'Warning: An unspecified error occured during writeOutCache()'}) ) # Send error message over HTTP.
-                return
-        else:
-            self.finish( json.dumps({'content': 'Cache was not written to disk. To save cache, please wait up to ' + str(defaultSaveCacheInterval) + ' seconds.'}) )
+        try:
+            await cacheWriter.flushInBackground()
+            self.finish( json.dumps({'content': 'Cache was written to disk.'}) )
+            return
+        except:
+            print( 'Warning: An unspecified error occured during writeOutCache()' ) # Print to console.
+            self.finish( json.dumps({'content': 'Warning: An unspecified error occured during writeOutCache()'}) ) # Send error message over HTTP.
             return
 
 
@@ -1483,6 +4298,23 @@ class ClearCache(tornado.web.RequestHandler):
             return
 
 
+# Returns True if an Accept-Encoding header allows gzip. gzip;q=0 means the client does not want it.
+def acceptsGzip(acceptEncoding):
+    for item in acceptEncoding.split(','):
+        parameters=item.strip().split(';')
+        if parameters[0].strip().lower() not in [ 'gzip', '*' ]:
+            continue
+        for parameter in parameters[1:]:
+            parameter=parameter.strip().lower()
+            if parameter.startswith('q='):
+                try:
+                    return float(parameter[2:]) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
 class GetCache(tornado.web.RequestHandler):
     async def get(self):
         print( 'self.request=' + str(self.request) )
@@ -1496,41 +4328,360 @@ class GetCache(tornado.web.RequestHandler):
             return
 
         #https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Content-Disposition
+        # The download is always plain csv. If the client accepts gzip, then it is compressed on the fly with Content-Encoding instead, which the client removes again when saving it.
         self.set_header('Content-Type', 'application/csv')
-        self.set_header('Content-Disposition', 'attachment; filename=' + cacheFileNameOnly )
+        self.set_header('Content-Disposition', 'attachment; filename=' + 'cache.' + modelHash + '.csv' )
+        self.set_header('Vary', 'Accept-Encoding')
+        compressResponse=acceptsGzip( self.request.headers.get('Accept-Encoding', '') )
+        if compressResponse == True:
+            self.set_header('Content-Encoding', 'gzip')
 
         # This might produce an error if the file has not been written to disk yet.
         # It might be better to read the entire file into memory, as cumbersome as that is, and then send it. That minimizes the potential of writing to the file at the same time as reading it. That wastes a lot of memory that will never be reclaimed by the OS, even if del is explcitly called on the object, however. So, which is better? Which is worse? Oh, the joys of async programming.
+        # With sqlite and binary, there is no cache.csv to send, so export one to a temporary file first and delete it afterwards. cache.csv itself is left alone since it is imported the first time sqlite or binary is used. Do it in a thread since it can take a while.
+        # For csv, make sure the file on disk has every entry first.
+        await cacheWriter.flushInBackground()
+        sendFileNameAndPath=cacheFilePathAndName
+        if cacheStore.entriesAreInMemory != True:
+            fileDescriptor, sendFileNameAndPath = tempfile.mkstemp(prefix='cache.export.', suffix=cacheFileExtension, dir=cacheFilePathOnly)
+            os.close(fileDescriptor)
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, cacheStore.exportCsv, sendFileNameAndPath)
+                await self.sendCacheFile(sendFileNameAndPath, compressResponse)
+            finally:
+                if checkIfThisFileExists(sendFileNameAndPath) == True:
+                    os.remove(sendFileNameAndPath)
+        else:
+            await self.sendCacheFile(sendFileNameAndPath, compressResponse)
+
+    async def sendCacheFile(self, fileNameAndPath, compressResponse):
+        # A cache.csv.gz on disk is decompressed while it is read. It is compressed again as a single gzip stream for the client since it can have several gzip members from appending to it, and not every client reads past the first one.
+        # Reading and compressing each chunk happens in a thread so that other requests are not held up while a large cache is being sent.
+        if fileNameAndPath.endswith('.gz'):
+            myFileHandle=gzip.open(fileNameAndPath, 'rb')
+        else:
+            myFileHandle=open(fileNameAndPath, 'rb')
+        if compressResponse == True:
+            # wbits=31 writes a gzip header and trailer instead of a zlib one.
+            compressor=zlib.compressobj(defaultCacheCompressionLevel, zlib.DEFLATED, 31)
+
         chunkSize = 4194304 #4MB
-        with open(cacheFilePathAndName, 'rb') as myFileHandle:
+        def readChunk():
+            chunk = myFileHandle.read(chunkSize)
+            if compressResponse != True:
+                return chunk, not chunk
+            if not chunk:
+                return compressor.flush(), True
+            return compressor.compress(chunk), False
+
+        loop=asyncio.get_running_loop()
+        with myFileHandle:
             while True:
-                chunk = myFileHandle.read(chunkSize)
-                if not chunk:
-                    break
+                chunk, finished = await loop.run_in_executor(None, readChunk)
                 try:
-                    self.write(chunk)
-                    await self.flush()
-                    await asyncio.sleep(0)
+                    if len(chunk) != 0:
+                        self.write(chunk)
+                        await self.flush()
                 except:
                     break
                 finally:
                     del chunk
+                if finished == True:
+                    break
 
+    # The JSON is written and flushed a batch of entries at a time, so the whole cache is never serialized into a single string and other requests are handled in between batches.
+    # ?limit=n returns at most n entries, in order of rawText, together with nextCursor. Pass that back as ?cursor= to get the next page. nextCursor is null after the last page.
     async def post(self):
         print( 'self.request=' + str(self.request) )
         if debug == True:
             print( 'Executing: ' + type(self).__name__ + '.' + inspect.currentframe().f_code.co_name ) #Print out className.currentFunctionName.
-        self.set_status(200)
         self.set_header('Content-Type', 'application/json')
 
         if cacheEnabled != True:
+            self.set_status(200)
             self.finish( json.dumps({'content': 'Unable to send cache because cache is not enabled.'}) )
             return
 
-        self.finish( json.dumps( dict( [('content',translationCacheDictionary)] ), ensure_ascii=False) )
+        try:
+            limit=int( self.get_argument('limit', '0') )
+        except ValueError:
+            limit=-1
+        if limit < 0:
+            self.set_status(400)
+            self.finish( json.dumps( { 'error': 'limit must be 0 or more.' } ) )
+            return
+        cursor=self.get_argument('cursor', None)
+        self.set_status(200)
+
+        # Every store can read from disk in iterateEntries(), for example csv after entries were evicted from memory, so write out pending entries first and do not start reading on the I/O loop.
+        await cacheWriter.flushInBackground()
+
+        loop=asyncio.get_running_loop()
+        if (limit == 0) and (cursor == None):
+            entries=await loop.run_in_executor(None, iterateCacheEntries)
+        else:
+            if cursor == None:
+                cursor=''
+            page=await loop.run_in_executor(None, cacheStore.getPage, cursor, limit)
+            entries=iter(page)
+
+        batchSize=10000
+        def serializeBatch():
+            batch=list( itertools.islice(entries, batchSize) )
+            return [ json.dumps(rawText, ensure_ascii=False) + ': ' + json.dumps(translatedText, ensure_ascii=False) for rawText, translatedText in batch ], batch
+
+        try:
+            self.write('{"content": {')
+            separator=''
+            lastRawText=None
+            numberOfEntries=0
+            while True:
+                serializedBatch, batch = await loop.run_in_executor(None, serializeBatch)
+                if len(batch) == 0:
+                    break
+                self.write( separator + ', '.join(serializedBatch) )
+                separator=', '
+                lastRawText=batch[-1][0]
+                numberOfEntries += len(batch)
+                del serializedBatch, batch
+                await self.flush()
+
+            if (limit == 0) and (cursor == None):
+                self.write('}}')
+            else:
+                # A full page means there might be more entries after it.
+                if (limit != 0) and (numberOfEntries == limit):
+                    nextCursor=lastRawText
+                else:
+                    nextCursor=None
+                self.write( '}, "nextCursor": ' + json.dumps(nextCursor, ensure_ascii=False) + '}' )
+            await self.flush()
+        except tornado.iostream.StreamClosedError:
+            print( 'Warning: Client disconnected while sending cache.' )
         return
 
 
+# POST a csv, json or jsonl file of translations to add them to the cache without translating them. The format is chosen with ?format= or from the Content-Type. Bodies sent with Content-Encoding: gzip are decompressed.
+# ?conflictPolicy=replace overwrites translations that are already in the cache. The default, keep, leaves them alone.
+# The body is written to a temporary file as it arrives, and then parsed and added to the cache a batch at a time in a thread, so other requests keep being served.
+@tornado.web.stream_request_body
+class ImportCache(tornado.web.RequestHandler):
+    contentTypes={ 'text/csv': 'csv', 'application/csv': 'csv', 'application/json': 'json', 'application/x-ndjson': 'jsonl', 'application/jsonl': 'jsonl' }
+
+    def prepare(self):
+        print( 'self.request=' + str(self.request) )
+        self.spoolFileHandle=None
+        if self.request.method != 'POST':
+            return
+        self.request.connection.set_max_body_size(defaultImportCacheMaxSize * 1048576)
+        self.spoolFileHandle=tempfile.TemporaryFile()
+
+    def data_received(self, chunk):
+        self.spoolFileHandle.write(chunk)
+
+    def on_finish(self):
+        if self.spoolFileHandle != None:
+            self.spoolFileHandle.close()
+
+    async def post(self):
+        if debug == True:
+            print( 'Executing: ' + type(self).__name__ + '.' + inspect.currentframe().f_code.co_name ) #Print out className.currentFunctionName.
+        self.set_header('Content-Type', 'application/json')
+
+        if cacheEnabled != True:
+            self.set_status(200)
+            self.finish( json.dumps({'content': 'Unable to import cache because cache is not enabled.'}) )
+            return
+
+        importFormat=self.get_argument('format', None)
+        if importFormat == None:
+            importFormat=self.contentTypes.get( self.request.headers.get('Content-Type', '').split(';')[0].strip().lower() )
+        conflictPolicy=self.get_argument('conflictPolicy', 'keep').lower()
+        if (importFormat == None) or (importFormat.lower() not in self.contentTypes.values()):
+            self.set_status(400)
+            self.finish( json.dumps( { 'error': 'Specify the format of the file as ?format=csv, json or jsonl, or with its Content-Type.' } ) )
+            return
+        if conflictPolicy not in [ 'keep', 'replace' ]:
+            self.set_status(400)
+            self.finish( json.dumps( { 'error': 'conflictPolicy must be keep or replace.' } ) )
+            return
+
+        self.spoolFileHandle.seek(0)
+        myBinaryFileHandle=self.spoolFileHandle
+        if self.request.headers.get('Content-Encoding', '').strip().lower() == 'gzip':
+            myBinaryFileHandle=gzip.GzipFile(fileobj=self.spoolFileHandle, mode='rb')
+
+        importStartTime=time.perf_counter()
+        try:
+            counts=await asyncio.get_running_loop().run_in_executor(None, importCacheEntries, parseImportFile(myBinaryFileHandle, importFormat.lower()), conflictPolicy)
+        except Exception as exception:
+            # Whatever was imported before the error stays in the cache.
+            print( ('Warning: Error importing cache: ' + str(exception)).encode(consoleEncoding) )
+            self.set_status(400)
+            self.finish( json.dumps( { 'error': 'Unable to import cache: ' + str(exception) }, ensure_ascii=False ) )
+            return
+        counts['seconds']=round(time.perf_counter() - importStartTime, 2)
+        print( ('Imported cache entries: ' + str(counts)).encode(consoleEncoding) )
+        self.set_status(200)
+        self.finish( json.dumps( { 'content': counts } ) )
+
+
+class CacheStats(tornado.web.RequestHandler):
+    async def get(self):
+        print( 'self.request=' + str(self.request) )
+        if debug == True:
+            print( 'Executing: ' + type(self).__name__ + '.' + inspect.currentframe().f_code.co_name ) #Print out className.currentFunctionName.
+        self.set_status(200)
+        self.set_header('Content-Type', 'text/plain')
+
+        if cacheEnabled != True:
+            self.finish( 'Unable to report cache statistics because cache is not enabled.' )
+            return
+
+        statistics=self.getStatistics()
+        modelStatistics=statistics.pop('models', {})
+        for key, value in statistics.items():
+            self.write( key + '=' + str(value) + '\n' )
+        for languagePair, pairStatistics in modelStatistics.items():
+            for key, value in pairStatistics.items():
+                self.write( languagePair + '.' + key + '=' + str(value) + '\n' )
+
+    async def post(self):
+        print( 'self.request=' + str(self.request) )
+        if debug == True:
+            print( 'Executing: ' + type(self).__name__ + '.' + inspect.currentframe().f_code.co_name ) #Print out className.currentFunctionName.
+        self.set_status(200)
+        self.set_header('Content-Type', 'application/json')
+
+        if cacheEnabled != True:
+            self.finish( json.dumps({'content': 'Unable to report cache statistics because cache is not enabled.'}) )
+            return
+
+        self.finish( json.dumps( { 'content': self.getStatistics() } ) )
+
+    # The statistics for the caches of the models from --models are under 'models', keyed by 'sourceLanguage->targetLanguage'.
+    def getStatistics(self):
+        with cacheLock:
+            statistics=translationCacheDictionary.statistics()
+        if modelRegistry != None:
+            statistics['models']={}
+            for model in modelRegistry.models.values():
+                if model.cacheDictionary == None:
+                    continue
+                with model.cacheLock:
+                    statistics['models'][ model.sourceLanguage + '->' + model.targetLanguage ]=model.cacheDictionary.statistics()
+        return statistics
+
+
+# /api/v1/jobs
+# POST submits a job. The body uses the same JSON as translation requests: { "content" : [ "rawText", ... ] } and returns the job summary with its id.
+# GET lists the summaries of every job that has not expired yet.
+class Jobs(tornado.web.RequestHandler):
+    async def get(self):
+        print( 'self.request=' + str(self.request) )
+        self.set_header('Content-Type', 'application/json')
+        self.finish( json.dumps( { 'content': [ job.summary() for job in translationJobQueue.jobs.values() ] } ) )
+
+    async def post(self):
+        print( 'self.request=' + str(self.request) )
+        if debug == True:
+            print( 'Executing: ' + type(self).__name__ + '.' + inspect.currentframe().f_code.co_name ) #Print out className.currentFunctionName.
+        self.set_header('Content-Type', 'application/json')
+
+        try:
+            args = tornado.escape.json_decode(self.request.body)
+        except ValueError:
+            args = None
+        if ( not isinstance(args, dict) ) or ( 'content' not in args ):
+            self.set_status(400)
+            self.finish( json.dumps( { 'error': 'Expected JSON with a \'content\' entry.' } ) )
+            return
+
+        rawInput=args['content']
+        if isinstance(rawInput, str):
+            rawInput=[rawInput]
+        if ( not isinstance(rawInput, list) ) or ( len(rawInput) == 0 ) or ( not all( isinstance(i, str) for i in rawInput ) ):
+            self.set_status(400)
+            self.finish( json.dumps( { 'error': '\'content\' must be a string or a non-empty list of strings.' } ) )
+            return
+
+        job=translationJobQueue.submit(rawInput)
+        self.set_status(202)
+        self.finish( json.dumps( job.summary() ) )
+
+
+# /api/v1/jobs/id returns the job summary. Once the job is completed, the translations are included in 'content' in the same order as the input.
+# DELETE /api/v1/jobs/id, or POST /api/v1/jobs/id/cancel, cancels the job. Entries that were already translated stay in the cache.
+class Job(tornado.web.RequestHandler):
+    def getJob(self, jobId):
+        job=translationJobQueue.get(jobId)
+        if job == None:
+            self.set_status(404)
+            self.set_header('Content-Type', 'application/json')
+            self.finish( json.dumps( { 'error': 'Job not found: ' + jobId } ) )
+        return job
+
+    async def get(self, jobId):
+        print( 'self.request=' + str(self.request) )
+        job=self.getJob(jobId)
+        if job == None:
+            return
+        self.set_header('Content-Type', 'application/json')
+        summary=job.summary()
+        if job.status == 'completed':
+            summary['content']=job.results
+        self.finish( json.dumps(summary) )
+
+    async def delete(self, jobId):
+        print( 'self.request=' + str(self.request) )
+        job=self.getJob(jobId)
+        if job == None:
+            return
+        translationJobQueue.cancel(jobId)
+        self.set_header('Content-Type', 'application/json')
+        self.finish( json.dumps( job.summary() ) )
+
+    async def post(self, jobId):
+        await self.delete(jobId)
+
+
+# /api/v1/jobs/id/stream returns completed entries as application/x-ndjson, one {"index": 0, "content": "translatedText"} per line, and keeps the connection open until the job finishes.
+# The last line is always the job summary: {"status": "completed", ...}
+# ?from=n skips the first n completed entries, so a client that was disconnected can resume where it left off.
+class JobStream(tornado.web.RequestHandler):
+    async def get(self, jobId):
+        print( 'self.request=' + str(self.request) )
+        job=translationJobQueue.get(jobId)
+        if job == None:
+            self.set_status(404)
+            self.set_header('Content-Type', 'application/json')
+            self.finish( json.dumps( { 'error': 'Job not found: ' + jobId } ) )
+            return
+
+        try:
+            position=int( self.get_argument('from', '0') )
+        except ValueError:
+            position=0
+        self.set_header('Content-Type', 'application/x-ndjson')
+
+        try:
+            while True:
+                # Keep a reference to the current event before writing, so an update that happens during flush() is not missed.
+                updated=job.updated
+                while position < len(job.completionOrder):
+                    index=job.completionOrder[position]
+                    self.write( json.dumps( { 'index': index, 'content': job.results[index] } ) + '\n' )
+                    position += 1
+                if job.isFinished():
+                    self.write( json.dumps( job.summary() ) + '\n' )
+                    await self.flush()
+                    return
+                await self.flush()
+                await updated.wait()
+        except tornado.iostream.StreamClosedError:
+            print( 'Warning: Client disconnected while streaming job ' + job.id )
+
+
 async def runUI(uiPath):
     # Might be useful somehow: https://docs.python.org/3.8/library/shlex.html#shlex.quote
     #import subprocess
@@ -1633,6 +4784,19 @@ async def runUI(uiPath):
 # Limitations: requires compiling streamlit, platform specific
 
 
+# Created in main() since they need a running event loop. warmWorkerPool is only used in multiprocess mode.
+translationScheduler=None
+translationJobQueue=None
+warmWorkerPool=None
+# Only used with --models.
+modelRegistry=None
+# Only used with --httpProcesses. httpProcessId is the task id from tornado.process.fork_processes() for this process.
+httpSockets=None
+httpProcessId=None
+# Created in main(). Only used with --preloadModel. tokenizerExecutor is only used with CTranslate2.
+inferenceExecutor=None
+tokenizerExecutor=None
+
 async def main():
 
 #    Define v0 API
@@ -1655,7 +4819,19 @@ async def main():
         (r'/api/v1/writeCache', SaveCache),
         (r'/api/v1/clearCache', ClearCache),
         (r'/api/v1/getCache', GetCache),
+        (r'/api/v1/importCache', ImportCache),
+        (r'/api/v1/cacheStats', CacheStats),
+        (r'/api/v1/metrics', Metrics),
+        (r'/api/v1/models', Models),
         ]
+    # Jobs are kept in memory by the process that accepted them, so with --httpProcesses the next request for the same job would likely go to a different process.
+    if httpProcesses == 1:
+        translationAPIv1 += [
+            (r'/api/v1/jobs', Jobs),
+            (r'/api/v1/jobs/([0-9a-f]+)', Job),
+            (r'/api/v1/jobs/([0-9a-f]+)/cancel', Job),
+            (r'/api/v1/jobs/([0-9a-f]+)/stream', JobStream),
+            ]
 
     # Make application that uses the above API. Application can bind to localhost (with IP alias), all addreses, or a specific address.
     # Requiring HostMatches(address) means that DNS rebind attacks will not work.
@@ -1667,10 +4843,14 @@ async def main():
     else:
         application = tornado.web.Application([ (tornado.web.HostMatches( address ), translationAPIv1 ), ])
 
-    print( (currentScriptNameWithoutPath + ' v' + __version__).encode(consoleEncoding) )
-    print( (currentScriptNameWithoutPath + ' ' + mode + ' ' + device + ' started: http://' + str(address) + ':' + str(port) ).encode(consoleEncoding) )
+    # With --httpProcesses, only the first process prints the addresses and starts the UI.
+    if httpProcessId != None:
+        print( (currentScriptNameWithoutPath + ' ' + mode + ' ' + device + ' HTTP process ' + str(httpProcessId) + ' pid=' + str(os.getpid()) + ' started.').encode(consoleEncoding) )
+    if (httpProcessId == None) or (httpProcessId == 0):
+        print( (currentScriptNameWithoutPath + ' v' + __version__).encode(consoleEncoding) )
+        print( (currentScriptNameWithoutPath + ' ' + mode + ' ' + device + ' started: http://' + str(address) + ':' + str(port) ).encode(consoleEncoding) )
     # if binding to all addresses, then display the connectable addresses for convenience.
-    if ( address == '0.0.0.0' ):
+    if ( address == '0.0.0.0' ) and ( (httpProcessId == None) or (httpProcessId == 0) ):
         print( 'http://localhost:' + str(port) )
         import socket
         for i in socket.getaddrinfo(socket.gethostname(),None):
@@ -1680,12 +4860,42 @@ async def main():
             if temp.find(':') == -1:
                 print( 'http://' + temp + ':' + str(port) )
 
+    # This must be created inside of the running event loop.
+    global translationScheduler
+    translationScheduler=MicroBatchScheduler(batchWindow, batchMaxSentences, batchMaxTokens)
+    global translationJobQueue
+    if httpProcesses == 1:
+        translationJobQueue=TranslationJobQueue(defaultJobChunkSize, defaultJobRetentionTime)
+        translationJobQueue.start()
+    if cacheEnabled == True:
+        cacheWriter.start()
+
+    global warmWorkerPool
+    global tokenizerExecutor
+    global inferenceExecutor
+    if preloadModel != True:
+        warmWorkerPool=WarmWorkerPool(workerPoolSize, workerMaxRequests, workerMaxMemory, replicaCoreGroups, workerIdleTimeout, workerRequestTimeout)
+        warmWorkerPool.start()
+    else:
+        inferenceExecutor=InferenceExecutor(inferenceSlots, inferenceMaxQueue)
+        if mode == 'ctranslate2':
+            tokenizerExecutor=concurrent.futures.ThreadPoolExecutor(max_workers=defaultTokenizerThreads, thread_name_prefix='tokenizer')
+    global modelRegistry
+    if len(registeredModels) != 0:
+        modelRegistry=ModelRegistry(registeredModels, modelMemoryBudget)
+        modelRegistry.start()
+
     # Update this with: https://www.tornadoweb.org/en/stable/netutil.html Done.
-    application.listen(address=address, port=port)
+    # With --httpProcesses, the sockets were bound before fork() so every process accepts connections from the same listening socket.
+    if httpSockets != None:
+        httpServer=tornado.httpserver.HTTPServer(application)
+        httpServer.add_sockets(httpSockets)
+    else:
+        application.listen(address=address, port=port)
 
     global uiHandle
     uiHandle=None
-    if uiPath != None:
+    if (uiPath != None) and ( (httpProcessId == None) or (httpProcessId == 0) ):
         uiHandle = await runUI(uiPath)
     # uiHandle is an instance of: asyncio.subprocess.Process
     #https://docs.python.org/3.8/library/asyncio-subprocess.html#interacting-with-subprocesses
@@ -1694,6 +4904,46 @@ async def main():
 
 if __name__ == '__main__':
 
+    if benchmarkCorpus != None:
+        runBenchmark(benchmarkCorpus)
+        sys.exit(0)
+
+    # --importCache adds the entries to the cache on disk and exits. cacheWriter.flush() writes each batch, so the cacheWriter thread is not needed.
+    if importCacheFile != None:
+        verifyThisFileExists(importCacheFile, 'importCache')
+        print( ('Importing ' + importCacheFile + ' into the cache.').encode(consoleEncoding) )
+        importStartTime=time.perf_counter()
+        if importCacheFile.lower().endswith('.gz'):
+            myBinaryFileHandle=gzip.open(importCacheFile, 'rb')
+        else:
+            myBinaryFileHandle=open(importCacheFile, 'rb')
+        try:
+            with myBinaryFileHandle:
+                counts=importCacheEntries( parseImportFile(myBinaryFileHandle, importCacheFormat), importCacheConflictPolicy )
+        except Exception as exception:
+            # Every batch read before the error was already written to disk.
+            sys.exit( ('Error: Unable to import cache from ' + importCacheFile + ' ' + str(exception)).encode(consoleEncoding) )
+        print( ('Imported ' + str(counts['read']) + ' entries in ' + str( round(time.perf_counter() - importStartTime, 2) ) + ' seconds. Added=' + str(counts['added']) + ' Replaced=' + str(counts['replaced']) + ' Skipped=' + str(counts['skipped'])).encode(consoleEncoding) )
+        sys.exit(0)
+
+    # Multiprocess HTTP mode. The listening sockets are bound once and then shared by every forked process. fork_processes() only returns in the child processes. The parent waits for them and restarts any that crash.
+    # Anything that holds threads or file handles is created after fork(): the sqlite connection, which is closed before forking and opened again by each process, the model, and everything in main().
+    if httpProcesses != 1:
+        import tornado.netutil
+        import tornado.process
+        import tornado.httpserver
+        if httpProcesses == 0:
+            httpProcesses=getUsableCpuCount(cpuTopology, usePhysicalCores=False)
+        httpSockets=tornado.netutil.bind_sockets(port, address=address)
+        if cacheEnabled == True:
+            cacheStore.close()
+        print( ('Info: Starting ' + str(httpProcesses) + ' HTTP processes on port ' + str(port) + '.').encode(consoleEncoding) )
+        httpProcessId=tornado.process.fork_processes(httpProcesses)
+        if cacheEnabled == True:
+            cacheStore.reopen()
+        if preloadModel == True:
+            translator = loadTranslator()
+
     if perfMetrics == True:
         print( 'Load time: ' + str( round(time.perf_counter() - startedLoadingTime, 2) ) + ' seconds' )
 
@@ -1706,6 +4956,22 @@ if __name__ == '__main__':
 #    except RuntimeError:
 #        pass
 
+    # Write out any remaining cache entries. This happens here instead of on the I/O loop for every type of shutdown: 'close server', ctrl+c, etc.
+    if cacheEnabled == True:
+        try:
+            cacheWriter.stop()
+        except Exception as exception:
+            print( ('Warning: An error occured while writing cache to disk: ' + str(exception)).encode(consoleEncoding) )
+
+    # Stop the warm worker processes so they do not outlive the server.
+    if warmWorkerPool != None:
+        warmWorkerPool.shutdown()
+    if inferenceExecutor != None:
+        inferenceExecutor.shutdown()
+    if tokenizerExecutor != None:
+        tokenizerExecutor.shutdown(wait=False)
+    if modelRegistry != None:
+        modelRegistry.shutdown()
 
     if psutilAvailable == True:
         #Only psutil works as intended to close the UI.
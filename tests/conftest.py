@@ -0,0 +1,52 @@
+import csv
+import pathlib
+import shutil
+import sqlite3
+import sys
+import threading
+
+import pytest
+
+sys.path.insert( 0, str( pathlib.Path(__file__).absolute().parent.parent ) )
+
+
+# py3translationServer.py reads the command line and loads the sentencepiece models when it is imported, so import it once with a placeholder CTranslate2 model and a tiny sentencepiece model.
+# Nothing here loads a translator, so model.bin can be empty.
+@pytest.fixture(scope='session')
+def server(tmp_path_factory):
+    pytest.importorskip('tornado')
+    pytest.importorskip('ctranslate2')
+    sentencepiece=pytest.importorskip('sentencepiece')
+
+    modelFolder=tmp_path_factory.mktemp('model')
+    ( modelFolder / 'model.bin' ).write_bytes(b'')
+    ( modelFolder / 'spm' ).mkdir()
+    corpus=modelFolder / 'corpus.txt'
+    corpus.write_text( '\n'.join( 'This is line number ' + str(i) + ' of a small corpus for the tests.' for i in range(200) ), encoding='utf-8' )
+    sentencepiece.SentencePieceTrainer.train( input=str(corpus), model_prefix=str( modelFolder / 'spm' / 'spm.ja.nopretok' ), vocab_size=40, minloglevel=2 )
+    shutil.copyfile( modelFolder / 'spm' / 'spm.ja.nopretok.model', modelFolder / 'spm' / 'spm.en.nopretok.model' )
+
+    commandLineArguments=sys.argv
+    sys.argv=[ 'py3translationServer.py', 'ctranslate2', str(modelFolder), '-sl', 'ja', '-tl', 'en' ]
+    try:
+        import py3translationServer
+    finally:
+        sys.argv=commandLineArguments
+    # These are only imported when the server is started with the cache enabled.
+    py3translationServer.csv=csv
+    py3translationServer.sqlite3=sqlite3
+    return py3translationServer
+
+
+# The globals that __main__ sets up for the cache of the model from the command prompt. cacheStore is up to each test.
+@pytest.fixture
+def cache(server, monkeypatch, tmp_path):
+    monkeypatch.setattr( server, 'cacheFilePathOnly', str(tmp_path), raising=False )
+    monkeypatch.setattr( server, 'translationCacheDictionary', server.TranslationCacheDictionary(), raising=False )
+    monkeypatch.setattr( server, 'cacheEntriesPendingWrite', {}, raising=False )
+    monkeypatch.setattr( server, 'cacheCompactionRequested', False, raising=False )
+    monkeypatch.setattr( server, 'cacheLock', threading.Lock(), raising=False )
+    monkeypatch.setattr( server, 'cacheSharedBetweenProcesses', False, raising=False )
+    monkeypatch.setattr( server, 'cacheStore', None, raising=False )
+    monkeypatch.setattr( server, 'modelRegistry', None, raising=False )
+    return server
@@ -0,0 +1,95 @@
+import time
+import types
+
+import pytest
+
+
+cacheFormats=[ 'csv', 'sqlite', 'binary' ]
+
+
+def openStore(server, cacheFormat, folder):
+    if cacheFormat == 'sqlite':
+        return server.SqliteCacheStore( str( folder / 'cache.sqlite3' ), 'testModelHash' )
+    if cacheFormat == 'binary':
+        return server.BinaryCacheStore( str( folder / 'cache.test.bin' ), 'testModel' )
+    return server.CsvCacheStore( str( folder / 'cache.test.csv' ), 'testModel', server.translationCacheDictionary, server.cacheLock )
+
+
+# Read back whatever a new process would find on disk.
+def readStore(server, cacheFormat, folder):
+    if cacheFormat == 'csv':
+        return dict( server.readCsvCacheFile( str( folder / 'cache.test.csv' ) ) )
+    store=openStore(server, cacheFormat, folder)
+    try:
+        return dict( store.iterateEntries() )
+    finally:
+        store.close()
+
+
+@pytest.fixture(params=cacheFormats)
+def cacheFormat(request, cache, tmp_path):
+    cache.cacheStore=openStore(cache, request.param, tmp_path)
+    yield request.param
+    if request.param != 'csv':
+        cache.cacheStore.close()
+
+
+def testSaveOnlyWritesNewEntries(cache, cacheFormat, tmp_path):
+    cache.addToCache( [ 'a', 'b' ], [ 'A', 'B' ] )
+    cache.writeOutCache()
+    assert cache.cacheEntriesPendingWrite == {}
+    cache.addToCache( [ 'c' ], [ 'C' ] )
+    cache.writeOutCache()
+    assert readStore(cache, cacheFormat, tmp_path) == { 'a': 'A', 'b': 'B', 'c': 'C' }
+
+
+def testCompactionKeepsEntriesThatWereNotSavedYet(cache, cacheFormat, tmp_path):
+    cache.addToCache( [ 'a', 'b' ], [ 'A', 'B' ] )
+    cache.writeOutCache()
+    cache.addToCache( [ 'c' ], [ 'C' ] )
+    cache.writeOutCache(compact=True)
+    assert cache.cacheEntriesPendingWrite == {}
+    assert readStore(cache, cacheFormat, tmp_path) == { 'a': 'A', 'b': 'B', 'c': 'C' }
+
+
+def testCompactionAfterClearOnlyKeepsNewEntries(cache, cacheFormat, tmp_path):
+    cache.addToCache( [ 'a', 'b' ], [ 'A', 'B' ] )
+    cache.writeOutCache()
+    cache.clearCache()
+    cache.addToCache( [ 'c' ], [ 'C' ] )
+    # clearCache() requests a compaction, so this rewrites the cache.
+    cache.writeOutCache()
+    assert readStore(cache, cacheFormat, tmp_path) == { 'c': 'C' }
+
+
+
+# An entry evicted from memory before it was saved is only in cacheEntriesPendingWrite, and an entry evicted after it was saved is only on disk.
+def testCompactionKeepsEvictedEntries(cache, cacheFormat, tmp_path):
+    cache.translationCacheDictionary.maxEntries=2
+    cache.addToCache( [ 'a', 'b' ], [ 'A', 'B' ] )
+    cache.writeOutCache()
+    cache.addToCache( [ 'c', 'd', 'e' ], [ 'C', 'D', 'E' ] )
+    assert len(cache.translationCacheDictionary) == 2
+    cache.writeOutCache(compact=True)
+    assert readStore(cache, cacheFormat, tmp_path) == { 'a': 'A', 'b': 'B', 'c': 'C', 'd': 'D', 'e': 'E' }
+
+
+def testImportWaitsForTheCsvCacheToLoad(cache, monkeypatch, tmp_path):
+    flushes=[]
+    monkeypatch.setattr( cache, 'cacheWriter', types.SimpleNamespace( flush=lambda: flushes.append(True) ), raising=False )
+    cacheFileNameAndPath=str( tmp_path / 'cache.csv' )
+    cache.writeCsvCacheFile( cacheFileNameAndPath, [ ( 'a', 'A from disk' ) ], 'testModel' )
+    store=cache.CsvCacheStore( cacheFileNameAndPath, 'testModel', cache.translationCacheDictionary, cache.cacheLock )
+    monkeypatch.setattr( cache, 'cacheStore', store )
+
+    load=store.load
+    def slowLoad(translationCacheDictionary, lock):
+        time.sleep(0.2)
+        load(translationCacheDictionary, lock)
+    store.load=slowLoad
+
+    store.loadInBackground( cache.translationCacheDictionary, cache.cacheLock )
+    counts=cache.importCacheEntries( [ ( 'a', 'A from import' ), ( 'b', 'B' ), ( 'c', 'C' ) ], 'keep', batchSize=1 )
+    assert counts == { 'read': 3, 'added': 2, 'replaced': 0, 'skipped': 1 }
+    assert cache.translationCacheDictionary['a'] == 'A from disk'
+    assert flushes == [ True ]
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+
+# Stands in for translateWithEngine and records every batch it is given.
+@pytest.fixture
+def engineBatches(server, monkeypatch):
+    batches=[]
+
+    async def translateWithEngine(translateMe):
+        batches.append( list(translateMe) )
+        await asyncio.sleep(0)
+        return [ [ i.upper() for i in translateMe ], 0, 0 ]
+
+    monkeypatch.setattr( server, 'translateWithEngine', translateWithEngine )
+    return batches
+
+
+def testConcurrentRequestsAreMergedAndDeduplicated(server, engineBatches):
+    async def translateConcurrently():
+        scheduler=server.MicroBatchScheduler(0.05, 0, 0)
+        return await asyncio.gather( scheduler.translate( [ 'a', 'b', 'a' ] ), scheduler.translate( [ 'b', 'c' ] ) )
+
+    assert asyncio.run( translateConcurrently() ) == [ [ 'A', 'B', 'A' ], [ 'B', 'C' ] ]
+    assert engineBatches == [ [ 'a', 'b', 'c' ] ]
+
+
+def testBatchMaxSentencesFlushesEarly(server, engineBatches):
+    async def translateConcurrently():
+        scheduler=server.MicroBatchScheduler(60, 2, 0)
+        return await asyncio.wait_for( asyncio.gather( scheduler.translate( [ 'a', 'b' ] ), scheduler.translate( [ 'c', 'd' ] ) ), 5 )
+
+    assert asyncio.run( translateConcurrently() ) == [ [ 'A', 'B' ], [ 'C', 'D' ] ]
+    assert engineBatches == [ [ 'a', 'b' ], [ 'c', 'd' ] ]
+
+
+def testBatchMaxTokensFlushesEarly(server, engineBatches):
+    async def translateAlone():
+        scheduler=server.MicroBatchScheduler(60, 0, 1)
+        return await asyncio.wait_for( scheduler.translate( [ 'This is line number 1.' ] ), 5 )
+
+    assert asyncio.run( translateAlone() ) == [ 'THIS IS LINE NUMBER 1.' ]
+
+
+def testEngineErrorsReachEveryRequestInTheBatch(server, monkeypatch):
+    async def translateWithEngine(translateMe):
+        raise RuntimeError('engine failed')
+
+    monkeypatch.setattr( server, 'translateWithEngine', translateWithEngine )
+
+    async def translateConcurrently():
+        scheduler=server.MicroBatchScheduler(0.05, 0, 0)
+        return await asyncio.gather( scheduler.translate( [ 'a' ] ), scheduler.translate( [ 'b' ] ), return_exceptions=True )
+
+    results=asyncio.run( translateConcurrently() )
+    assert [ str(i) for i in results ] == [ 'engine failed', 'engine failed' ]
@@ -0,0 +1,83 @@
+import asyncio
+import types
+
+import pytest
+
+
+# A model from --models for the same placeholder model as the command prompt, with its cache in tmp_path.
+@pytest.fixture
+def registeredModel(cache, monkeypatch, tmp_path):
+    monkeypatch.setattr( cache, 'currentScriptPathOnly', str(tmp_path) )
+    monkeypatch.setattr( cache, 'cacheFormat', 'csv' )
+    monkeypatch.setattr( cache, 'cacheFileExtension', '.csv' )
+    return cache.RegisteredModel( cache.inputModelPathOnly, 'ja', 'en' )
+
+
+def createRegistry(server, registeredModels):
+    async def create():
+        return server.ModelRegistry(registeredModels, 0)
+    return asyncio.run( create() )
+
+
+def testCsvCachesOfRegisteredModelsAreCompacted(cache, registeredModel):
+    registry=createRegistry(cache, [ registeredModel ])
+    registeredModel.openCache()
+    registeredModel.addToCache( [ 'a', 'b' ], [ 'A', 'B' ] )
+    registry.writeOutCaches()
+    registeredModel.addToCache( [ 'a' ], [ 'A2' ] )
+    registry.writeOutCaches()
+    assert len( list( cache.readCsvCacheFile(registeredModel.cacheStore.fileNameAndPath) ) ) == 3
+
+    registry.writeOutCaches(compact=True)
+    assert sorted( cache.readCsvCacheFile(registeredModel.cacheStore.fileNameAndPath) ) == [ ( 'a', 'A2' ), ( 'b', 'B' ) ]
+    assert registeredModel.cacheWrittenSinceCompaction == False
+
+
+def testRegisteredModelsUseTheirOwnCacheDictionary(cache, registeredModel):
+    registeredModel.openCache()
+    registeredModel.addToCache( [ 'a' ], [ 'A' ] )
+    assert registeredModel.cacheStore.count() == 1
+    assert len(cache.translationCacheDictionary) == 0
+
+
+def testLoadedModelsDoNotWaitForLoadLock(cache, registeredModel, monkeypatch):
+    monkeypatch.setattr( cache, 'cacheEnabled', False )
+    loadedModel=registeredModel
+    loadedModel.translator=object()
+
+    async def acquireWhileAnotherModelLoads():
+        registry=cache.ModelRegistry( [ loadedModel ], 0 )
+        async with registry.loadLock:
+            await asyncio.wait_for( registry.acquire(loadedModel), 5 )
+
+    asyncio.run( acquireWhileAnotherModelLoads() )
+    assert loadedModel.inUse == 1
+
+
+# Registered models go through their own translationScheduler and the tokenizer pipeline, so concurrent requests are merged and show up in serverMetrics and in their cache statistics.
+def testRegisteredModelsUseTheirOwnScheduler(cache, registeredModel, monkeypatch):
+    monkeypatch.setattr( cache, 'cacheEnabled', True )
+    monkeypatch.setattr( cache, 'batchWindow', 0.05 )
+    monkeypatch.setattr( cache, 'serverMetrics', cache.ServerMetrics() )
+    batches=[]
+
+    def echoTranslate(tokenizedList):
+        batches.append( len(tokenizedList) )
+        return [ types.SimpleNamespace( hypotheses=[ i ] ) for i in tokenizedList ]
+
+    registeredModel.openCache()
+    registeredModel.translator=object()
+    registeredModel.sourceLanguageProcessor=cache.sourceLanguageProcessor
+    registeredModel.targetLanguageProcessor=cache.targetLanguageProcessor
+    registeredModel.translateTokenized=echoTranslate
+
+    async def translateConcurrently():
+        registry=cache.ModelRegistry( [ registeredModel ], 0 )
+        return await asyncio.gather( registry.translate( registeredModel, [ 'line 1', 'line 2', 'line 1' ] ), registry.translate( registeredModel, [ 'line 2', 'line 3' ] ) )
+
+    assert asyncio.run( translateConcurrently() ) == [ [ 'line 1', 'line 2', 'line 1' ], [ 'line 2', 'line 3' ] ]
+    assert batches == [ 3 ]
+    assert cache.serverMetrics.entriesTranslated == 3
+    assert registeredModel.inUse == 0
+    statistics=registeredModel.cacheDictionary.statistics()
+    assert ( statistics['hits'], statistics['misses'], statistics['entries'] ) == ( 0, 5, 3 )
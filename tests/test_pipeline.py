@@ -0,0 +1,76 @@
+import asyncio
+import threading
+import time
+import types
+
+import pytest
+
+
+def testBucketsRespectTokenBudget(server, monkeypatch):
+    monkeypatch.setattr( server, 'tokenBudget', 5 )
+    tokenizedList=[ [ 't' ] * length for length in [ 4, 1, 3, 2, 6 ] ]
+    buckets=server.bucketTokenizedEntries(tokenizedList)
+    # Sorted by length, and an entry that is over the budget on its own still gets a bucket.
+    assert buckets == [ [ 1, 3 ], [ 2 ], [ 0 ], [ 4 ] ]
+    assert sorted( i for bucket in buckets for i in bucket ) == list( range( len(tokenizedList) ) )
+
+
+def testBucketsWithoutTokenBudgetUsePipelineChunkSize(server, monkeypatch):
+    monkeypatch.setattr( server, 'tokenBudget', 0 )
+    monkeypatch.setattr( server, 'defaultPipelineChunkSize', 2 )
+    buckets=server.bucketTokenizedEntries( [ [ 't' ] * length for length in [ 3, 1, 2 ] ] )
+    assert buckets == [ [ 1, 2 ], [ 0 ] ]
+
+
+# translateWithEngine() with --preloadModel and CTranslate2, but with a translator that returns its input, so every entry should come back as it went in.
+@pytest.fixture
+def pipeline(server, monkeypatch):
+    events=[]
+    eventsLock=threading.Lock()
+    tokenizeEntries=server.tokenizeEntries
+
+    def slowTokenizeEntries(processor, textList):
+        time.sleep(0.2)
+        with eventsLock:
+            events.append('tokenize end')
+        return tokenizeEntries(processor, textList)
+
+    def echoTranslate(tokenizedList):
+        with eventsLock:
+            events.append('translate start')
+        return [ types.SimpleNamespace( hypotheses=[ i ] ) for i in tokenizedList ]
+
+    monkeypatch.setattr( server, 'preloadModel', True )
+    monkeypatch.setattr( server, 'tokenBudget', 0 )
+    monkeypatch.setattr( server, 'defaultPipelineChunkSize', 2 )
+    monkeypatch.setattr( server, 'tokenizeEntries', slowTokenizeEntries )
+    monkeypatch.setattr( server, 'preloadModelTranslate', echoTranslate )
+    return events
+
+
+def testPipelineKeepsOrderAndOverlapsTokenizing(server, pipeline, monkeypatch):
+    translateMe=[ 'This is line number 10 of a small corpus.', 'line 1', 'This is line 2.', 'of the tests' ]
+
+    async def translate():
+        monkeypatch.setattr( server, 'inferenceExecutor', server.InferenceExecutor(1, 0) )
+        return await server.translateWithEngine(translateMe)
+
+    postTranslatedList, tokensIn, tokensOut = asyncio.run( translate() )
+    assert postTranslatedList == translateMe
+    assert tokensIn == tokensOut == sum( len(i) for i in server.sourceLanguageProcessor.encode(translateMe) )
+    # Two chunks of two entries. The first chunk is translated while the second one is still being tokenized.
+    assert pipeline == [ 'tokenize end', 'translate start', 'tokenize end', 'translate start' ]
+
+
+def testTranslateTokenizedBatchUsesTheBeamSizeItIsGiven(server, monkeypatch):
+    beamSizes=[]
+
+    class RecordingTranslator:
+        def translate_batch(self, source, **options):
+            beamSizes.append( options['beam_size'] )
+            return [ types.SimpleNamespace( hypotheses=[ i ] ) for i in source ]
+
+    monkeypatch.setattr( server, 'tokenBudget', 0 )
+    server.translateTokenizedBatch( RecordingTranslator(), [ [ 'a' ], [ 'b' ] ], 3 )
+    server.translateTokenizedBatch( RecordingTranslator(), [ [ 'a' ], [ 'b' ] ] )
+    assert beamSizes == [ 3, server.beam_size ]
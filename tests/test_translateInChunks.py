@@ -0,0 +1,41 @@
+import asyncio
+
+
+# Stands in for translationScheduler and records every chunk it is given.
+class RecordingScheduler:
+    def __init__(self):
+        self.chunks=[]
+
+    async def translate(self, translateMe):
+        self.chunks.append( list(translateMe) )
+        return [ i.upper() for i in translateMe ]
+
+
+def translateInChunks(server, rawInput, chunkSize, lookUpCacheFirst):
+    async def collect():
+        return [ chunkResults async for chunkResults in server.translateInChunks(rawInput, chunkSize, lookUpCacheFirst=lookUpCacheFirst) ]
+    return asyncio.run( collect() )
+
+
+def testCacheHitsAreYieldedBeforeAnythingIsTranslated(cache, monkeypatch):
+    scheduler=RecordingScheduler()
+    monkeypatch.setattr( cache, 'cacheEnabled', True )
+    monkeypatch.setattr( cache, 'cacheStore', cache.CsvCacheStore( cache.cacheFilePathOnly + '/cache.csv', 'testModel' ) )
+    monkeypatch.setattr( cache, 'translationScheduler', scheduler )
+    cache.translationCacheDictionary.update( { 'c': 'cached c', 'e': 'cached e' } )
+
+    results=translateInChunks( cache, [ 'a', 'b', 'c', 'd', 'e', 'a' ], 2, True )
+    assert results[0] == [ [ 2, 'cached c' ], [ 4, 'cached e' ] ]
+    assert scheduler.chunks == [ [ 'a', 'b' ], [ 'd' ] ]
+    assert sorted( entry for chunkResults in results for entry in chunkResults ) == [ [ 0, 'A' ], [ 1, 'B' ], [ 2, 'cached c' ], [ 3, 'D' ], [ 4, 'cached e' ], [ 5, 'A' ] ]
+
+
+def testCacheIsLookedUpPerChunkByDefault(cache, monkeypatch):
+    scheduler=RecordingScheduler()
+    monkeypatch.setattr( cache, 'cacheEnabled', True )
+    monkeypatch.setattr( cache, 'cacheStore', cache.CsvCacheStore( cache.cacheFilePathOnly + '/cache.csv', 'testModel' ) )
+    monkeypatch.setattr( cache, 'translationScheduler', scheduler )
+    cache.translationCacheDictionary.update( { 'c': 'cached c' } )
+
+    results=translateInChunks( cache, [ 'a', 'b', 'c', 'd' ], 2, False )
+    assert results == [ [ [ 0, 'A' ], [ 1, 'B' ] ], [ [ 2, 'cached c' ] ], [ [ 3, 'D' ] ] ]
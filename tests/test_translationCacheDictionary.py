@@ -0,0 +1,89 @@
+import pytest
+
+
+@pytest.fixture
+def TranslationCacheDictionary(server):
+    return server.TranslationCacheDictionary
+
+
+def testUnboundedDictionaryNeverEvicts(TranslationCacheDictionary):
+    cacheDictionary=TranslationCacheDictionary()
+    for i in range(1000):
+        cacheDictionary[ str(i) ]=str(i)
+    assert len(cacheDictionary) == 1000
+    assert cacheDictionary.evictions == 0
+    assert cacheDictionary.isBounded() == False
+
+
+def testLruEvictsLeastRecentlyUsed(TranslationCacheDictionary):
+    cacheDictionary=TranslationCacheDictionary(maxEntries=2)
+    cacheDictionary['a']='A'
+    cacheDictionary['b']='B'
+    # Reading 'a' makes 'b' the least recently used entry.
+    assert cacheDictionary['a'] == 'A'
+    cacheDictionary['c']='C'
+    assert 'a' in cacheDictionary
+    assert 'b' not in cacheDictionary
+    assert 'c' in cacheDictionary
+    assert cacheDictionary.evictions == 1
+
+
+def testLfuEvictsFewestHits(TranslationCacheDictionary):
+    cacheDictionary=TranslationCacheDictionary(maxEntries=3, evictionPolicy='lfu')
+    cacheDictionary['a']='A'
+    cacheDictionary['b']='B'
+    cacheDictionary['c']='C'
+    for counter in range(5):
+        cacheDictionary['a']
+    cacheDictionary['c']
+    # 'b' has no hits, so it goes first even though 'a' was used longer ago than 'c'.
+    cacheDictionary['d']='D'
+    assert 'b' not in cacheDictionary
+    assert sorted( rawText for rawText, translatedText in cacheDictionary.items() ) == [ 'a', 'c', 'd' ]
+
+
+def testMemoryLimit(TranslationCacheDictionary):
+    cacheDictionary=TranslationCacheDictionary()
+    cacheDictionary['x']='X'
+    entrySize=cacheDictionary.memoryUsed
+    cacheDictionary=TranslationCacheDictionary(maxMemory=3 * entrySize)
+    for rawText in [ 'a', 'b', 'c', 'd', 'e' ]:
+        cacheDictionary[rawText]=rawText.upper()
+    assert len(cacheDictionary) == 3
+    assert cacheDictionary.memoryUsed <= 3 * entrySize
+    assert cacheDictionary.evictions == 2
+
+
+def testReplacingAnEntryKeepsMemoryUsedAccurate(TranslationCacheDictionary):
+    cacheDictionary=TranslationCacheDictionary()
+    cacheDictionary['a']='short'
+    cacheDictionary['a']='a much longer translation'
+    cacheDictionary['b']='B'
+    expectedMemory=cacheDictionary.estimateMemory('a', 'a much longer translation') + cacheDictionary.estimateMemory('b', 'B')
+    assert cacheDictionary.memoryUsed == expectedMemory
+    cacheDictionary.clear()
+    assert cacheDictionary.memoryUsed == 0
+    assert len(cacheDictionary) == 0
+
+
+def testItemsAndCopyDoNotCountAsUse(TranslationCacheDictionary):
+    cacheDictionary=TranslationCacheDictionary(maxEntries=2)
+    cacheDictionary['a']='A'
+    cacheDictionary['b']='B'
+    assert cacheDictionary.copy() == { 'a': 'A', 'b': 'B' }
+    assert list( cacheDictionary.items() ) == [ ( 'a', 'A' ), ( 'b', 'B' ) ]
+    cacheDictionary['c']='C'
+    assert 'a' not in cacheDictionary
+
+
+def testStatistics(TranslationCacheDictionary):
+    cacheDictionary=TranslationCacheDictionary(maxEntries=1)
+    cacheDictionary['a']='A'
+    cacheDictionary['b']='B'
+    cacheDictionary.recordLookups(3, 1)
+    statistics=cacheDictionary.statistics()
+    assert statistics['entries'] == 1
+    assert statistics['hits'] == 3
+    assert statistics['misses'] == 1
+    assert statistics['hitRatio'] == 0.75
+    assert statistics['evictions'] == 1
@@ -0,0 +1,27 @@
+import asyncio
+import types
+
+
+# A worker that failed to stop must not end stopIdleWorkers(), or no other idle worker would ever be stopped again.
+def testStopIdleWorkersKeepsGoingAfterAnError(server):
+    stopped=[]
+
+    def failToStop():
+        raise OSError('stop failed')
+
+    def createWorker(slot, stop):
+        return types.SimpleNamespace( slot=slot, process=types.SimpleNamespace( pid=slot ), timeLastUsed=0, stop=stop )
+
+    async def stopIdleWorkers():
+        pool=server.WarmWorkerPool(2, 0, 0, idleTimeout=0.01)
+        pool.freeSlots=[]
+        pool.idleWorkers=[ createWorker(0, failToStop), createWorker(1, lambda: stopped.append(1)) ]
+        pool.start()
+        await asyncio.sleep(1.5)
+        pool.shutdown()
+        return pool
+
+    pool=asyncio.run( stopIdleWorkers() )
+    assert stopped == [ 1 ]
+    assert sorted(pool.freeSlots) == [ 0, 1 ]
+    assert pool.idleWorkers == []